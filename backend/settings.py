@@ -18,6 +18,7 @@ from decouple import config, Csv
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 import os
+import tempfile
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
 
@@ -30,23 +31,29 @@ STRIPE_WEBHOOK_SECRET = config("STRIPE_WEBHOOK_SECRET")
 STRIPE_CURRENCY = 'INR'  # ← YOU'RE MISSING THIS ONE
 
 stripe.api_key = STRIPE_SECRET_KEY
+
+# Async Stripe client used by the payment views (shop/stripe_client.py)
+STRIPE_API_BASE = config("STRIPE_API_BASE", default="https://api.stripe.com")
+STRIPE_CONNECT_TIMEOUT = config("STRIPE_CONNECT_TIMEOUT", default=3.0, cast=float)  # seconds
+STRIPE_READ_TIMEOUT = config("STRIPE_READ_TIMEOUT", default=10.0, cast=float)
+STRIPE_MAX_CONNECTIONS = config("STRIPE_MAX_CONNECTIONS", default=50, cast=int)  # pooled per worker
+STRIPE_MAX_CONCURRENCY = config("STRIPE_MAX_CONCURRENCY", default=200, cast=int)  # in-flight calls per worker
+STRIPE_QUEUE_TIMEOUT = config("STRIPE_QUEUE_TIMEOUT", default=5.0, cast=float)  # wait for a free slot
+STRIPE_MAX_NETWORK_RETRIES = config("STRIPE_MAX_NETWORK_RETRIES", default=1, cast=int)
+
+# Payment gateway used by the views and shop/utils.py (shop/gateways.py).
+# Set to shop.gateways.FakeGateway to run checkout offline, e.g. for load tests.
+PAYMENT_GATEWAY = config("PAYMENT_GATEWAY", default="shop.gateways.StripeGateway")
+FAKE_GATEWAY_LATENCY = config("FAKE_GATEWAY_LATENCY", default=0.3, cast=float)  # seconds per call
+FAKE_GATEWAY_ERROR_RATE = config("FAKE_GATEWAY_ERROR_RATE", default=0.0, cast=float)  # API errors
+FAKE_GATEWAY_DECLINE_RATE = config("FAKE_GATEWAY_DECLINE_RATE", default=0.05, cast=float)  # failed payments
+FAKE_GATEWAY_WEBHOOK_URL = config("FAKE_GATEWAY_WEBHOOK_URL", default="")  # e.g. http://127.0.0.1:8000/payments/webhook/
+FAKE_GATEWAY_WEBHOOK_DELAY = config("FAKE_GATEWAY_WEBHOOK_DELAY", default=1.0, cast=float)
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config("DEBUG", default=False, cast=bool)
 
 ALLOWED_HOSTS = config("ALLOWED_HOSTS", default="127.0.0.1", cast=Csv())
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.postgresql",
-        "NAME": config("DB_NAME"),
-        "USER": config("DB_USER"),
-        "PASSWORD": config("DB_PASSWORD"),
-        "HOST": config("DB_HOST", default="localhost"),
-        "PORT": config("DB_PORT", default="5432"),
-    }
-}
-
-
 # Application definition
 
 INSTALLED_APPS = [
@@ -74,6 +81,8 @@ AUTH_USER_MODEL = 'shop.User'  # If you're using a custom user model
 
 
 MIDDLEWARE = [
+    'shop.log.RequestIdMiddleware',
+    'shop.metrics.MetricsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'corsheaders.middleware.CorsMiddleware', 
     'django.middleware.security.SecurityMiddleware',
@@ -83,6 +92,9 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shop.db_router.ReplicaRoutingMiddleware',
+    'shop.profiling.ProfilingMiddleware',
+    'shop.nplusone.NPlusOneMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -117,9 +129,52 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST', default='localhost'),
         'PORT': config('DB_PORT', default='5432'),
+        # Keep connections between requests instead of paying TCP + TLS +
+        # auth on each one; health checks replace a connection that died
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=600, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'sslmode': config('DB_SSLMODE', default='prefer'),
+            # Applies to every statement, so no request can hold a
+            # connection (and its locks) for longer
+            'options': f"-c statement_timeout={config('DB_STATEMENT_TIMEOUT_MS', default=30000, cast=int)}",
+        },
     }
 }
 
+# psycopg 3 connection pool, per process: with gunicorn, workers x
+# DB_POOL_MAX_SIZE must stay under Postgres' max_connections. Django needs
+# CONN_MAX_AGE = 0 with a pool; connections go back to the pool instead.
+if config('DB_POOL', default=False, cast=bool):
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+        'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),  # wait for a free connection
+    }
+
+# Read replicas (shop/db_router.py): catalog reads go to them unless the
+# user wrote in the last REPLICA_PIN_SECONDS or the replica lags by more
+# than REPLICA_MAX_LAG seconds. DB_REPLICA_HOSTS is a comma separated list
+# of host[:port]; DB_REPLICA_NAME defaults to DB_NAME (set it to use a
+# second local database as the replica).
+DATABASE_REPLICAS = []
+for i, replica in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+    host, _, port = replica.partition(':')
+    DATABASES[f'replica{i}'] = {
+        **DATABASES['default'],
+        'NAME': config('DB_REPLICA_NAME', default=DATABASES['default']['NAME']),
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{i}')
+
+DATABASE_ROUTERS = ['shop.db_router.ReplicaRouter']
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=10, cast=int)
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=5, cast=float)
+REPLICA_LAG_CHECK_INTERVAL = config('REPLICA_LAG_CHECK_INTERVAL', default=5, cast=float)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -166,7 +221,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # request.user comes from the token claims, no user query per request
+        'shop.authentication.ClaimsJWTAuthentication',
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
@@ -178,8 +234,30 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,  # default items per page
+    # Throttles of the account endpoints (shop/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': config('THROTTLE_LOGIN_IP', default='30/min'),
+        'login_username': config('THROTTLE_LOGIN_USERNAME', default='10/hour'),  # failed attempts
+        'register_ip': config('THROTTLE_REGISTER_IP', default='20/hour'),
+        'register_email': config('THROTTLE_REGISTER_EMAIL', default='5/hour'),
+        'password_reset_ip': config('THROTTLE_PASSWORD_RESET_IP', default='20/hour'),
+        'password_reset_email': config('THROTTLE_PASSWORD_RESET_EMAIL', default='5/hour'),
+    },
+    # Proxies in front of the app; client IPs are read from X-Forwarded-For
+    # accordingly. Unset trusts the whole header, which clients can forge.
+    'NUM_PROXIES': config('NUM_PROXIES', default=None, cast=lambda v: int(v) if v not in (None, '') else None),
 }
 
+# Throttle counters and token revocations must be shared by all workers:
+# point REDIS_URL at Redis in production. Without it each process keeps
+# its own in-memory cache.
+REDIS_URL = config("REDIS_URL", default="")
+if REDIS_URL:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": REDIS_URL}}
+# Worker processes (gunicorn and uvicorn read the same variable); with more
+# than one, a system check requires the shared cache
+WEB_CONCURRENCY = config("WEB_CONCURRENCY", cast=int, default=1)
+
 
 from datetime import timedelta
 
@@ -189,10 +267,27 @@ SIMPLE_JWT = {
     "BLACKLIST_AFTER_ROTATION": False,
     "AUTH_HEADER_TYPES": ("Bearer",),
     "ROTATE_REFRESH_TOKENS": True,
+    # Re-stamps the user claims (shop/authentication.py) on refresh
+    "TOKEN_REFRESH_SERIALIZER": "shop.serializers.ClaimsTokenRefreshSerializer",
 }
 
+# Per-process cache of full users behind ClaimsJWTAuthentication, for the
+# fields that aren't in the token. Token revocations on password change,
+# deactivation or staff changes reach every worker only with the shared
+# cache (REDIS_URL).
+AUTH_USER_CACHE_TTL = config("AUTH_USER_CACHE_TTL", cast=float, default=30)
+AUTH_USER_CACHE_SIZE = config("AUTH_USER_CACHE_SIZE", cast=int, default=10000)
+
+# In-memory Bloom filter of blacklisted refresh tokens (shop/token_store.py):
+# seconds between reads of new blacklist rows, and between full rebuilds
+TOKEN_BLACKLIST_FILTER_REFRESH = config("TOKEN_BLACKLIST_FILTER_REFRESH", cast=float, default=5)
+TOKEN_BLACKLIST_FILTER_REBUILD = config("TOKEN_BLACKLIST_FILTER_REBUILD", cast=float, default=3600)
 
-EMAIL_BACKEND = config("EMAIL_BACKEND", default="django.core.mail.backends.smtp.EmailBackend")
+
+# send_mail() only queues the message (shop/mail.py); `manage.py send_queued_email`
+# delivers it through EMAIL_DELIVERY_BACKEND
+EMAIL_BACKEND = config("EMAIL_BACKEND", default="shop.mail.QueuedEmailBackend")
+EMAIL_DELIVERY_BACKEND = config("EMAIL_DELIVERY_BACKEND", default="django.core.mail.backends.smtp.EmailBackend")
 EMAIL_HOST = config("EMAIL_HOST", default="smtp.gmail.com")
 EMAIL_PORT = config("EMAIL_PORT", cast=int, default=587)
 EMAIL_USE_TLS = config("EMAIL_USE_TLS", cast=bool, default=True)
@@ -203,6 +298,9 @@ EMAIL_HOST_PASSWORD = config("EMAIL_HOST_PASSWORD")
 
 FRONTEND_URL = config("FRONTEND_URL", default="http://localhost:5173")
 
+# Where `manage.py export_columnar` writes the memory-mapped order history
+COLUMNAR_DATA_DIR = config("COLUMNAR_DATA_DIR", default=str(BASE_DIR / "columnar"))
+
 
 
 from decouple import config, Csv
@@ -240,34 +338,99 @@ DEFAULT_FILE_STORAGE = "cloudinary_storage.storage.MediaCloudinaryStorage"
 
 
 
+# Per-request timings (shop.metrics): Server-Timing response header and the
+# Prometheus /metrics endpoint, which needs "Authorization: Bearer
+# <METRICS_TOKEN>" (or DEBUG). The header tells any client the query count
+# and backend timings, so it's off unless DEBUG or SERVER_TIMING=True. With
+# several workers, METRICS_DIR is a directory shared by them where each one
+# leaves its totals.
+SERVER_TIMING = config('SERVER_TIMING', default=DEBUG, cast=bool)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+METRICS_DIR = config('METRICS_DIR', default='')
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5, cast=float)
+
+# On-demand profiling (shop.profiling): staff get a signed token, valid for
+# PROFILE_TOKEN_MAX_AGE seconds, from /admin/profiles/; requests sent with it
+# are profiled. PROFILE_SAMPLE_ROUTES ("order-list-create:100,...") profiles
+# 1 in N requests of those routes. The newest PROFILE_RING_SIZE results are
+# kept in PROFILE_DIR.
+PROFILE_DIR = config('PROFILE_DIR', default=os.path.join(tempfile.gettempdir(), 'shop-profiles'))
+PROFILE_RING_SIZE = config('PROFILE_RING_SIZE', default=100, cast=int)
+PROFILE_TOKEN_MAX_AGE = config('PROFILE_TOKEN_MAX_AGE', default=3600, cast=int)
+PROFILE_SAMPLE_ROUTES = {
+    route: int(every)
+    for route, every in (item.rsplit(':', 1) for item in config('PROFILE_SAMPLE_ROUTES', default='', cast=Csv()))
+}
+PROFILE_SAMPLE_MODE = config('PROFILE_SAMPLE_MODE', default='cprofile')
+PROFILE_SAMPLE_INTERVAL_MS = config('PROFILE_SAMPLE_INTERVAL_MS', default=5, cast=float)
+PROFILE_TOP_FUNCTIONS = config('PROFILE_TOP_FUNCTIONS', default=60, cast=int)
+
+# N+1 detection (shop.nplusone): requests running one query shape
+# NPLUSONE_THRESHOLD times or more are logged with the serializer field
+# responsible; NPLUSONE_RAISE makes them fail instead (tests).
+NPLUSONE_DETECT = config('NPLUSONE_DETECT', default=DEBUG, cast=bool)
+NPLUSONE_THRESHOLD = config('NPLUSONE_THRESHOLD', default=3, cast=int)
+NPLUSONE_RAISE = config('NPLUSONE_RAISE', default=False, cast=bool)
+
 # settings.py - Add logging configuration
+# Records go through a queue to a background thread (shop.log), which writes
+# plain text to the console and JSON lines to LOG_FILE, rotated at
+# LOG_MAX_BYTES (set LOG_FILE empty for console only, e.g. with several
+# workers, which would each rotate the same file). DEBUG lines are kept for
+# LOG_DEBUG_SAMPLE_RATE of requests.
+LOG_FILE = config('LOG_FILE', default='debug.log')
+LOG_TARGETS = ['cfg://handlers.console'] + (['cfg://handlers.file'] if LOG_FILE else [])
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'request_id': {'()': 'shop.log.RequestIdFilter'},
+        'sample_debug': {
+            '()': 'shop.log.SampleDebugFilter',
+            'rate': config('LOG_DEBUG_SAMPLE_RATE', default=0.05, cast=float),
+        },
+    },
+    'formatters': {
+        'console': {'format': '%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s'},
+        'json': {'()': 'shop.log.JSONFormatter'},
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
+            'formatter': 'console',
         },
         'file': {
             'level': 'DEBUG',
-            'class': 'logging.FileHandler',
-            'filename': 'debug.log',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': LOG_FILE or 'debug.log',
+            'maxBytes': config('LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int),
+            'backupCount': config('LOG_BACKUP_COUNT', default=5, cast=int),
+            'encoding': 'utf-8',
+            'delay': True,
+            'formatter': 'json',
+        },
+        'queue': {
+            'class': 'shop.log.BackgroundHandler',
+            'targets': LOG_TARGETS,
+            'maxsize': config('LOG_QUEUE_SIZE', default=10000, cast=int),
+            'filters': ['request_id', 'sample_debug'],
         },
     },
     'root': {
-        'handlers': ['console', 'file'],
+        'handlers': ['queue'],
         'level': 'INFO',
     },
     'loggers': {
         'django': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': False,
         },
         'shop': {  # Your app name
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],
             'level': 'DEBUG',
             'propagate': False,
         },
     },
-}
\ No newline at end of file
+}
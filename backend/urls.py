@@ -18,9 +18,13 @@ from django.contrib import admin
 from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
+from shop.admin import profile_detail_view, profile_list_view
 
 
 urlpatterns = [
+    # Request profiles (shop.profiling) live under the admin, ahead of its catch-all
+    path('admin/profiles/', admin.site.admin_view(profile_list_view), name='shop_profiles'),
+    path('admin/profiles/<str:profile_id>/', admin.site.admin_view(profile_detail_view), name='shop_profile'),
     path('admin/', admin.site.urls),
     path('',include('shop.urls')),
     path("api/auth/", include("djoser.urls")),      # registration, user management, activation, reset password
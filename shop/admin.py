@@ -1,27 +1,249 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import User, Category, Product, Cart, Order, OrderItem, Payment,Review
+from django.contrib import messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+from .models import User, Category, Product, Cart, Order, OrderItem, Payment,Review, OrderStatusHistory, OutboxEvent, WebhookEvent, SavedPaymentMethod, QueuedEmail
+from .serializers import refresh_order_snapshot
+from .order_status import transition_orders
+from . import profiling
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Use PostgreSQL's row estimate instead of COUNT(*) for unfiltered
+    changelists of big tables. Filtered lists still get an exact count.
+    """
+    estimate_threshold = 100_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return row[0]
+        return super().count
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Defaults for changelists over tables with millions of rows"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # skip the second, unfiltered COUNT(*)
+    list_per_page = 50
+    ordering = ('-pk',)
+
+
+def search_by_id_or(lookups):
+    """
+    get_search_results that matches a numeric term against the primary key
+    and anything else exactly (case-insensitive) against ``lookups``, so
+    searches hit indexes instead of running ILIKE '%term%' over joins.
+    """
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip().lstrip('#')
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        query = Q()
+        for lookup in lookups:
+            query |= Q(**{lookup: term})
+        return queryset.filter(query), False
+    return get_search_results
+
 
 # Inline for OrderItem
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 1  # Number of extra forms to display
+    autocomplete_fields = ('product',)  # don't render the whole catalog per row
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+# Read-only status history on the order page
+class OrderStatusHistoryInline(admin.TabularInline):
+    model = OrderStatusHistory
+    extra = 0
+    can_delete = False
+    fields = ('from_status', 'to_status', 'changed_by', 'source', 'changed_at')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('changed_by')
+
+
+def make_status_action(target_status, label):
+    """Admin action moving the selected orders to ``target_status``"""
+    def action(modeladmin, request, queryset):
+        order_ids = list(queryset.values_list('id', flat=True))
+        results = transition_orders(order_ids, target_status, changed_by=request.user, source='admin')
+        updated = [order_id for order_id, result in results.items() if result['outcome'] == 'updated']
+        skipped = [order_id for order_id, result in results.items() if result['outcome'] != 'updated']
+        modeladmin.message_user(request, f"{len(updated)} order(s) marked as {label}.")
+        if skipped:
+            modeladmin.message_user(
+                request,
+                f"{len(skipped)} order(s) skipped (transition not allowed): {', '.join(map(str, skipped[:20]))}",
+                level=messages.WARNING,
+            )
+
+    action.__name__ = f"mark_{target_status}"
+    action.short_description = f"Mark selected orders as {label}"
+    return action
 
 # Order Admin
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ScalableAdmin):
     list_display = ('id', 'user', 'total_price', 'status', 'created_at', 'updated_at')
-    list_editable = ('status',)  # ✅ Makes status editable in the list view
     list_filter = ('status', 'created_at')
-    search_fields = ('user__username', 'id')
-    readonly_fields = ('created_at', 'updated_at')
-    inlines = [OrderItemInline]
+    list_select_related = ('user',)
+    search_fields = ('id', 'user__username', 'user__email')
+    search_help_text = "Order id, or the customer's exact username or email"
+    get_search_results = search_by_id_or(('user__username__iexact', 'user__email__iexact'))
+    autocomplete_fields = ('user',)
+    # ✅ Status only moves through the actions below, which follow the state machine
+    readonly_fields = ('status', 'created_at', 'updated_at')
+    inlines = [OrderItemInline, OrderStatusHistoryInline]
+    actions = [
+        make_status_action(value, label)
+        for value, label in Order.STATUS_CHOICES if Order.allowed_from(value)
+    ]
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Only re-render items if they changed
+        items_changed = any(formset.has_changed() for formset in formsets)
+        refresh_order_snapshot(form.instance, rerender_items=items_changed)
+
+
+@admin.register(User)
+class UserAdmin(ScalableAdmin):
+    list_display = ('id', 'username', 'email', 'is_active', 'is_staff', 'date_joined')
+    list_filter = ('is_active', 'is_staff')
+    # '^' = prefix match, served by the upper(...) text_pattern_ops indexes
+    search_fields = ('^username', '^email')
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'created_at')
+    search_fields = ('^name',)
+
+
+@admin.register(Product)
+class ProductAdmin(ScalableAdmin):
+    list_display = ('id', 'name', 'category', 'price', 'stock', 'updated_at')
+    list_select_related = ('category',)
+    list_filter = ('category',)
+    search_fields = ('^name',)
+    search_help_text = "Product id, or the start of the product name"
+    autocomplete_fields = ('category',)
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+@admin.register(Cart)
+class CartAdmin(ScalableAdmin):
+    list_display = ('id', 'user', 'product', 'quantity', 'added_at')
+    list_select_related = ('user', 'product')
+    autocomplete_fields = ('user', 'product')
+    search_fields = ('user__username',)
+    get_search_results = search_by_id_or(('user__username__iexact', 'user__email__iexact'))
+
+
+@admin.register(Payment)
+class PaymentAdmin(ScalableAdmin):
+    list_display = ('id', 'order', 'payment_method', 'amount', 'status', 'paid_at')
+    list_select_related = ('order__user',)
+    list_filter = ('status', 'payment_method')
+    raw_id_fields = ('order',)
+    search_fields = ('transaction_id',)
+    search_help_text = "Payment id or exact transaction id"
+    get_search_results = search_by_id_or(('transaction_id',))
+
+
+@admin.register(SavedPaymentMethod)
+class SavedPaymentMethodAdmin(ScalableAdmin):
+    list_display = ('id', 'user', 'brand', 'last4', 'exp_month', 'exp_year', 'last_used_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    search_fields = ('stripe_payment_method_id',)
+    get_search_results = search_by_id_or(('stripe_payment_method_id',))
+
+
+@admin.register(Review)
+class ReviewAdmin(ScalableAdmin):
+    list_display = ('id', 'user', 'product', 'rating', 'created_at')
+    list_select_related = ('user', 'product')
+    list_filter = ('rating',)
+    autocomplete_fields = ('user', 'product')
+    search_fields = ('user__username',)
+    get_search_results = search_by_id_or(('user__username__iexact', 'product__name__iexact'))
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(ScalableAdmin):
+    list_display = ('id', 'event_type', 'created_at', 'processed_at', 'attempts')
+    list_filter = ('event_type',)
+    readonly_fields = ('event_type', 'payload', 'created_at', 'processed_at', 'attempts', 'last_error')
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(ScalableAdmin):
+    list_display = ('id', 'event_id', 'event_type', 'received_at', 'processed_at', 'attempts')
+    list_filter = ('event_type',)
+    search_fields = ('event_id',)
+    search_help_text = "Exact Stripe event id"
+    get_search_results = search_by_id_or(('event_id',))
+    readonly_fields = ('event_id', 'event_type', 'payload', 'received_at', 'processed_at', 'attempts', 'last_error')
+
+
+@admin.register(QueuedEmail)
+class QueuedEmailAdmin(ScalableAdmin):
+    list_display = ('id', 'subject', 'created_at', 'sent_at', 'attempts')
+    readonly_fields = ('subject', 'body', 'from_email', 'to', 'cc', 'bcc', 'reply_to', 'headers',
+                       'alternatives', 'created_at', 'available_at', 'sent_at', 'attempts', 'last_error')
+
+
+# Request profiles (shop.profiling): not a model, so plain admin views
+def profile_list_view(request):
+    context = {
+        **admin.site.each_context(request),
+        "title": "Request profiles",
+        "profiles": profiling.list_profiles(),
+        "token": profiling.issue_token(request.user),
+        "token_max_age": settings.PROFILE_TOKEN_MAX_AGE,
+    }
+    return TemplateResponse(request, "admin/shop/profiles.html", context)
 
-# Optional: register other models
-admin.site.register(User)
-admin.site.register(Category)
-admin.site.register(Product)
-admin.site.register(Cart)
-admin.site.register(Payment)
 
+def profile_detail_view(request, profile_id):
+    result = profiling.load(profile_id)
+    if result is None:
+        raise Http404("Profile not found (it may have been rotated out)")
+    context = {
+        **admin.site.each_context(request),
+        "title": f"{result['method']} {result['path']}",
+        "result": result,
+        "slow_queries": sorted(result["queries"], key=lambda query: query["ms"], reverse=True)[:10],
+    }
+    return TemplateResponse(request, "admin/shop/profile_detail.html", context)
 
-admin.site.register(Review)
\ No newline at end of file
@@ -0,0 +1,218 @@
+# analytics.py - Incremental sales rollups for the dashboard API
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncDay, TruncHour
+from django.utils import timezone
+
+from .models import Category, Order, OrderItem, SalesRollup, SyncWatermark
+
+WATERMARK = "sales_rollups"
+
+# Re-read a little before the watermark so orders committed late with an
+# earlier updated_at are not missed. Rebuilding a bucket is idempotent.
+OVERLAP = timedelta(minutes=5)
+
+# Cancelled orders don't count as sales
+EXCLUDED_STATUSES = ("cancelled",)
+
+DIMENSIONS = ("category", "state", "payment_method")
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def _line_items(start, end):
+    return OrderItem.objects.filter(
+        order__created_at__gte=start, order__created_at__lt=end,
+    ).exclude(order__status__in=EXCLUDED_STATUSES)
+
+
+def _aggregate_hours(start, end, by_category):
+    group_by = ["period", "state_key", "payment_method_key"]
+    if by_category:
+        group_by.append("category_key")
+    return (
+        _line_items(start, end)
+        .annotate(
+            period=TruncHour("order__created_at"),
+            state_key=Coalesce("order__shipping_state", F("order__user__state")),
+            payment_method_key=F("order__payment_method"),
+            category_key=F("product__category_id"),
+        )
+        .values(*group_by)
+        .annotate(
+            revenue_sum=Sum(F("price") * F("quantity")),
+            units_sum=Sum("quantity"),
+            order_count=Count("order_id", distinct=True),
+        )
+        .order_by()
+    )
+
+
+def rebuild_hours(start, end):
+    """Recompute the hourly rollups for ``[start, end)`` from the orders"""
+    rows = []
+    for level, by_category in (("order", False), ("category", True)):
+        for bucket in _aggregate_hours(start, end, by_category):
+            rows.append(SalesRollup(
+                granularity="hour",
+                level=level,
+                period_start=bucket["period"],
+                category_id=bucket.get("category_key") or 0,
+                state=bucket["state_key"] or "",
+                payment_method=bucket["payment_method_key"] or "",
+                revenue=bucket["revenue_sum"] or 0,
+                orders=bucket["order_count"],
+                units=bucket["units_sum"] or 0,
+            ))
+
+    with transaction.atomic():
+        SalesRollup.objects.filter(
+            granularity="hour", period_start__gte=start, period_start__lt=end,
+        ).delete()
+        SalesRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def rebuild_days(start, end):
+    """Recompute the daily rollups for ``[start, end)`` from the hourly ones"""
+    buckets = (
+        SalesRollup.objects.filter(granularity="hour", period_start__gte=start, period_start__lt=end)
+        .annotate(day=TruncDay("period_start"))
+        .values("day", "level", "category_id", "state", "payment_method")
+        .annotate(revenue_sum=Sum("revenue"), order_count=Sum("orders"), units_sum=Sum("units"))
+        .order_by()
+    )
+    rows = [
+        SalesRollup(
+            granularity="day",
+            level=bucket["level"],
+            period_start=bucket["day"],
+            category_id=bucket["category_id"],
+            state=bucket["state"],
+            payment_method=bucket["payment_method"],
+            revenue=bucket["revenue_sum"],
+            orders=bucket["order_count"],
+            units=bucket["units_sum"],
+        )
+        for bucket in buckets
+    ]
+    with transaction.atomic():
+        SalesRollup.objects.filter(
+            granularity="day", period_start__gte=start, period_start__lt=end,
+        ).delete()
+        SalesRollup.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def _ranges(starts, step):
+    """Merge sorted bucket starts into contiguous ``(start, end)`` ranges"""
+    ranges = []
+    for start in sorted(starts):
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = start + step
+        else:
+            ranges.append([start, start + step])
+    return [tuple(r) for r in ranges]
+
+
+def _floor_day(value):
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rebuild_range(start, end):
+    """Rebuild hour and day rollups for every day touching ``[start, end)``"""
+    start, end = _floor_day(start), _floor_day(end - timedelta(microseconds=1)) + DAY
+    day = start
+    while day < end:
+        rebuild_hours(day, day + DAY)
+        rebuild_days(day, day + DAY)
+        day += DAY
+
+
+def update_rollups(now=None):
+    """
+    Bring the rollups up to date with orders created or changed since the
+    last run, using ``Order.updated_at`` as the watermark.
+
+    Only the hour buckets the changed orders were created in are rebuilt,
+    followed by the days containing them. Returns the number of buckets rebuilt.
+    """
+    now = now or timezone.now()
+    watermark = SyncWatermark.objects.filter(name=WATERMARK).first()
+
+    changed = Order.objects.filter(updated_at__lte=now)
+    if watermark:
+        changed = changed.filter(updated_at__gt=watermark.value - OVERLAP)
+
+    hours = set(
+        changed.annotate(hour=TruncHour("created_at")).values_list("hour", flat=True).distinct()
+    )
+    for start, end in _ranges(hours, HOUR):
+        rebuild_hours(start, end)
+    for start, end in _ranges({_floor_day(hour) for hour in hours}, DAY):
+        rebuild_days(start, end)
+
+    SyncWatermark.objects.update_or_create(name=WATERMARK, defaults={"value": now})
+    return len(hours)
+
+
+def query_rollups(start, end, granularity="day", group_by=()):
+    """
+    Answer a dashboard query from the rollup tables.
+
+    ``start``/``end`` are dates (both inclusive); ``group_by`` is any of
+    ``DIMENSIONS``. Each row has revenue, orders, units and avg_order_value.
+    """
+    start = timezone.make_aware(datetime.combine(start, time.min))
+    end = timezone.make_aware(datetime.combine(end + DAY, time.min))
+    level = "category" if "category" in group_by else "order"
+    fields = ["period_start"] + [
+        {"category": "category_id"}.get(dimension, dimension) for dimension in group_by
+    ]
+    buckets = (
+        SalesRollup.objects.filter(
+            granularity=granularity, level=level,
+            period_start__gte=start, period_start__lt=end,
+        )
+        .values(*fields)
+        .annotate(revenue_sum=Sum("revenue"), order_count=Sum("orders"), units_sum=Sum("units"))
+        .order_by(*fields)
+    )
+
+    buckets = list(buckets)
+    category_names = {}
+    if "category" in group_by:
+        category_ids = {bucket["category_id"] for bucket in buckets}
+        category_names = dict(Category.objects.filter(id__in=category_ids).values_list("id", "name"))
+
+    results = []
+    for bucket in buckets:
+        row = {"period": bucket["period_start"]}
+        for dimension in group_by:
+            if dimension == "category":
+                row["category_id"] = bucket["category_id"] or None
+                row["category"] = category_names.get(bucket["category_id"], "Uncategorized")
+            else:
+                row[dimension] = bucket[dimension]
+        row.update(_metrics(bucket))
+        results.append(row)
+
+    totals = SalesRollup.objects.filter(
+        granularity=granularity, level="order",
+        period_start__gte=start, period_start__lt=end,
+    ).aggregate(revenue_sum=Sum("revenue"), order_count=Sum("orders"), units_sum=Sum("units"))
+    return {"results": results, "totals": _metrics(totals)}
+
+
+def _metrics(bucket):
+    revenue = bucket["revenue_sum"] or 0
+    orders = bucket["order_count"] or 0
+    return {
+        "revenue": revenue,
+        "orders": orders,
+        "units": bucket["units_sum"] or 0,
+        "avg_order_value": round(revenue / orders, 2) if orders else 0,
+    }
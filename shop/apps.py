@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from . import authentication  # noqa: F401  (user cache invalidation signals)
+        from . import metrics
+
+        metrics.install()
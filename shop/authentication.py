@@ -0,0 +1,207 @@
+# authentication.py - JWT authentication without a user query per request
+#
+# Tokens issued by UserLoginSerializer (ClaimsRefreshToken) carry the user's
+# username, is_staff and is_active, so ClaimsJWTAuthentication can rebuild
+# request.user from the token alone. Fields that aren't in the token are
+# loaded on first access from a short-TTL per-process cache of full users.
+#
+# Invalidation: saving a user drops them from this process' cache, and a
+# password change, deactivation or staff/superuser change stores a
+# revocation mark in Django's cache that rejects every token issued before
+# it, so stale is_staff claims don't outlive a demotion. The mark only reaches other
+# processes if CACHES points at a shared backend, so a system check fails
+# when WEB_CONCURRENCY allows several workers (or on check --deploy) and
+# the cache is per process.
+import copy
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.checks import Error, Tags, register
+from django.db import router
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import ClaimsUser, User
+from .token_store import blacklist_filter
+
+USER_CLAIMS = ("username", "is_staff", "is_active")
+# Changing any of these revokes the user's tokens (deactivation only for is_active)
+REVOKING_FIELDS = ("password", "is_active", "is_staff", "is_superuser")
+
+# Cache backends whose entries other processes can't see
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+_users = {}  # user id -> (expires at, User)
+_users_lock = threading.Lock()
+
+
+# ---------- Tokens ----------
+
+def stamp_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """
+    Refresh token carrying USER_CLAIMS; access tokens made from it copy them.
+    Blacklist checks go through the in-memory filter in token_store first.
+    """
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        stamp_claims(token, user)
+        return token
+
+    def check_blacklist(self):
+        # A Bloom filter has no false negatives: "not in it" means not blacklisted
+        if blacklist_filter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        blacklist_filter.add(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+def _revocation_key(user_id):
+    return f"auth:revoked:{user_id}"
+
+
+def revoke_tokens(user_id):
+    """Reject every token of the user issued before now"""
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME)
+    cache.set(_revocation_key(user_id), int(time.time()), timeout=int(lifetime.total_seconds()))
+    forget_user(user_id)
+
+
+def is_revoked(token):
+    revoked_at = cache.get(_revocation_key(token[api_settings.USER_ID_CLAIM]))
+    return revoked_at is not None and token.get("iat", 0) < revoked_at
+
+
+# ---------- User cache ----------
+
+def get_full_user(user_id):
+    """The user with every field loaded, from this process' cache when fresh"""
+    now = time.monotonic()
+    entry = _users.get(user_id)
+    if entry is None or entry[0] <= now:
+        entry = (now + settings.AUTH_USER_CACHE_TTL, User.objects.get(pk=user_id))
+        with _users_lock:
+            if len(_users) >= settings.AUTH_USER_CACHE_SIZE:
+                for key in [key for key, (expires, _user) in _users.items() if expires <= now]:
+                    del _users[key]
+                if len(_users) >= settings.AUTH_USER_CACHE_SIZE:
+                    _users.clear()
+            _users[user_id] = entry
+    # Callers may change the copy; the cached instance stays as loaded
+    return copy.copy(entry[1])
+
+
+aget_full_user = sync_to_async(get_full_user)
+
+
+def _cached_user(user_id):
+    entry = _users.get(user_id)
+    return entry[1] if entry is not None and entry[0] > time.monotonic() else None
+
+
+def forget_user(user_id):
+    _users.pop(user_id, None)
+
+
+@receiver(pre_save, sender=User)
+def _user_saving(sender, instance, raw=False, using=None, update_fields=None, **kwargs):
+    """Flags saves that change the password or staff status, or deactivate the user"""
+    instance._revokes_tokens = False
+    fields = set(REVOKING_FIELDS) if update_fields is None else set(REVOKING_FIELDS) & set(update_fields)
+    if raw or instance._state.adding or not fields:
+        return
+    before = sender._base_manager.using(using).filter(pk=instance.pk).values(*fields).first()
+    if before is None:
+        return
+    changed = {field for field in fields if before[field] != getattr(instance, field)}
+    # A hasher upgrade on login rewrites the hash without set_password()
+    # marking it in _password; that's not a password change
+    if instance._password is None:
+        changed.discard("password")
+    # Reactivated users have no tokens to take back
+    if instance.is_active:
+        changed.discard("is_active")
+    instance._revokes_tokens = bool(changed)
+
+
+@receiver(post_save, sender=User)
+def _user_saved(sender, instance, created, **kwargs):
+    forget_user(instance.pk)
+    if instance.__dict__.pop("_revokes_tokens", False):
+        revoke_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def _user_deleted(sender, instance, **kwargs):
+    revoke_tokens(instance.pk)
+
+
+# ---------- Checks ----------
+
+def _unshared_revocations_error():
+    if settings.CACHES["default"]["BACKEND"] not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [Error(
+        "Token revocations are kept in a per-process cache, so other workers keep "
+        "accepting the tokens of users who changed their password or were deactivated.",
+        hint="Set REDIS_URL (or point CACHES at another shared backend).",
+        id="shop.E001",
+    )]
+
+
+@register(Tags.security, Tags.caches)
+def check_revocation_cache(app_configs, **kwargs):
+    return _unshared_revocations_error() if settings.WEB_CONCURRENCY > 1 else []
+
+
+@register(Tags.security, Tags.caches, deploy=True)
+def check_revocation_cache_deploy(app_configs, **kwargs):
+    # The worker count may be given on the gunicorn command line instead
+    return _unshared_revocations_error()
+
+
+# ---------- Authentication ----------
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that builds request.user (a ClaimsUser) from the token
+    claims instead of querying the users table. Tokens without the claims
+    (issued before they were added) fall back to the usual lookup.
+    """
+
+    def get_user(self, validated_token):
+        if not all(claim in validated_token for claim in USER_CLAIMS):
+            return super().get_user(validated_token)
+
+        # simplejwt stores the id as a string
+        user_id = User._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        if is_revoked(validated_token):
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        cached = _cached_user(user_id)
+        if not validated_token["is_active"] or (cached is not None and not cached.is_active):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        claims = {"id": user_id, **{claim: validated_token[claim] for claim in USER_CLAIMS}}
+        # from_db expects the loaded fields in model order; the rest are deferred
+        fields = [f.attname for f in ClaimsUser._meta.concrete_fields if f.attname in claims]
+        return ClaimsUser.from_db(router.db_for_read(User), fields, [claims[name] for name in fields])
@@ -0,0 +1,284 @@
+# columnar.py - Memory-mapped columnar copy of the order history for ad-hoc analytics
+#
+# `manage.py export_columnar` writes one raw NumPy file per column plus a
+# meta.json (dtypes, row count, string dictionaries). Strings are dictionary
+# encoded, so every column is a fixed width array that can be memory mapped
+# and scanned with vectorized NumPy operations.
+import json
+import os
+import re
+import shutil
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count
+
+from .models import Order, OrderItem
+
+META_FILE = "meta.json"
+
+# name -> (dtype, source lookup or None for derived columns, dictionary encoded)
+COLUMNS = {
+    "order_id": ("int64", "order_id", False),
+    "item_id": ("int64", "id", False),
+    "created_at": ("int64", "order__created_at", False),  # unix seconds
+    "user_id": ("int64", "order__user_id", False),
+    "product_id": ("int64", "product_id", False),
+    "category": ("int32", "product__category__name", True),
+    "state": ("int32", "order__shipping_state", True),
+    "payment_method": ("int32", "order__payment_method", True),
+    "status": ("int32", "order__status", True),
+    "quantity": ("int32", "quantity", False),
+    "price": ("float64", "price", False),
+    "revenue": ("float64", None, False),  # price * quantity
+    "customer_orders": ("int32", None, False),  # orders placed by the customer
+}
+
+# Time buckets usable in group_by, derived from created_at
+TIME_BUCKETS = {"day": 86400, "week": 7 * 86400}
+# 1970-01-01 was a Thursday; shift so weeks start on Monday
+WEEK_OFFSET = 3 * 86400
+
+SCAN_CHUNK = 4_000_000
+
+
+def data_dir():
+    return settings.COLUMNAR_DATA_DIR
+
+
+# ---------------- Export ----------------
+
+def export(path=None, chunk_size=50_000, stdout=None):
+    """
+    Export every order line (joined with order and product) to ``path``.
+
+    Columns are written to a temporary directory which replaces the previous
+    export only once complete, so readers never see a half written store.
+    Returns the number of rows written.
+    """
+    path = str(path or data_dir())
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    customer_orders = dict(
+        Order.objects.values("user_id").annotate(n=Count("id")).values_list("user_id", "n").order_by()
+    )
+    dictionaries = {name: {} for name, (_, _, encoded) in COLUMNS.items() if encoded}
+    sources = [(name, lookup) for name, (_, lookup, _) in COLUMNS.items() if lookup]
+
+    rows = (
+        OrderItem.objects.order_by("order_id", "id")
+        .values_list(*[lookup for _, lookup in sources])
+        .iterator(chunk_size=chunk_size)
+    )
+    files = {name: open(os.path.join(tmp_path, f"{name}.bin"), "wb") for name in COLUMNS}
+    count = 0
+    try:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                _write_batch(batch, sources, dictionaries, customer_orders, files)
+                count += len(batch)
+                batch = []
+                if stdout:
+                    stdout.write(f"  {count} rows")
+        if batch:
+            _write_batch(batch, sources, dictionaries, customer_orders, files)
+            count += len(batch)
+    finally:
+        for f in files.values():
+            f.close()
+
+    meta = {
+        "rows": count,
+        "exported_at": datetime.now(dt_timezone.utc).isoformat(),
+        "columns": {name: dtype for name, (dtype, _, _) in COLUMNS.items()},
+        # code -> value lists, so a code is an index into its dictionary
+        "dictionaries": {
+            name: [value for value, _ in sorted(codes.items(), key=lambda item: item[1])]
+            for name, codes in dictionaries.items()
+        },
+    }
+    with open(os.path.join(tmp_path, META_FILE), "w") as f:
+        json.dump(meta, f)
+
+    old_path = path + ".old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return count
+
+
+def _write_batch(batch, sources, dictionaries, customer_orders, files):
+    values = dict(zip([name for name, _ in sources], zip(*batch)))
+    for name, (dtype, lookup, encoded) in COLUMNS.items():
+        if name == "revenue":
+            column = np.asarray(values["price"], dtype="float64") * np.asarray(values["quantity"], dtype="float64")
+        elif name == "customer_orders":
+            column = np.fromiter((customer_orders.get(user_id, 0) for user_id in values["user_id"]), dtype=dtype)
+        elif name == "created_at":
+            column = np.fromiter((int(value.timestamp()) for value in values[name]), dtype=dtype)
+        elif encoded:
+            codes = dictionaries[name]
+            column = np.fromiter((codes.setdefault(value or "", len(codes)) for value in values[name]), dtype=dtype)
+        else:
+            column = np.asarray(values[name], dtype=dtype)
+        column.astype(dtype, copy=False).tofile(files[name])
+
+
+# ---------------- Query ----------------
+
+FILTER_RE = re.compile(r"^\s*(\w+)\s*(==|!=|>=|<=|=|>|<|\bin\b)\s*(.+?)\s*$")
+
+
+def parse_filter(expression):
+    """Parse ``"state=Goa"``, ``"customer_orders>3"`` or ``"category in A,B"``"""
+    match = FILTER_RE.match(expression)
+    if not match:
+        raise ValueError(f"Invalid filter: {expression}")
+    column, op, value = match.groups()
+    if op == "=":
+        op = "=="
+    if op == "in":
+        value = [part.strip() for part in value.split(",")]
+    return column, op, value
+
+
+class ColumnStore:
+    """Read-only view over an export, with a small vectorized query API"""
+
+    def __init__(self, path=None):
+        self.path = str(path or data_dir())
+        with open(os.path.join(self.path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.rows = self.meta["rows"]
+        self.dictionaries = self.meta["dictionaries"]
+        self._codes = {name: {value: code for code, value in enumerate(values)}
+                       for name, values in self.dictionaries.items()}
+        self._columns = {}
+
+    def column(self, name):
+        if name not in self.meta["columns"]:
+            raise KeyError(f"Unknown column: {name}")
+        if name not in self._columns:
+            if self.rows == 0:
+                self._columns[name] = np.empty(0, dtype=self.meta["columns"][name])
+            else:
+                self._columns[name] = np.memmap(
+                    os.path.join(self.path, f"{name}.bin"),
+                    dtype=self.meta["columns"][name], mode="r", shape=(self.rows,),
+                )
+        return self._columns[name]
+
+    def query(self, filters=(), group_by=(), sums=(), count=True):
+        """
+        Filter, group and aggregate in one pass over the columns.
+
+        ``filters`` are ``(column, op, value)`` tuples (see :func:`parse_filter`),
+        ``group_by`` are column names or ``day``/``week``, ``sums`` are numeric
+        columns. Returns a list of dicts sorted by group key.
+        """
+        for name in list(group_by) + list(sums):
+            if name not in TIME_BUCKETS:
+                self.column(name)  # fail early on unknown columns
+        filters = [self._encode_filter(*f) for f in filters]
+
+        totals = defaultdict(lambda: np.zeros(len(sums) + 1))
+        for start in range(0, self.rows, SCAN_CHUNK):
+            chunk = slice(start, min(start + SCAN_CHUNK, self.rows))
+            mask = self._mask(filters, chunk)
+            if not mask.any():
+                continue
+
+            if not group_by:
+                values = [self.column(name)[chunk][mask].sum() for name in sums]
+                totals[()] += np.array([mask.sum(), *values])
+                continue
+
+            keys = [self._group_values(name, chunk)[mask] for name in group_by]
+            # Combine the key columns into a single group index
+            combined = np.zeros(int(mask.sum()), dtype="int64")
+            uniques = []
+            for key in keys:
+                unique, inverse = np.unique(key, return_inverse=True)
+                combined = combined * len(unique) + inverse
+                uniques.append(unique)
+            groups, group_index = np.unique(combined, return_inverse=True)
+            aggregates = [np.bincount(group_index)] + [
+                np.bincount(group_index, weights=self.column(name)[chunk][mask]) for name in sums
+            ]
+            for position, group in enumerate(groups):
+                key = []
+                for unique in reversed(uniques):
+                    group, code = divmod(int(group), len(unique))
+                    key.append(unique[code].item())
+                totals[tuple(reversed(key))] += np.array([agg[position] for agg in aggregates])
+
+        results = []
+        for key in sorted(totals):
+            values = totals[key]
+            row = {name: self._decode(name, value) for name, value in zip(group_by, key)}
+            if count:
+                row["count"] = int(values[0])
+            for name, value in zip(sums, values[1:]):
+                row[f"sum_{name}"] = round(float(value), 2)
+            results.append(row)
+        return results
+
+    def _encode_filter(self, column, op, value):
+        if column in self._codes:
+            codes = self._codes[column]
+            if op == "in":
+                value = [codes[v] for v in value if v in codes]
+            elif op in ("==", "!="):
+                value = codes.get(value, -1)
+            else:
+                raise ValueError(f"Only =, != and in are supported on {column}")
+        elif op == "in":
+            value = [float(v) for v in value]
+        else:
+            value = float(value)
+        self.column(column)
+        return column, op, value
+
+    def _mask(self, filters, chunk):
+        mask = np.ones(chunk.stop - chunk.start, dtype=bool)
+        for column, op, value in filters:
+            data = self.column(column)[chunk]
+            if op == "in":
+                mask &= np.isin(data, value)
+            elif op == "==":
+                mask &= data == value
+            elif op == "!=":
+                mask &= data != value
+            elif op == ">":
+                mask &= data > value
+            elif op == ">=":
+                mask &= data >= value
+            elif op == "<":
+                mask &= data < value
+            elif op == "<=":
+                mask &= data <= value
+        return mask
+
+    def _group_values(self, name, chunk):
+        if name == "week":
+            return (self.column("created_at")[chunk] + WEEK_OFFSET) // TIME_BUCKETS["week"]
+        if name == "day":
+            return self.column("created_at")[chunk] // TIME_BUCKETS["day"]
+        return self.column(name)[chunk]
+
+    def _decode(self, name, value):
+        if name in self.dictionaries:
+            return self.dictionaries[name][value]
+        if name == "week":
+            return datetime.fromtimestamp(value * TIME_BUCKETS["week"] - WEEK_OFFSET, dt_timezone.utc).date().isoformat()
+        if name == "day":
+            return datetime.fromtimestamp(value * TIME_BUCKETS["day"], dt_timezone.utc).date().isoformat()
+        return value
@@ -0,0 +1,146 @@
+# db_router.py - Read replica routing for catalog reads
+#
+# Everything goes to "default" (the primary) unless a view opts in with
+# ReplicaReadMixin: its GET/HEAD requests then read from a replica listed in
+# DATABASE_REPLICAS. Two things keep them on the primary:
+#
+# * read-your-writes: ReplicaRoutingMiddleware remembers (in the shared
+#   cache) when a user last made a successful write, and that user's reads
+#   stay on the primary for REPLICA_PIN_SECONDS;
+# * lag: each replica's replay lag is checked every REPLICA_LAG_CHECK_INTERVAL
+#   seconds per process, and replicas further behind than REPLICA_MAX_LAG (or
+#   unreachable) are skipped until the next check.
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+_read_from_replica = ContextVar("read_from_replica", default=False)
+
+_health = {}  # alias -> (checked at, usable)
+_health_lock = threading.Lock()
+
+# Replay lag in seconds; 0 when the replica has replayed everything it received
+_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+def _pin_key(user_id):
+    return f"db:pinned:{user_id}"
+
+
+def pin_to_primary(user):
+    cache.set(_pin_key(user.pk), True, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user):
+    return bool(user.is_authenticated and cache.get(_pin_key(user.pk)))
+
+
+def _check(alias):
+    try:
+        connection = connections[alias]
+        with connection.cursor() as cursor:
+            if connection.vendor != "postgresql":
+                cursor.execute("SELECT 1")
+                return True
+            cursor.execute(_LAG_SQL)
+            lag = float(cursor.fetchone()[0] or 0)
+    except Exception as e:
+        logger.warning(f"Replica {alias} unavailable: {e}")
+        return False
+    if lag > settings.REPLICA_MAX_LAG:
+        logger.warning(f"Replica {alias} is {lag:.1f}s behind, reading from the primary")
+        return False
+    return True
+
+
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _usable(alias):
+    now = time.monotonic()
+    checked_at, usable = _health.get(alias, (None, False))
+    if checked_at is None or now - checked_at >= settings.REPLICA_LAG_CHECK_INTERVAL:
+        if _in_event_loop():
+            # The async ORM looks up QuerySet.db on the event loop (aiterator()
+            # does) where queries can't run; keep the last result and let the
+            # query itself, which runs in a thread, do the check
+            return usable
+        with _health_lock:
+            checked_at, usable = _health.get(alias, (None, False))
+            if checked_at is None or now - checked_at >= settings.REPLICA_LAG_CHECK_INTERVAL:
+                usable = _check(alias)
+                _health[alias] = (now, usable)
+    return usable
+
+
+def pick_replica():
+    """A replica that is reachable and caught up, or None"""
+    replicas = [alias for alias in settings.DATABASE_REPLICAS if _usable(alias)]
+    return random.choice(replicas) if replicas else None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _read_from_replica.get():
+            return pick_replica() or DEFAULT_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    """For pure-read catalog views: safe requests read from a replica"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # After authentication, so a user who just wrote reads their write
+        if request.method in SAFE_METHODS and settings.DATABASE_REPLICAS and not is_pinned(request.user):
+            _read_from_replica.set(True)
+
+
+class ReplicaRoutingMiddleware:
+    """Scopes replica reads to one request and pins users after their writes"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _read_from_replica.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_from_replica.reset(token)
+
+        if settings.DATABASE_REPLICAS and request.method not in SAFE_METHODS and response.status_code < 400:
+            user = getattr(request, "user", None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user)
+        return response
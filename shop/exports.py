@@ -0,0 +1,98 @@
+# exports.py - Streaming order exports for accounting
+import csv
+import json
+from datetime import datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import OrderItem
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# One row per order line, joined with its order, customer, product and payment
+EXPORT_COLUMNS = [
+    ("order_id", "order_id"),
+    ("order_created_at", "order__created_at"),
+    ("order_status", "order__status"),
+    ("order_total", "order__total_price"),
+    ("payment_method", "order__payment_method"),
+    ("customer_id", "order__user_id"),
+    ("customer_email", "order__user__email"),
+    ("shipping_state", "order__shipping_state"),
+    ("shipping_district", "order__shipping_district"),
+    ("item_id", "id"),
+    ("product_id", "product_id"),
+    ("product_name", "product__name"),
+    ("quantity", "quantity"),
+    ("unit_price", "price"),
+    ("payment_status", "order__payment__status"),
+    ("payment_amount", "order__payment__amount"),
+    ("transaction_id", "order__payment__transaction_id"),
+    ("paid_at", "order__payment__paid_at"),
+]
+HEADER = [name for name, _ in EXPORT_COLUMNS]
+
+
+class Echo:
+    """File-like object that hands back what is written (for csv.writer)"""
+    def write(self, value):
+        return value
+
+
+def export_rows(start=None, end=None, statuses=None, chunk_size=2000):
+    """
+    Yield export rows as tuples, in ``HEADER`` order.
+
+    A single joined query is streamed with ``.iterator()``, which uses a
+    server-side cursor on PostgreSQL, so memory stays flat however many rows
+    are exported. ``start``/``end`` are inclusive dates.
+    """
+    items = OrderItem.objects.all()
+    if start:
+        items = items.filter(order__created_at__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        items = items.filter(order__created_at__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+    if statuses:
+        items = items.filter(order__status__in=statuses)
+
+    items = items.order_by("order_id", "id").values_list(*[lookup for _, lookup in EXPORT_COLUMNS])
+    return items.iterator(chunk_size=chunk_size)
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_jsonl(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(HEADER, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+def stream_export(rows, export_format, lines_per_chunk=500):
+    """Group lines into larger chunks so the response isn't one write per row"""
+    lines = stream_csv(rows) if export_format == "csv" else stream_jsonl(rows)
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= lines_per_chunk:
+            yield "".join(buffer)
+            buffer = []
+    if buffer:
+        yield "".join(buffer)
+
+
+async def astream_export(rows, export_format, lines_per_chunk=500):
+    """
+    stream_export for ASGI, where Django would read a sync iterator to the end
+    before sending anything. Each chunk is built by the thread that runs sync
+    ORM code, so the server-side cursor stays on one connection.
+    """
+    chunks = stream_export(rows, export_format, lines_per_chunk)
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
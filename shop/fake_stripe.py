@@ -0,0 +1,117 @@
+# fake_stripe.py - Minimal local stand-in for the Stripe PaymentIntent API
+#
+# Used by `manage.py loadtest_stripe` and for trying `reconcile_payments`
+# locally: point STRIPE_API_BASE (or stripe.api_base) at the server's url and
+# every call answers after `latency` seconds.
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        params = dict(parse_qsl(self.rfile.read(length).decode()))
+        if self.path.rstrip("/") != "/v1/payment_intents":
+            return self._send(404, {"error": {"type": "invalid_request_error", "message": "Unknown path"}})
+
+        intent_id = f"pi_fake_{secrets.token_hex(8)}"
+        intent = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(params.get("amount", 0)),
+            "currency": params.get("currency", "usd"),
+            "status": "requires_payment_method",
+            "created": int(time.time()),
+            "client_secret": f"{intent_id}_secret_{secrets.token_hex(8)}",
+            "metadata": {
+                key[len("metadata["):-1]: value
+                for key, value in params.items() if key.startswith("metadata[")
+            },
+        }
+        self.server.intents[intent_id] = intent
+        self._send(200, intent)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") == "/v1/payment_intents":
+            return self._send(200, self._list(dict(parse_qsl(url.query))))
+        prefix = "/v1/payment_intents/"
+        intent = self.server.intents.get(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+        if intent is None:
+            return self._send(404, {"error": {"type": "invalid_request_error", "message": "No such payment_intent"}})
+        self._send(200, dict(intent, status=self.server.intent_status))
+
+    def _list(self, params):
+        """Newest first, filtered on created[gte]/created[lt], paged with starting_after"""
+        intents = sorted(self.server.intents.values(), key=lambda i: i["created"], reverse=True)
+        if "created[gte]" in params:
+            intents = [i for i in intents if i["created"] >= int(params["created[gte]"])]
+        if "created[lt]" in params:
+            intents = [i for i in intents if i["created"] < int(params["created[lt]"])]
+        if params.get("starting_after"):
+            ids = [i["id"] for i in intents]
+            if params["starting_after"] in ids:
+                intents = intents[ids.index(params["starting_after"]) + 1:]
+        limit = int(params.get("limit", 10))
+        return {
+            "object": "list",
+            "url": "/v1/payment_intents",
+            "has_more": len(intents) > limit,
+            "data": [dict(i, status=self.server.intent_status) for i in intents[:limit]],
+        }
+
+    def _send(self, code, body):
+        time.sleep(self.server.latency)
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Request-Id", f"req_fake_{secrets.token_hex(6)}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering POST /v1/payment_intents (create),
+    GET /v1/payment_intents (list) and GET /v1/payment_intents/<id>.
+    Listed and retrieved intents report ``intent_status``.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency=0.0, intent_status="succeeded", host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.intent_status = intent_status
+        self.intents = {}
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
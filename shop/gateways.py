@@ -0,0 +1,256 @@
+# gateways.py - Payment gateway backends
+#
+# The payment views and shop/utils.py talk to `get_gateway()` instead of the
+# Stripe SDK, so `settings.PAYMENT_GATEWAY` can swap live Stripe for
+# `FakeGateway` (no network, configurable latency/failures, signed webhooks)
+# when load testing checkout offline.
+#
+# Methods mirror Django's naming: `acreate_payment_intent` is the async
+# variant of `create_payment_intent`. Errors are raised as stripe.error
+# exceptions for every backend so callers handle them once.
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import random
+import secrets
+import threading
+import time
+from functools import lru_cache
+
+import httpx
+import stripe
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import stripe_client
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def get_gateway():
+    return import_string(settings.PAYMENT_GATEWAY)()
+
+
+def reset_gateway():
+    """Forget the cached gateway (after changing PAYMENT_GATEWAY, e.g. in tests)"""
+    get_gateway.cache_clear()
+
+
+class StripeGateway:
+    """
+    Live Stripe: async calls through the pooled client, sync ones through the
+    SDK. Calls count as "stripe" time in the request's metrics.
+    """
+
+    async def acreate_payment_intent(self, idempotency_key=None, **params):
+        with timed("stripe"):
+            return await stripe_client.create_payment_intent(idempotency_key=idempotency_key, **params)
+
+    async def aretrieve_payment_intent(self, intent_id):
+        with timed("stripe"):
+            return await stripe_client.retrieve_payment_intent(intent_id)
+
+    async def acreate_customer(self, idempotency_key=None, **params):
+        with timed("stripe"):
+            return await stripe_client.create_customer(idempotency_key=idempotency_key, **params)
+
+    def create_payment_intent(self, idempotency_key=None, **params):
+        with timed("stripe"):
+            return stripe.PaymentIntent.create(idempotency_key=idempotency_key, **params)
+
+    def create_customer(self, idempotency_key=None, **params):
+        with timed("stripe"):
+            return stripe.Customer.create(idempotency_key=idempotency_key, **params)
+
+    def list_payment_methods(self, customer_id):
+        # Only the first page is timed; auto-paging fetches the rest lazily
+        with timed("stripe"):
+            return stripe.PaymentMethod.list(customer=customer_id, type="card", limit=100).auto_paging_iter()
+
+    def retrieve_balance(self):
+        with timed("stripe"):
+            return stripe.Balance.retrieve()
+
+
+class FakeGateway:
+    """
+    In-process stand-in for Stripe.
+
+    Every call waits ``FAKE_GATEWAY_LATENCY`` seconds and fails with
+    ``FAKE_GATEWAY_ERROR_RATE``. Each PaymentIntent is decided when it's
+    created (declined with ``FAKE_GATEWAY_DECLINE_RATE``) and the outcome is
+    encoded in its id, so any worker can answer a retrieve. If
+    ``FAKE_GATEWAY_WEBHOOK_URL`` is set, the matching ``payment_intent.*``
+    event is posted there ``FAKE_GATEWAY_WEBHOOK_DELAY`` seconds later,
+    signed with ``STRIPE_WEBHOOK_SECRET`` like a real delivery.
+    """
+
+    def __init__(self):
+        self._events = queue.Queue()
+        self._emitter = None
+        self._intents_by_key = {}  # idempotency key -> intent, in this process only
+
+    # ---------- API ----------
+
+    async def acreate_payment_intent(self, idempotency_key=None, **params):
+        await asyncio.sleep(settings.FAKE_GATEWAY_LATENCY)
+        return self._create_intent(params, idempotency_key)
+
+    async def aretrieve_payment_intent(self, intent_id):
+        await asyncio.sleep(settings.FAKE_GATEWAY_LATENCY)
+        return self._retrieve_intent(intent_id)
+
+    def create_payment_intent(self, idempotency_key=None, **params):
+        time.sleep(settings.FAKE_GATEWAY_LATENCY)
+        return self._create_intent(params, idempotency_key)
+
+    async def acreate_customer(self, idempotency_key=None, **params):
+        await asyncio.sleep(settings.FAKE_GATEWAY_LATENCY)
+        return self._create_customer(params)
+
+    def create_customer(self, idempotency_key=None, **params):
+        time.sleep(settings.FAKE_GATEWAY_LATENCY)
+        return self._create_customer(params)
+
+    def list_payment_methods(self, customer_id):
+        time.sleep(settings.FAKE_GATEWAY_LATENCY)
+        self._maybe_fail()
+        return iter(())
+
+    def retrieve_balance(self):
+        return stripe.Balance.construct_from(
+            {"object": "balance", "available": [{"amount": 0, "currency": settings.STRIPE_CURRENCY.lower()}]},
+            "sk_fake",
+        )
+
+    # ---------- Intents ----------
+
+    def _maybe_fail(self):
+        if random.random() < settings.FAKE_GATEWAY_ERROR_RATE:
+            raise stripe.error.APIConnectionError("Fake gateway: simulated network error")
+
+    def _create_customer(self, params):
+        self._maybe_fail()
+        return stripe.Customer.construct_from(
+            {"id": f"cus_fake_{secrets.token_hex(8)}", "object": "customer", **params}, "sk_fake"
+        )
+
+    def _create_intent(self, params, idempotency_key=None):
+        # Like Stripe, a repeated idempotency key replays the first result
+        # instead of creating (and charging) another intent
+        if idempotency_key is None or idempotency_key not in self._intents_by_key:
+            created = self._new_intent(params)
+            if idempotency_key is not None:
+                self._intents_by_key[idempotency_key] = created
+        else:
+            created = self._intents_by_key[idempotency_key]
+        intent, settled = created
+        if params.get("confirm"):
+            # Confirmed server side: the outcome is known right away
+            if settled["status"] != "succeeded":
+                raise stripe.error.CardError("Your card was declined.", None, "card_declined")
+            intent = settled
+        return stripe.PaymentIntent.construct_from(intent, "sk_fake")
+
+    def _new_intent(self, params):
+        """A new intent and how it settles, as dicts"""
+        self._maybe_fail()
+        outcome = "declined" if random.random() < settings.FAKE_GATEWAY_DECLINE_RATE else "ok"
+        intent = {
+            "id": f"pi_fake_{secrets.token_hex(8)}_{outcome}",
+            "object": "payment_intent",
+            "amount": int(params.get("amount", 0)),
+            "currency": params.get("currency", settings.STRIPE_CURRENCY.lower()),
+            "customer": params.get("customer"),
+            "payment_method": params.get("payment_method") or f"pm_fake_{secrets.token_hex(8)}",
+            "metadata": {key: str(value) for key, value in (params.get("metadata") or {}).items()},
+            "created": int(time.time()),
+            "status": "requires_payment_method",
+        }
+        intent["client_secret"] = f"{intent['id']}_secret_{secrets.token_hex(8)}"
+        settled = self._settle(intent)
+        if settings.FAKE_GATEWAY_WEBHOOK_URL:
+            self._schedule_webhook(settled)
+            if params.get("setup_future_usage") and intent["customer"] and settled["status"] == "succeeded":
+                self._schedule_card_attached(intent)
+        return intent, settled
+
+    def _retrieve_intent(self, intent_id):
+        self._maybe_fail()
+        if not intent_id.startswith("pi_fake_"):
+            raise stripe.error.InvalidRequestError(f"No such payment_intent: '{intent_id}'", "id")
+        intent = {"id": intent_id, "object": "payment_intent", "metadata": {}, "created": int(time.time())}
+        return stripe.PaymentIntent.construct_from(self._settle(intent), "sk_fake")
+
+    def _settle(self, intent):
+        """The intent as it looks once the customer has paid (or been declined)"""
+        settled = dict(intent)
+        if intent["id"].endswith("_declined"):
+            settled["status"] = "requires_payment_method"
+            settled["last_payment_error"] = {"code": "card_declined", "message": "Your card was declined."}
+        else:
+            settled["status"] = "succeeded"
+        return settled
+
+    # ---------- Webhooks ----------
+
+    def _schedule_webhook(self, intent):
+        event_type = "payment_intent.succeeded" if intent["status"] == "succeeded" else "payment_intent.payment_failed"
+        event = {
+            "id": f"evt_fake_{secrets.token_hex(12)}",
+            "object": "event",
+            "type": event_type,
+            "created": int(time.time()),
+            "data": {"object": intent},
+        }
+        self._queue_event(event)
+
+    def _schedule_card_attached(self, intent):
+        self._queue_event({
+            "id": f"evt_fake_{secrets.token_hex(12)}",
+            "object": "event",
+            "type": "payment_method.attached",
+            "created": int(time.time()),
+            "data": {"object": {
+                "id": intent["payment_method"],
+                "object": "payment_method",
+                "type": "card",
+                "customer": intent["customer"],
+                "card": {"brand": "visa", "last4": "4242", "exp_month": 12, "exp_year": time.gmtime().tm_year + 3},
+            }},
+        })
+
+    def _queue_event(self, event):
+        self._events.put((time.monotonic() + settings.FAKE_GATEWAY_WEBHOOK_DELAY, event))
+        if self._emitter is None or not self._emitter.is_alive():
+            self._emitter = threading.Thread(target=self._emit_webhooks, daemon=True)
+            self._emitter.start()
+
+    def _emit_webhooks(self):
+        # Events share one delay, so the queue is already in due order
+        with httpx.Client(timeout=10) as client:
+            while True:
+                due, event = self._events.get()
+                time.sleep(max(0.0, due - time.monotonic()))
+                payload = json.dumps(event)
+                try:
+                    client.post(
+                        settings.FAKE_GATEWAY_WEBHOOK_URL,
+                        content=payload,
+                        headers={"Content-Type": "application/json", "Stripe-Signature": sign_payload(payload)},
+                    )
+                except httpx.HTTPError as e:
+                    logger.warning(f"Fake gateway: webhook {event['id']} not delivered: {e}")
+
+
+def sign_payload(payload, secret=None, timestamp=None):
+    """Stripe-Signature header value for ``payload`` (what Stripe sends with webhooks)"""
+    timestamp = int(timestamp or time.time())
+    secret = secret or settings.STRIPE_WEBHOOK_SECRET
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
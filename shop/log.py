@@ -0,0 +1,158 @@
+# log.py - Logging pipeline: background writer, JSON lines, request ids
+#
+# Loggers hand records to BackgroundHandler, which only puts them on a
+# bounded queue; a QueueListener thread formats and writes them to the real
+# handlers (console, rotating JSON file). A slow disk or stderr pipe therefore
+# never stalls a request, and when the queue is full records are dropped and
+# counted instead of blocking.
+#
+# RequestIdMiddleware gives every request an id (the proxy's X-Request-ID
+# when it sends a sane one), echoed in the response and stamped on each
+# record by RequestIdFilter. SampleDebugFilter keeps DEBUG records for a
+# fraction of requests, all-or-nothing per request so a sampled request keeps
+# its full trail. Nothing here imports models: it is loaded by LOGGING.
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueListener
+
+request_id = ContextVar("request_id", default=None)
+
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+
+class BackgroundHandler(logging.Handler):
+    """
+    Queues records for a listener thread writing to ``targets``. The thread
+    is (re)started lazily in each process, so forked workers get their own.
+    """
+
+    def __init__(self, targets, maxsize=10000):
+        # Indexing, not iterating: dictConfig resolves cfg:// on item access
+        targets = [targets[i] for i in range(len(targets))]
+        for target in targets:
+            if not isinstance(target, logging.Handler):
+                # Lets dictConfig retry once the target handler exists
+                raise ValueError(f"target not configured yet: {target!r}")
+        super().__init__()
+        self.targets = targets
+        self.maxsize = maxsize
+        self.queue = None
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+
+    def _start(self):
+        with self.lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(self.maxsize)
+            self._listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # Render the message and traceback now, while args and exc_info are
+        # still what they were at the call site
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            if self.dropped:
+                dropped, self.dropped = self.dropped, 0
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": f"Log queue full, dropped {dropped} records", "request_id": "-",
+                }))
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        # Drains the queue into the targets before they are closed
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+        super().close()
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": None if getattr(record, "request_id", "-") == "-" else record.request_id,
+            "pid": record.process,
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        current = request_id.get()
+        if current is None:
+            # Django logs 4xx/5xx responses (django.request) after the
+            # middleware has returned, but passes the request along
+            current = getattr(getattr(record, "request", None), "request_id", None)
+        record.request_id = current or "-"
+        return True
+
+
+class SampleDebugFilter(logging.Filter):
+    """Passes records below INFO for about ``rate`` of requests"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno >= logging.INFO or self.rate >= 1:
+            return True
+        current = request_id.get()
+        if current is None:
+            return random.random() < self.rate
+        return zlib.crc32(current.encode()) < self.rate * 2 ** 32
+
+
+class RequestIdMiddleware:
+    """Sets the request id for log records and returns it as X-Request-ID"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        incoming = request.headers.get("X-Request-ID", "")
+        request.request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        token = request_id.set(request.request_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_id.reset(token)
+        response["X-Request-ID"] = request.request_id
+        return response
@@ -0,0 +1,134 @@
+# mail.py - Database-backed email queue
+#
+# With EMAIL_BACKEND = "shop.mail.QueuedEmailBackend" every send_mail() call
+# just inserts a QueuedEmail row, inside whatever transaction the caller is
+# in, so requests never wait on SMTP and an SMTP outage can't fail them.
+# `manage.py send_queued_email` delivers the rows through
+# EMAIL_DELIVERY_BACKEND over one reused connection, retrying with backoff.
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import QueuedEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+
+
+class QueuedEmailBackend(BaseEmailBackend):
+    """Email backend that stores messages for the delivery worker"""
+
+    def send_messages(self, email_messages):
+        rows = []
+        for message in email_messages:
+            if message.attachments:
+                raise ValueError("Attachments can't be queued; send them with EMAIL_DELIVERY_BACKEND directly")
+            rows.append(QueuedEmail(
+                subject=message.subject,
+                body=message.body,
+                from_email=message.from_email or settings.DEFAULT_FROM_EMAIL,
+                to=list(message.to),
+                cc=list(message.cc),
+                bcc=list(message.bcc),
+                reply_to=list(message.reply_to),
+                headers=dict(message.extra_headers),
+                alternatives=[list(alternative) for alternative in getattr(message, "alternatives", [])],
+            ))
+        QueuedEmail.objects.bulk_create(rows)
+        return len(rows)
+
+
+def _to_message(row, connection):
+    message = EmailMultiAlternatives(
+        subject=row.subject,
+        body=row.body,
+        from_email=row.from_email,
+        to=row.to,
+        cc=row.cc,
+        bcc=row.bcc,
+        reply_to=row.reply_to,
+        headers=row.headers,
+        connection=connection,
+    )
+    for content, mimetype in row.alternatives:
+        message.attach_alternative(content, mimetype)
+    return message
+
+
+def _retry_delay(attempts):
+    # 1m, 2m, 4m ... capped at one hour
+    return timedelta(seconds=min(60 * 2 ** (attempts - 1), 3600))
+
+
+def get_delivery_connection():
+    return get_connection(settings.EMAIL_DELIVERY_BACKEND)
+
+
+def send_batch(connection, batch_size=100):
+    """
+    Deliver one batch of queued emails over ``connection``.
+
+    Rows are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` so several
+    workers can run side by side. The connection is opened once and left open
+    for the next batch; each message is sent on it separately so a rejected
+    recipient only fails its own row. Returns ``(sent, failed)``.
+    """
+    sent = failed = 0
+    with transaction.atomic():
+        rows = list(
+            QueuedEmail.objects.select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True, available_at__lte=timezone.now(), attempts__lt=MAX_ATTEMPTS)
+            .order_by("available_at", "id")[:batch_size]
+        )
+        if not rows:
+            return 0, 0
+
+        for row in rows:
+            try:
+                connection.open()  # no-op while the connection is up
+            except Exception as e:
+                # Server unreachable: not the message's fault, so don't count
+                # an attempt; the rest of the batch waits for the next run
+                logger.warning(f"Email connection failed: {e}")
+                break
+            row.attempts += 1
+            try:
+                connection.send_messages([_to_message(row, connection)])
+            except Exception as e:
+                logger.warning(f"Email {row.id} to {row.to} failed: {e}")
+                row.last_error = str(e)
+                row.available_at = timezone.now() + _retry_delay(row.attempts)
+                failed += 1
+                # The server may have dropped us; reconnect for the next one
+                connection.close()
+            else:
+                row.sent_at = timezone.now()
+                row.last_error = ""
+                sent += 1
+
+        QueuedEmail.objects.bulk_update(rows, ["attempts", "sent_at", "available_at", "last_error"])
+    return sent, failed
+
+
+def metrics():
+    """Queue depth, lag and throughput of the email queue"""
+    now = timezone.now()
+    unsent = QueuedEmail.objects.filter(sent_at__isnull=True)
+    pending = unsent.filter(attempts__lt=MAX_ATTEMPTS)
+    oldest = pending.aggregate(oldest=Min("created_at"))["oldest"]
+    sent = QueuedEmail.objects.filter(sent_at__isnull=False)
+    return {
+        "pending": pending.count(),
+        "retrying": pending.filter(attempts__gt=0).count(),
+        "dead": unsent.filter(attempts__gte=MAX_ATTEMPTS).count(),
+        "lag_seconds": (now - oldest).total_seconds() if oldest else 0.0,
+        "sent_last_minute": sent.filter(sent_at__gte=now - timedelta(minutes=1)).count(),
+        "sent_last_hour": sent.filter(sent_at__gte=now - timedelta(hours=1)).count(),
+    }
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from shop.models import Order, OrderItem
+from shop.serializers import refresh_order_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write the JSON snapshot for orders that don't have one yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--rerender", action="store_true",
+            help="Also refresh orders that already have a snapshot (line items are kept as bought)",
+        )
+
+    def handle(self, *args, **options):
+        orders = Order.objects.select_related("user", "payment").prefetch_related(
+            Prefetch("items", queryset=OrderItem.objects.select_related("product"))
+        ).order_by("id")
+        if not options["rerender"]:
+            orders = orders.filter(snapshot__isnull=True)
+
+        count = 0
+        for order in orders.iterator(chunk_size=options["batch_size"]):
+            refresh_order_snapshot(order)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Snapshotted {count} orders"))
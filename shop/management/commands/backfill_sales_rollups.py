@@ -0,0 +1,48 @@
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from shop.analytics import WATERMARK, rebuild_range
+from shop.models import Order, SyncWatermark
+
+
+class Command(BaseCommand):
+    help = "Rebuild the hourly and daily sales rollups for past orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First day, YYYY-MM-DD (default: first order)")
+        parser.add_argument("--end", help="Last day, YYYY-MM-DD, inclusive (default: today)")
+
+    def handle(self, *args, **options):
+        # Anything changing while we backfill is picked up by update_sales_rollups
+        started = timezone.now()
+        bounds = Order.objects.aggregate(first=Min("created_at"), last=Max("created_at"))
+        if bounds["first"] is None:
+            self.stdout.write("No orders to backfill")
+            return
+
+        start = self._day(options["start"]) or bounds["first"]
+        end = (self._day(options["end"]) + timedelta(days=1)) if options["end"] else started
+        if start >= end:
+            raise CommandError("--start must be before --end")
+
+        day = start
+        while day < end:
+            next_day = min(day + timedelta(days=30), end)
+            rebuild_range(day, next_day)
+            self.stdout.write(f"Rebuilt {day:%Y-%m-%d} .. {next_day:%Y-%m-%d}")
+            day = next_day
+
+        SyncWatermark.objects.get_or_create(name=WATERMARK, defaults={"value": started})
+        self.stdout.write(self.style.SUCCESS("Backfill complete"))
+
+    def _day(self, value):
+        if not value:
+            return None
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+        return timezone.make_aware(datetime.combine(parsed, time.min))
@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from shop.gateways import get_gateway
+from shop.models import SavedPaymentMethod, User
+from shop.utils import create_stripe_customer
+from shop.webhooks import save_payment_methods
+
+
+class Command(BaseCommand):
+    help = "Create Stripe customers for users that don't have one yet (and optionally cache their saved cards)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--workers", type=int, default=8,
+                            help="Parallel Stripe requests (stay under the API rate limit)")
+        parser.add_argument("--sync-cards", action="store_true",
+                            help="Also refresh the saved card cache for every Stripe customer")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        created = failed = 0
+        last_pk = 0
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            while True:
+                users = list(
+                    User.objects.filter(stripe_customer_id__isnull=True, pk__gt=last_pk)
+                    .order_by("pk").only("id", "username", "email")[:batch_size]
+                )
+                if not users:
+                    break
+                last_pk = users[-1].pk
+
+                # Stripe has no bulk create; requests run in parallel and the
+                # ids are written back with one bulk_update per batch
+                customers = pool.map(create_stripe_customer, users)
+                done = []
+                for user, customer in zip(users, customers):
+                    if customer is None:
+                        failed += 1
+                        continue
+                    user.stripe_customer_id = customer.id
+                    done.append(user)
+                User.objects.bulk_update(done, ["stripe_customer_id"])
+                created += len(done)
+                self.stdout.write(f"  {created} customer(s) created, {failed} failed")
+
+            cards = 0
+            if options["sync_cards"]:
+                gateway = get_gateway()
+                customer_ids = User.objects.filter(stripe_customer_id__isnull=False).values_list(
+                    "stripe_customer_id", flat=True
+                )
+                batch = []
+                for customer_id in customer_ids.iterator(chunk_size=batch_size):
+                    batch.append(customer_id)
+                    if len(batch) >= batch_size:
+                        cards += self._sync_cards(pool, gateway, batch)
+                        batch = []
+                if batch:
+                    cards += self._sync_cards(pool, gateway, batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {created} customer(s) created, {failed} failed"
+            + (f", {cards} saved card(s) cached" if options["sync_cards"] else "")
+        ))
+
+    def _sync_cards(self, pool, gateway, customer_ids):
+        methods = pool.map(lambda customer_id: list(gateway.list_payment_methods(customer_id)), customer_ids)
+        methods = [pm for customer_methods in methods for pm in customer_methods]
+        # Drop cached cards Stripe no longer has for these customers
+        SavedPaymentMethod.objects.filter(user__stripe_customer_id__in=customer_ids).exclude(
+            stripe_payment_method_id__in=[pm["id"] for pm in methods]
+        ).delete()
+        return save_payment_methods(methods)
@@ -0,0 +1,119 @@
+import logging
+import logging.handlers
+import os
+import tempfile
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from shop.log import BackgroundHandler, JSONFormatter, RequestIdFilter, SampleDebugFilter, request_id
+
+MODES = ("sync", "queue")
+
+
+class _StallingStream:
+    """File stream that blocks for ``stall`` seconds every ``every`` writes, like a busy disk"""
+
+    def __init__(self, stream, stall, every):
+        self._stream, self._stall, self._every, self._writes = stream, stall, every, 0
+
+    def write(self, data):
+        self._writes += 1
+        if self._stall and self._writes % self._every == 0:
+            time.sleep(self._stall)
+        return self._stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the logging done by one request as seen by the request thread: the old "
+        "synchronous FileHandler + console setup against the queued JSON pipeline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--info", type=int, default=3, help="INFO lines per request")
+        parser.add_argument("--debug", type=int, default=10, help="DEBUG lines per request")
+        parser.add_argument("--sample-rate", type=float, default=0.05,
+                            help="DEBUG sampling rate in queue mode")
+        parser.add_argument("--stall-ms", type=float, default=0.0,
+                            help="Simulated disk stall for file writes")
+        parser.add_argument("--stall-every", type=int, default=200, help="Writes between stalls")
+        parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'mode':>6} {'requests':>9} {'mean':>9} {'p50':>9} {'p99':>9} {'max':>9} "
+                          f"{'drain':>8} {'lines':>7}")
+        with tempfile.TemporaryDirectory() as directory:
+            for mode in options["modes"]:
+                path = os.path.join(directory, f"{mode}.log")
+                self._report(mode, path, *self._run(mode, path, options))
+
+    def _handlers(self, mode, path, options):
+        console = logging.StreamHandler(open(os.devnull, "w"))  # stands in for stderr
+        stall = options["stall_ms"] / 1000
+        if mode == "sync":
+            # The previous LOGGING: both handlers on the calling thread, no sampling
+            file = logging.FileHandler(path)
+            file.stream = _StallingStream(file.stream, stall, options["stall_every"])
+            return [console, file]
+
+        file = logging.handlers.RotatingFileHandler(path, maxBytes=1024 ** 3, backupCount=1)
+        file.stream = _StallingStream(file.stream, stall, options["stall_every"])
+        file.setFormatter(JSONFormatter())
+        console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+        handler = BackgroundHandler([console, file], maxsize=100000)
+        handler.addFilter(RequestIdFilter())
+        handler.addFilter(SampleDebugFilter(options["sample_rate"]))
+        return [handler]
+
+    def _run(self, mode, path, options):
+        logger = logging.getLogger(f"bench_logging.{mode}")
+        logger.propagate = False
+        logger.setLevel(logging.DEBUG)
+        handlers = self._handlers(mode, path, options)
+        for handler in handlers:
+            logger.addHandler(handler)
+
+        timings = []
+        try:
+            for i in range(options["requests"]):
+                token = request_id.set(uuid.uuid4().hex)
+                started = time.perf_counter()
+                for j in range(options["debug"]):
+                    logger.debug("Loaded cart line %s for order %s", j, i)
+                for j in range(options["info"]):
+                    logger.info("Order %s: step %s done", i, j)
+                timings.append(time.perf_counter() - started)
+                request_id.reset(token)
+
+            drain_started = time.perf_counter()
+            for handler in handlers:
+                handler.close()  # the queue handler waits for its listener here
+            drain = time.perf_counter() - drain_started
+        finally:
+            for handler in handlers:
+                logger.removeHandler(handler)
+                handler.close()
+        with open(path) as f:
+            lines = sum(1 for _ in f)
+        return timings, drain, lines
+
+    def _report(self, mode, path, timings, drain, lines):
+        timings.sort()
+
+        def us(seconds):
+            return f"{seconds * 1e6:>7.1f}us"
+
+        def percentile(p):
+            return timings[min(int(len(timings) * p), len(timings) - 1)]
+
+        self.stdout.write(
+            f"{mode:>6} {len(timings):>9} {us(sum(timings) / len(timings))} {us(percentile(0.5))} "
+            f"{us(percentile(0.99))} "
+            f"{us(timings[-1])} {drain * 1000:>6.0f}ms {lines:>7}"
+        )
@@ -0,0 +1,47 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from shop.exports import EXPORT_FORMATS, export_rows, stream_export
+from shop.models import Order
+
+
+class Command(BaseCommand):
+    help = "Stream orders (one row per order line, with payment) to CSV or JSON Lines"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="First order date, YYYY-MM-DD (inclusive)")
+        parser.add_argument("--end", help="Last order date, YYYY-MM-DD (inclusive)")
+        parser.add_argument("--status", action="append", default=[],
+                            help="Only orders with this status (repeatable)")
+        parser.add_argument("--format", dest="export_format", choices=EXPORT_FORMATS, default="csv")
+        parser.add_argument("--output", "-o", help="File to write to (default: stdout)")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        start = self._date(options["start"])
+        end = self._date(options["end"])
+        for value in options["status"]:
+            if value not in dict(Order.STATUS_CHOICES):
+                raise CommandError(f"Invalid status: {value}")
+
+        rows = export_rows(start=start, end=end, statuses=options["status"], chunk_size=options["chunk_size"])
+        out = open(options["output"], "w", newline="", encoding="utf-8") if options["output"] else sys.stdout
+        try:
+            for chunk in stream_export(rows, options["export_format"]):
+                out.write(chunk)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+
+    def _date(self, value):
+        if not value:
+            return None
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+        return parsed
@@ -0,0 +1,480 @@
+import multiprocessing
+import os
+import time
+from datetime import date, datetime, time as dt_time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Max
+
+from shop.models import Cart, Category, Order, OrderItem, Payment, Product, Review, User
+
+# Rows per worker task; also the unit the seeds are derived from, so the
+# same seed gives the same rows whatever --workers is
+CHUNK_SIZE = 10000
+# Ids of per-order and per-user rows are computed, not drawn from the
+# sequence, so they don't depend on which worker commits first
+MAX_ITEMS_PER_ORDER = 6
+MAX_REVIEWS_PER_USER = 50
+MAX_CART_LINES_PER_USER = 10
+
+CATEGORY_NAMES = [
+    "Electronics", "Books", "Home & Kitchen", "Fashion", "Sports", "Toys", "Beauty", "Grocery",
+    "Automotive", "Garden", "Health", "Music", "Office", "Pet Supplies", "Jewellery", "Footwear",
+]
+ADJECTIVES = [
+    "Classic", "Compact", "Deluxe", "Eco", "Essential", "Premium", "Smart", "Ultra", "Vintage", "Wireless",
+    "Portable", "Ergonomic", "Handmade", "Organic", "Rugged", "Slim",
+]
+NOUNS = [
+    "Lamp", "Backpack", "Speaker", "Notebook", "Kettle", "Jacket", "Headphones", "Bottle", "Chair",
+    "Watch", "Blender", "Sneakers", "Charger", "Mug", "Tent", "Keyboard", "Cushion", "Scarf",
+]
+FIRST_NAMES = [
+    "Aarav", "Ananya", "Arjun", "Diya", "Ishaan", "Kavya", "Meera", "Neha", "Priya", "Rahul",
+    "Rohan", "Sanjay", "Sneha", "Tara", "Vikram", "Zoya", "Amit", "Pooja", "Karan", "Nisha",
+]
+LAST_NAMES = [
+    "Sharma", "Patel", "Iyer", "Nair", "Reddy", "Gupta", "Singh", "Das", "Menon", "Joshi",
+    "Kumar", "Bose", "Rao", "Mehta", "Pillai", "Verma",
+]
+PLACES = {  # state -> districts
+    "Kerala": ["Ernakulam", "Thrissur", "Kozhikode", "Kollam"],
+    "Karnataka": ["Bengaluru Urban", "Mysuru", "Udupi"],
+    "Maharashtra": ["Mumbai", "Pune", "Nagpur", "Nashik"],
+    "Tamil Nadu": ["Chennai", "Coimbatore", "Madurai"],
+    "Delhi": ["New Delhi", "South Delhi"],
+    "West Bengal": ["Kolkata", "Howrah"],
+}
+STATES = sorted(PLACES)
+STREETS = ["MG Road", "Park Street", "Station Road", "Temple Road", "Lake View", "Main Bazaar", "Gandhi Nagar"]
+PAYMENT_METHODS = (["card", "cod", "upi", "netbanking"], [0.6, 0.3, 0.07, 0.03])
+ITEM_COUNTS = ([1, 2, 3, 4, 5, 6], [0.55, 0.25, 0.1, 0.05, 0.03, 0.02])
+RATINGS = ([1, 2, 3, 4, 5], [0.05, 0.07, 0.13, 0.3, 0.45])
+
+# Columns written per model; every NOT NULL column must be listed
+COLUMNS = {
+    Category: ["id", "name", "created_at", "image"],
+    User: [
+        "id", "password", "last_login", "is_superuser", "username", "first_name", "last_name", "email",
+        "is_staff", "is_active", "date_joined", "phone_number", "date_of_birth", "address", "state",
+        "district", "pin_code", "stripe_customer_id",
+    ],
+    Product: ["id", "name", "description", "price", "stock", "category_id", "created_at", "updated_at", "image"],
+    Review: ["id", "user_id", "product_id", "rating", "title", "comment", "created_at"],
+    Cart: ["id", "user_id", "product_id", "quantity", "added_at"],
+    Order: [
+        "id", "status", "user_id", "total_price", "created_at", "updated_at", "delivery_date", "payment_method",
+        "shipping_full_name", "shipping_phone", "shipping_address", "shipping_state", "shipping_district",
+        "shipping_pin_code", "snapshot",
+    ],
+    OrderItem: ["id", "order_id", "product_id", "quantity", "price"],
+    Payment: ["id", "order_id", "payment_method", "amount", "status", "transaction_id", "paid_at"],
+}
+
+# Set in the parent before the pool forks, read by the workers
+_plan = {}
+
+
+def _mix(*values):
+    """Deterministic 64-bit hash of integers (splitmix64 steps)"""
+    h = 0x9E3779B97F4A7C15
+    for value in values:
+        h = (h ^ value) * 0xBF58476D1CE4E5B9 & 0xFFFFFFFFFFFFFFFF
+        h = (h ^ (h >> 31)) * 0x94D049BB133111EB & 0xFFFFFFFFFFFFFFFF
+    return h ^ (h >> 29)
+
+
+def _person(seed, user_id):
+    """Name and address of a user, also copied onto their orders"""
+    h = _mix(seed, user_id)
+    first, last = FIRST_NAMES[h % len(FIRST_NAMES)], LAST_NAMES[(h >> 8) % len(LAST_NAMES)]
+    state = STATES[(h >> 16) % len(STATES)]
+    return {
+        "first_name": first,
+        "last_name": last,
+        "phone": f"9{h % 10 ** 9:09d}",
+        "address": f"{(h >> 24) % 400 + 1}, {STREETS[(h >> 32) % len(STREETS)]}",
+        "state": state,
+        "district": PLACES[state][(h >> 40) % len(PLACES[state])],
+        "pin_code": f"{(h >> 44) % 900000 + 100000}",
+    }
+
+
+class _Zipf:
+    """Draws 0-based indices with Zipf(s) weights over a seeded random ranking"""
+
+    def __init__(self, n, s, seed):
+        weights = 1.0 / np.arange(1, n + 1) ** s
+        self.cdf = np.cumsum(weights / weights.sum())
+        self.ranking = np.random.default_rng(seed).permutation(n)
+
+    def sample(self, rng, size):
+        ranks = np.minimum(np.searchsorted(self.cdf, rng.random(size)), len(self.cdf) - 1)
+        return self.ranking[ranks]
+
+    def distinct(self, rng, count):
+        """``count`` different indices (at most n), popular ones more likely"""
+        count = min(count, len(self.cdf))
+        chosen = dict.fromkeys(self.sample(rng, count).tolist())
+        while len(chosen) < count:
+            chosen.update(dict.fromkeys(self.sample(rng, count - len(chosen)).tolist()))
+        return list(chosen)[:count]
+
+
+def placeholder_value(url):
+    """
+    CloudinaryField value that renders as ``url``.
+
+    The field splits the last ".ext" off as the format and leaves absolute
+    URLs alone otherwise, so the extension is given twice.
+    """
+    return f"{url}{os.path.splitext(url)[1]}"
+
+
+def _placeholder_svg(label, hue):
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="400" height="400" viewBox="0 0 400 400">'
+        f'<rect width="400" height="400" fill="hsl({hue}, 45%, 70%)"/>'
+        f'<text x="200" y="215" font-family="sans-serif" font-size="32" text-anchor="middle" '
+        f'fill="hsl({hue}, 45%, 25%)">{label.replace("&", "&amp;")}</text></svg>'
+    )
+
+
+def _rng(stage, chunk):
+    return np.random.default_rng([_plan["seed"], stage, chunk])
+
+
+def _timestamp(rng, size):
+    """Creation times over the dataset's period, as datetimes"""
+    seconds = rng.integers(0, _plan["period"], size)
+    return [_plan["start"] + timedelta(seconds=int(s)) for s in seconds]
+
+
+def _categories(chunk, start, end):
+    rng = _rng(1, chunk)
+    rows = []
+    for index, created in zip(range(start, end), _timestamp(rng, end - start)):
+        category_id = _plan["base"][Category] + index + 1
+        name = f"{CATEGORY_NAMES[index % len(CATEGORY_NAMES)]} {category_id}"
+        rows.append((category_id, name, created, _plan["images"][index]))
+    return {Category: rows}
+
+
+def _users(chunk, start, end):
+    rng = _rng(2, chunk)
+    seed = _plan["seed"]
+    births = rng.integers(0, 45 * 365, end - start)
+    rows = []
+    for index, joined, birth in zip(range(start, end), _timestamp(rng, end - start), births.tolist()):
+        user_id = _plan["base"][User] + index + 1
+        person = _person(seed, user_id)
+        rows.append((
+            user_id, _plan["password"], None, False, f"gen-{user_id}", person["first_name"], person["last_name"],
+            f"gen-{user_id}@example.invalid", False, True, joined, person["phone"],
+            date(1960, 1, 1) + timedelta(days=birth), person["address"], person["state"], person["district"],
+            person["pin_code"], None,
+        ))
+    return {User: rows}
+
+
+def _products(chunk, start, end):
+    rng = _rng(3, chunk)
+    size = end - start
+    categories = _plan["category_zipf"].sample(rng, size).tolist()
+    words = rng.integers(0, len(ADJECTIVES) * len(NOUNS), size).tolist()
+    stock = np.where(rng.random(size) < 0.05, 0, rng.integers(1, 500, size)).tolist()
+    rows = []
+    for i, (index, created) in enumerate(zip(range(start, end), _timestamp(rng, size))):
+        product_id = _plan["base"][Product] + index + 1
+        adjective, noun = ADJECTIVES[words[i] % len(ADJECTIVES)], NOUNS[words[i] // len(ADJECTIVES)]
+        rows.append((
+            product_id, f"{adjective} {noun} {product_id}",
+            f"{adjective} {noun.lower()}, model {product_id:07d}.", _price(index), stock[i],
+            _plan["base"][Category] + categories[i] + 1, created, created, _plan["images"][categories[i]],
+        ))
+    return {Product: rows}
+
+
+def _price(product_index):
+    return Decimal(int(_plan["prices"][product_index])).scaleb(-2)
+
+
+def _per_user(chunk, start, end, stage, mean, cap):
+    """(user index, k, product indices) for users that get ``mean`` rows on average"""
+    rng = _rng(stage, chunk)
+    counts = np.minimum(rng.poisson(mean, end - start), cap).tolist()
+    for index, count in zip(range(start, end), counts):
+        if count:
+            yield index, _plan["product_zipf"].distinct(rng, count), rng
+
+
+def _reviews(chunk, start, end):
+    rows = []
+    mean = _plan["reviews"] / _plan["users"]
+    for index, products, rng in _per_user(chunk, start, end, 4, mean, MAX_REVIEWS_PER_USER):
+        ratings = rng.choice(RATINGS[0], len(products), p=RATINGS[1]).tolist()
+        for k, (product, rating, created) in enumerate(zip(products, ratings, _timestamp(rng, len(products)))):
+            rows.append((
+                _plan["base"][Review] + index * MAX_REVIEWS_PER_USER + k + 1,
+                _plan["base"][User] + index + 1, _plan["base"][Product] + product + 1, rating,
+                f"{rating} stars", "Generated review." if rating >= 3 else "Generated review, not impressed.",
+                created,
+            ))
+    return {Review: rows}
+
+
+def _carts(chunk, start, end):
+    rows = []
+    mean = _plan["carts"] / _plan["users"]
+    for index, products, rng in _per_user(chunk, start, end, 5, mean, MAX_CART_LINES_PER_USER):
+        quantities = rng.integers(1, 4, len(products)).tolist()
+        added = _plan["end"] - timedelta(seconds=int(rng.integers(0, 14 * 86400)))
+        for k, (product, quantity) in enumerate(zip(products, quantities)):
+            rows.append((
+                _plan["base"][Cart] + index * MAX_CART_LINES_PER_USER + k + 1,
+                _plan["base"][User] + index + 1, _plan["base"][Product] + product + 1, quantity, added,
+            ))
+    return {Cart: rows}
+
+
+def _status(age, rng_value):
+    """Order status for an order ``age`` old: recent ones are still moving"""
+    if rng_value < 0.04:
+        return "cancelled"
+    if age < timedelta(days=1):
+        return "pending"
+    if age < timedelta(days=3):
+        return "processing"
+    if age < timedelta(days=7):
+        return "shipped"
+    return "delivered" if age < timedelta(days=30) else "completed"
+
+
+def _orders(chunk, start, end):
+    rng = _rng(6, chunk)
+    size = end - start
+    seed, base, end_time = _plan["seed"], _plan["base"], _plan["end"]
+    users = _plan["user_zipf"].sample(rng, size).tolist()
+    methods = rng.choice(PAYMENT_METHODS[0], size, p=PAYMENT_METHODS[1]).tolist()
+    item_counts = rng.choice(ITEM_COUNTS[0], size, p=ITEM_COUNTS[1]).tolist()
+    status_draws = rng.random(size).tolist()
+    # Order ids follow time, like real ones: spread evenly with some jitter
+    offsets = (np.arange(start, end) + rng.random(size)) * (_plan["period"] / _plan["orders"])
+
+    orders, items, payments = [], [], []
+    for i, index in enumerate(range(start, end)):
+        order_id = base[Order] + index + 1
+        user_id = base[User] + users[i] + 1
+        created = _plan["start"] + timedelta(seconds=float(offsets[i]))
+        status = _status(end_time - created, status_draws[i])
+        method = methods[i]
+
+        total = Decimal("0.00")
+        products = _plan["product_zipf"].distinct(rng, item_counts[i])
+        quantities = np.where(rng.random(len(products)) < 0.8, 1, rng.integers(2, 4, len(products))).tolist()
+        for k, (product, quantity) in enumerate(zip(products, quantities)):
+            price = _price(product)
+            total += price * quantity
+            items.append((
+                base[OrderItem] + index * MAX_ITEMS_PER_ORDER + k + 1, order_id, base[Product] + product + 1,
+                quantity, price,
+            ))
+
+        person = _person(seed, user_id)
+        updated = min(created + timedelta(days=3), end_time) if status != "pending" else created
+        orders.append((
+            order_id, status, user_id, total, created, updated,
+            (created + timedelta(days=5)).date() if status in ("delivered", "completed") else None, method,
+            f"{person['first_name']} {person['last_name']}", person["phone"], person["address"],
+            person["state"], person["district"], person["pin_code"], None,
+        ))
+
+        if status == "cancelled":
+            payment_status = "failed"
+        elif method == "cod":
+            payment_status = "completed" if status in ("delivered", "completed") else "pending"
+        else:
+            payment_status = "completed"
+        payments.append((
+            base[Payment] + index + 1, order_id, method, total, payment_status,
+            f"COD-{order_id}" if method == "cod" else f"pi_gen_{_mix(seed, order_id):016x}",
+            created + timedelta(minutes=2) if payment_status == "completed" else None,
+        ))
+    return {Order: orders, OrderItem: items, Payment: payments}
+
+
+# Loaded in this order: each stage only refers to rows of earlier ones
+STAGES = [
+    ("categories", _categories),
+    ("users", _users),
+    ("products", _products),
+    ("reviews", _reviews),
+    ("carts", _carts),
+    ("orders", _orders),
+]
+# What a stage's chunks iterate over
+STAGE_UNITS = {"reviews": "users", "carts": "users"}
+
+
+def _load(rows_by_model):
+    """Write the rows with COPY (PostgreSQL) or executemany, in one transaction"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model, rows in rows_by_model.items():
+            if not rows:
+                continue
+            table = connection.ops.quote_name(model._meta.db_table)
+            columns = [model._meta.get_field(name).column for name in COLUMNS[model]]
+            quoted = ", ".join(connection.ops.quote_name(column) for column in columns)
+            if connection.vendor == "postgresql":
+                with cursor.copy(f"COPY {table} ({quoted}) FROM STDIN") as copy:
+                    for row in rows:
+                        copy.write_row(row)
+            else:
+                placeholders = ", ".join(["%s"] * len(columns))
+                cursor.executemany(
+                    f"INSERT INTO {table} ({quoted}) VALUES ({placeholders})",
+                    [tuple(_adapt(value) for value in row) for row in rows],
+                )
+    return sum(len(rows) for rows in rows_by_model.values())
+
+
+def _adapt(value):
+    if isinstance(value, datetime):
+        return connection.ops.adapt_datetimefield_value(value)
+    if isinstance(value, date):
+        return connection.ops.adapt_datefield_value(value)
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _work(task):
+    stage, chunk, start, end = task
+    if connection.vendor == "postgresql" and not _plan.get("session_ready"):
+        # Losing the tail of a bulk load in a crash is fine; rerun it
+        with connection.cursor() as cursor:
+            cursor.execute("SET synchronous_commit TO off")
+        _plan["session_ready"] = True
+    return stage, _load(dict(STAGES)[stage](chunk, start, end))
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with a large, reproducible synthetic shop: users, categories, "
+        "products, reviews, carts, orders, order items and payments. Product popularity "
+        "(reviews, carts, order lines) and orders per user follow Zipf distributions. Rows "
+        "are generated and loaded (COPY on PostgreSQL) by --workers processes; the same "
+        "--seed on the same starting database gives the same data. Images are local SVG "
+        "placeholders, one per category."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--categories", type=int, default=20)
+        parser.add_argument("--products", type=int, default=10000)
+        parser.add_argument("--reviews", type=int, default=50000)
+        parser.add_argument("--carts", type=int, default=5000, help="Cart lines")
+        parser.add_argument("--orders", type=int, default=100000)
+        parser.add_argument("--zipf", type=float, default=1.1, help="Exponent of product popularity")
+        parser.add_argument("--user-zipf", type=float, default=0.6,
+                            help="Exponent of orders per user (0 is uniform)")
+        parser.add_argument("--days", type=int, default=365, help="Period the data spreads over")
+        parser.add_argument("--end-date", type=date.fromisoformat, default=None,
+                            help="Day the period ends, YYYY-MM-DD (default: today); fix it to reproduce")
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--password", default="password", help="Password of every generated user")
+        parser.add_argument("--image-dir", default=os.path.join(settings.STATIC_ROOT, "placeholders"),
+                            help="Where the placeholder SVGs are written")
+        parser.add_argument("--image-url", default=f"http://localhost:8000{settings.STATIC_URL}placeholders/",
+                            help="URL the image directory is served at")
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["products"] < 1 or options["categories"] < 1:
+            raise CommandError("--users, --products and --categories must be at least 1")
+        workers = options["workers"]
+        if connection.vendor == "sqlite" and workers > 1:
+            self.stdout.write("SQLite takes one writer at a time; generating with one process")
+            workers = 1
+
+        self._plan(options)
+        tasks = []
+        for stage, _ in STAGES:
+            total = options[STAGE_UNITS.get(stage, stage)]
+            for chunk, start in enumerate(range(0, total, CHUNK_SIZE)):
+                tasks.append((stage, chunk, start, min(start + CHUNK_SIZE, total)))
+
+        started = time.monotonic()
+        for stage, _ in STAGES:
+            stage_tasks = [task for task in tasks if task[0] == stage]
+            stage_started = time.monotonic()
+            if workers > 1:
+                # Forked children must not share the parent's socket
+                connections.close_all()
+                with multiprocessing.get_context("fork").Pool(workers) as pool:
+                    rows = sum(count for _, count in pool.imap_unordered(_work, stage_tasks))
+            else:
+                rows = sum(_work(task)[1] for task in stage_tasks)
+            elapsed = time.monotonic() - stage_started
+            self.stdout.write(f"{stage:>10}: {rows:>11,} rows in {elapsed:6.1f}s ({rows / max(elapsed, 1e-9):,.0f}/s)")
+
+        self._reset_sequences()
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.monotonic() - started:.1f}s"))
+        self.stdout.write(
+            "Order snapshots are rendered on first read; run backfill_order_snapshots and "
+            "backfill_sales_rollups to prepare them up front."
+        )
+
+    def _plan(self, options):
+        seed = options["seed"]
+        end_day = options["end_date"] or datetime.now(dt_timezone.utc).date()
+        end = datetime.combine(end_day, dt_time.min, tzinfo=dt_timezone.utc)
+        # Generated ids follow whatever is already there
+        base = {model: model.objects.aggregate(last=Max("id"))["last"] or 0 for model in COLUMNS}
+        prices = np.random.default_rng([seed, 0]).lognormal(np.log(2500), 0.9, options["products"])
+
+        _plan.clear()
+        _plan.update(
+            seed=seed,
+            users=options["users"],
+            orders=max(options["orders"], 1),
+            reviews=options["reviews"],
+            carts=options["carts"],
+            start=end - timedelta(days=options["days"]),
+            end=end,
+            period=options["days"] * 86400,
+            base=base,
+            password=make_password(options["password"], salt=f"gen{seed}"),
+            prices=np.clip(np.round(prices), 99, 5_000_000),  # cents
+            product_zipf=_Zipf(options["products"], options["zipf"], [seed, 10]),
+            user_zipf=_Zipf(options["users"], options["user_zipf"], [seed, 11]),
+            category_zipf=_Zipf(options["categories"], 0.8, [seed, 12]),
+            images=self._placeholders(options, base[Category]),
+        )
+
+    def _placeholders(self, options, category_base):
+        """One SVG per category; returns the image field value for each"""
+        os.makedirs(options["image_dir"], exist_ok=True)
+        values = []
+        for index in range(options["categories"]):
+            category_id = category_base + index + 1
+            name = f"{CATEGORY_NAMES[index % len(CATEGORY_NAMES)]} {category_id}"
+            filename = f"category-{category_id}.svg"
+            with open(os.path.join(options["image_dir"], filename), "w") as f:
+                f.write(_placeholder_svg(name, _mix(options["seed"], category_id) % 360))
+            values.append(placeholder_value(options["image_url"] + filename))
+        return values
+
+    def _reset_sequences(self):
+        """Point the id sequences past the explicitly numbered rows"""
+        statements = connection.ops.sequence_reset_sql(no_style(), list(COLUMNS))
+        if statements:
+            with connection.cursor() as cursor:
+                for sql in statements:
+                    cursor.execute(sql)
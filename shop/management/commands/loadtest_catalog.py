@@ -0,0 +1,114 @@
+import asyncio
+import os
+import time
+from collections import Counter
+
+import httpx
+from django.core.management.base import BaseCommand, CommandError
+
+
+def _children(pid):
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; fields resume after ")"
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == pid:
+            children.append(int(entry))
+    return children
+
+
+def tree_rss(pid):
+    """Resident memory in bytes of a process and all its descendants (Linux)"""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+        pending.extend(_children(current))
+    return total
+
+
+class Command(BaseCommand):
+    help = (
+        "Closed-loop load test of the catalog read endpoints: C clients each send the "
+        "next request as soon as the previous one answers. Reports throughput, latency "
+        "and, with --pid, the server's extra resident memory per in-flight request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--paths", nargs="+", default=["products/", "categories/"],
+                            help="Requested in turn by each client")
+        parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 50, 200])
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds per concurrency level")
+        parser.add_argument("--pid", type=int,
+                            help="Server (gunicorn master) pid; its process tree's RSS is sampled")
+
+    def handle(self, *args, **options):
+        if options["pid"] and not os.path.exists(f"/proc/{options['pid']}"):
+            raise CommandError(f"No process {options['pid']}")
+        self.stdout.write(f"{'clients':>8} {'requests':>9} {'req/s':>8} {'p50':>8} {'p99':>8} "
+                          f"{'rss idle':>9} {'rss peak':>9} {'per req':>9}  responses")
+        for clients in options["concurrency"]:
+            self._report(clients, options, *asyncio.run(self._run(clients, options)))
+
+    async def _run(self, clients, options):
+        base = options["url"].rstrip("/") + "/"
+        urls = [base + path.lstrip("/") for path in options["paths"]]
+        pid = options["pid"]
+        idle = tree_rss(pid) if pid else 0
+        peak = idle
+        timings, statuses = [], Counter()
+        deadline = time.monotonic() + options["duration"]
+
+        async def client(offset):
+            sent = offset
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await http.get(urls[sent % len(urls)])
+                    statuses[response.status_code] += 1
+                    if response.status_code == 200:
+                        timings.append(time.perf_counter() - started)
+                except httpx.HTTPError:
+                    statuses["error"] += 1
+                sent += 1
+
+        limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+        async with httpx.AsyncClient(timeout=60, limits=limits) as http:
+            started = time.monotonic()
+            tasks = [asyncio.create_task(client(i)) for i in range(clients)]
+            while not all(task.done() for task in tasks):
+                if pid:
+                    peak = max(peak, await asyncio.to_thread(tree_rss, pid))
+                await asyncio.sleep(0.25)
+            await asyncio.gather(*tasks)
+            elapsed = time.monotonic() - started
+        return timings, statuses, elapsed, idle, peak
+
+    def _report(self, clients, options, timings, statuses, elapsed, idle, peak):
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(int(len(timings) * p), len(timings) - 1)] * 1000 if timings else 0
+
+        mb = 1024 * 1024
+        memory = (f"{idle / mb:>7.1f}MB {peak / mb:>7.1f}MB {(peak - idle) / clients / 1024:>7.0f}KB"
+                  if options["pid"] else f"{'-':>9} {'-':>9} {'-':>9}")
+        breakdown = ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items(), key=str))
+        self.stdout.write(
+            f"{clients:>8} {len(timings):>9} {len(timings) / elapsed:>8.0f} {percentile(0.5):>6.1f}ms "
+            f"{percentile(0.99):>6.1f}ms {memory}  {breakdown or '-'}"
+        )
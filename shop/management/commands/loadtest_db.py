@@ -0,0 +1,92 @@
+import copy
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db.utils import ConnectionHandler
+
+MODES = ("new", "persistent", "pool")
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the database side of gunicorn sync worker requests (connect if needed, "
+        "run a few queries, release the connection at request end) with a new connection "
+        "per request, persistent connections and the psycopg pool"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=500)
+        parser.add_argument("--queries", type=int, default=3,
+                            help="Queries per request (SELECT 1)")
+        parser.add_argument("--database", default="default")
+        parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+
+    def handle(self, *args, **options):
+        if options["database"] not in settings.DATABASES:
+            raise CommandError(f"Unknown database {options['database']!r}")
+        base = settings.DATABASES[options["database"]]
+
+        self.stdout.write(f"{'mode':>10} {'requests':>9} {'connects':>9} {'connect':>9} "
+                          f"{'p50':>8} {'p99':>8} {'req/s':>8}")
+        for mode in options["modes"]:
+            try:
+                result = self._run(self._settings_for(base, mode), options)
+            except (ImproperlyConfigured, ImportError) as e:
+                self.stdout.write(f"{mode:>10} skipped: {e}")
+                continue
+            self._report(mode, *result)
+
+    def _settings_for(self, base, mode):
+        conf = copy.deepcopy(base)
+        conf.setdefault("OPTIONS", {}).pop("pool", None)
+        if mode == "new":
+            conf["CONN_MAX_AGE"] = 0
+        elif mode == "persistent":
+            conf["CONN_MAX_AGE"] = max(base.get("CONN_MAX_AGE") or 0, 600)
+            conf["CONN_HEALTH_CHECKS"] = True
+        else:
+            if conf["ENGINE"] != "django.db.backends.postgresql":
+                raise ImproperlyConfigured("connection pools need PostgreSQL with psycopg 3")
+            conf["CONN_MAX_AGE"] = 0
+            conf["OPTIONS"]["pool"] = (base.get("OPTIONS") or {}).get("pool") or {"min_size": 1, "max_size": 4}
+        return conf
+
+    def _run(self, conf, options):
+        # A separate handler and alias (pools are kept per alias) so the app's
+        # own connection is untouched; the handler insists on a "default"
+        connection = ConnectionHandler({"default": conf, "loadtest": conf})["loadtest"]
+        timings, connect_times = [], []
+        started = time.monotonic()
+        try:
+            for _ in range(options["requests"]):
+                request_started = time.perf_counter()
+                connection.close_if_unusable_or_obsolete()  # what request_started does
+                if connection.connection is None:
+                    connect_started = time.perf_counter()
+                    connection.ensure_connection()
+                    connect_times.append(time.perf_counter() - connect_started)
+                with connection.cursor() as cursor:
+                    for _ in range(options["queries"]):
+                        cursor.execute("SELECT 1")
+                        cursor.fetchone()
+                connection.close_if_unusable_or_obsolete()  # what request_finished does
+                timings.append(time.perf_counter() - request_started)
+        finally:
+            connection.close()
+            if getattr(connection, "pool", None) is not None:
+                connection.close_pool()
+        return timings, connect_times, time.monotonic() - started
+
+    def _report(self, mode, timings, connect_times, elapsed):
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(int(len(timings) * p), len(timings) - 1)] * 1000 if timings else 0
+
+        connect = sum(connect_times) / len(connect_times) * 1000 if connect_times else 0
+        self.stdout.write(
+            f"{mode:>10} {len(timings):>9} {len(connect_times):>9} {connect:>7.2f}ms "
+            f"{percentile(0.5):>6.2f}ms {percentile(0.99):>6.2f}ms {len(timings) / elapsed:>8.0f}"
+        )
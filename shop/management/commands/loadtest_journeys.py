@@ -0,0 +1,380 @@
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.authentication import ClaimsRefreshToken
+from shop.models import Product, User
+
+# Fewer requests than this make a p95 too noisy to compare between runs
+_MIN_SAMPLES = 20
+_SERVER_TIMING_DB = re.compile(r'(?:^|,\s*)db;dur=([\d.]+);desc="(\d+) queries"')
+
+
+def percentile(timings, p):
+    """p-th percentile of sorted ``timings`` (nearest rank), 0 when empty"""
+    return timings[min(int(len(timings) * p), len(timings) - 1)] if timings else 0.0
+
+
+def _results(response):
+    data = response.json()
+    return data["results"] if isinstance(data, dict) and "results" in data else data
+
+
+class _Stats:
+    """Latencies, statuses and server-side DB time per endpoint"""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.db_ms = defaultdict(float)
+        self.queries = defaultdict(int)
+        self.journeys = Counter()
+
+    def add(self, endpoint, status, seconds, response=None):
+        self.statuses[endpoint][status] += 1
+        if response is None:
+            return
+        self.timings[endpoint].append(seconds)
+        match = _SERVER_TIMING_DB.search(response.headers.get("Server-Timing", ""))
+        if match:
+            self.db_ms[endpoint] += float(match.group(1))
+            self.queries[endpoint] += int(match.group(2))
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for endpoint in sorted(self.statuses):
+            timings = sorted(self.timings[endpoint])
+            count = len(timings)
+            statuses = self.statuses[endpoint]
+            endpoints[endpoint] = {
+                "requests": count,
+                "rps": round(count / elapsed, 2),
+                "p50_ms": round(percentile(timings, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(timings, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(timings, 0.99) * 1000, 2),
+                "max_ms": round(timings[-1] * 1000, 2) if timings else 0.0,
+                "errors": sum(n for status, n in statuses.items() if status == "error" or status >= 500),
+                "statuses": {str(status): n for status, n in sorted(statuses.items(), key=str)},
+                # From the Server-Timing header; absent when SERVER_TIMING is off
+                "queries_per_request": round(self.queries[endpoint] / count, 2) if count else 0.0,
+                "db_ms_per_request": round(self.db_ms[endpoint] / count, 2) if count else 0.0,
+            }
+        return {
+            "elapsed": round(elapsed, 2),
+            "journeys": dict(self.journeys),
+            "journeys_per_second": {name: round(n / elapsed, 2) for name, n in self.journeys.items()},
+            "endpoints": endpoints,
+        }
+
+
+class _Shopper:
+    """One virtual user walking through journeys, one request at a time"""
+
+    def __init__(self, http, base, token, stats, rng, catalog, think):
+        self.http, self.base, self.stats, self.rng = http, base, stats, rng
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.categories, self.search_terms = catalog
+        self.think = think
+
+    async def request(self, endpoint, method, path, **kwargs):
+        """The response, or None if it failed; ``endpoint`` groups the timing"""
+        if self.think:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.think))
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(
+                method, self.base + path, headers=self.headers, **kwargs
+            )
+        except httpx.HTTPError:
+            self.stats.add(endpoint, "error", 0.0)
+            return None
+        self.stats.add(endpoint, response.status_code, time.perf_counter() - started, response)
+        return response if response.is_success else None
+
+    async def browse(self):
+        """Categories, a category's products, a search, a product page"""
+        if await self.request("GET categories/", "GET", "categories/") is None:
+            return None
+        category = self.rng.choice(self.categories)
+        listing = await self.request("GET categories/{id}/products/", "GET", f"categories/{category}/products/")
+        term = self.rng.choice(self.search_terms)
+        found = await self.request("GET products/?search=", "GET", "products/", params={"search": term})
+        products = [
+            product for response in (listing, found) if response is not None
+            for product in _results(response) if product["stock"] > 0
+        ]
+        if not products:
+            return None
+        product = self.rng.choice(products)
+        if await self.request("GET products/{id}/", "GET", f"products/{product['id']}/") is None:
+            return None
+        return product
+
+    async def purchase(self):
+        """Browse, then add to cart, check out, pay by card and look at the orders"""
+        product = await self.browse()
+        if product is None:
+            return False
+        line = await self.request("POST cart/", "POST", "cart/",
+                                  json={"product": product["id"], "product_id": product["id"], "quantity": 1})
+        if line is None:
+            return False
+        line = line.json()
+        try:
+            if await self.request("GET cart/", "GET", "cart/") is None:
+                return False
+            order = await self.request(
+                "POST orders/", "POST", "orders/",
+                json={"items": [{"product": product["id"], "quantity": 1}], "payment_method": "card"},
+            )
+            if order is None:
+                return False
+            payment = await self.request(
+                "POST payments/", "POST", "payments/",
+                json={"order": order.json()["order"]["id"], "payment_method": "card", "save_card": False},
+            )
+            if payment is None:
+                return False
+            # A declined card (FAKE_GATEWAY_DECLINE_RATE) answers 400 here
+            await self.request("POST payments/confirm/", "POST", "payments/confirm/",
+                               json={"payment_id": payment.json()["payment_id"]})
+            return await self.request("GET orders/", "GET", "orders/") is not None
+        finally:
+            # Checkout leaves the cart alone; empty it like the frontend does
+            await self.request("DELETE cart/{id}/", "DELETE", f"cart/{line['id']}/")
+
+    async def run(self, deadline, purchase_ratio):
+        while time.monotonic() < deadline:
+            if self.rng.random() < purchase_ratio:
+                name, done = "purchase", await self.purchase()
+            else:
+                name, done = "browse", await self.browse() is not None
+            self.stats.journeys[name if done else f"{name} (failed)"] += 1
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the API with scripted shopper journeys (browse: categories, a category, "
+        "search, a product; purchase: browse, add to cart, check out, pay by card, list "
+        "orders). C shoppers run closed-loop for --duration per concurrency level; p50/p95/p99 "
+        "and throughput are reported per endpoint and can be saved as JSON and compared with "
+        "a previous run. The server must use PAYMENT_GATEWAY=shop.gateways.FakeGateway and "
+        "this database, and SERVER_TIMING=True for query counts; --serve starts one that way."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--serve", action="store_true",
+                            help="Start uvicorn on a free port with the fake gateway, instead of using --url")
+        parser.add_argument("--workers", type=int, default=1, help="uvicorn workers with --serve")
+        parser.add_argument("--gateway-latency", type=float, default=0.05,
+                            help="FAKE_GATEWAY_LATENCY with --serve, in seconds")
+        parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 10, 50])
+        parser.add_argument("--duration", type=float, default=30.0, help="Seconds per concurrency level")
+        parser.add_argument("--purchase-ratio", type=float, default=0.25,
+                            help="Share of journeys that buy something; the rest only browse")
+        parser.add_argument("--think-ms", type=float, default=0.0,
+                            help="Mean pause before each request (uniform 0..2x)")
+        parser.add_argument("--seed", type=int, default=1, help="Makes the journeys repeatable")
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="Relative p95 increase or throughput drop reported as a regression")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        catalog = self._catalog()
+        tokens = self._shoppers(max(options["concurrency"]))
+        server = self._serve(options) if options["serve"] else None
+        try:
+            url = server.url if server else options["url"]
+            runs = {}
+            for clients in options["concurrency"]:
+                stats, elapsed = asyncio.run(self._run(url, clients, tokens, catalog, options))
+                runs[str(clients)] = stats.summary(elapsed)
+                self._report(clients, runs[str(clients)])
+        finally:
+            if server:
+                server.stop()
+
+        result = {
+            "meta": {
+                "time": time.time(),
+                "commit": self._commit(),
+                "url": "(--serve)" if server else options["url"],
+                "workers": options["workers"] if server else None,
+                "gateway_latency": options["gateway_latency"] if server else None,
+                **{key: options[key] for key in ("duration", "purchase_ratio", "think_ms", "seed")},
+            },
+            "runs": runs,
+        }
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if baseline is not None:
+            regressions = self._compare(baseline, result, options["tolerance"])
+            if regressions:
+                raise CommandError(f"{regressions} regression(s) against {options['baseline']}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
+
+    def _catalog(self):
+        categories = list(
+            Product.objects.filter(stock__gt=0, category__isnull=False)
+            .values_list("category_id", flat=True).distinct().order_by("category_id")
+        )
+        names = Product.objects.filter(stock__gt=0).order_by("pk").values_list("name", flat=True)[:500]
+        terms = sorted({word.lower() for name in names for word in name.split()[:2] if len(word) > 2})
+        if not categories or not terms:
+            raise CommandError("No categorized products in stock to shop for")
+        return categories, terms
+
+    def _shoppers(self, count):
+        """Access tokens of ``count`` active benchmark accounts, created as needed"""
+        tokens = []
+        for i in range(count):
+            user, created = User.objects.get_or_create(
+                username=f"loadtest-{i}", defaults={"email": f"loadtest-{i}@example.invalid"}
+            )
+            if created:
+                user.set_unusable_password()
+                user.save(update_fields=["password"])
+            # Minted here rather than through /login/, which is rate limited per IP
+            tokens.append(str(ClaimsRefreshToken.for_user(user).access_token))
+        return tokens
+
+    async def _run(self, url, clients, tokens, catalog, options):
+        base = url.rstrip("/") + "/"
+        stats = _Stats()
+        rng = random.Random(f"{options['seed']}-{clients}")
+        deadline = time.monotonic() + options["duration"]
+        limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+        async with httpx.AsyncClient(timeout=60, limits=limits) as http:
+            shoppers = [
+                _Shopper(http, base, tokens[i], stats, random.Random(rng.random()), catalog,
+                         options["think_ms"] / 1000)
+                for i in range(clients)
+            ]
+            started = time.monotonic()
+            await asyncio.gather(*(shopper.run(deadline, options["purchase_ratio"]) for shopper in shoppers))
+            elapsed = time.monotonic() - started
+        return stats, elapsed
+
+    def _serve(self, options):
+        server = _Server(options["workers"], options["gateway_latency"])
+        server.start()
+        return server
+
+    @staticmethod
+    def _commit():
+        try:
+            return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _report(self, clients, run):
+        self.stdout.write(f"\n{clients} shoppers, {run['elapsed']}s: " + ", ".join(
+            f"{name} {count} ({run['journeys_per_second'][name]}/s)" for name, count in sorted(run["journeys"].items())
+        ))
+        self.stdout.write(f"{'endpoint':<31} {'requests':>8} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} "
+                          f"{'queries':>7} {'db':>7} {'errors':>6}  statuses")
+        for endpoint, row in run["endpoints"].items():
+            self.stdout.write(
+                f"{endpoint:<31} {row['requests']:>8} {row['rps']:>7.1f} {row['p50_ms']:>6.1f}ms "
+                f"{row['p95_ms']:>6.1f}ms {row['p99_ms']:>6.1f}ms {row['queries_per_request']:>7.1f} "
+                f"{row['db_ms_per_request']:>5.1f}ms {row['errors']:>6}  "
+                + ", ".join(f"{status}: {n}" for status, n in row["statuses"].items())
+            )
+
+    def _compare(self, baseline, result, tolerance):
+        """Print how each endpoint moved since ``baseline``; returns the number of regressions"""
+        regressions = 0
+        self.stdout.write(f"\nAgainst {baseline['meta'].get('commit') or 'baseline'}:")
+        for clients, run in result["runs"].items():
+            before_run = baseline["runs"].get(clients)
+            if before_run is None:
+                self.stdout.write(f"{clients} shoppers: not in the baseline")
+                continue
+            for endpoint, row in run["endpoints"].items():
+                before = before_run["endpoints"].get(endpoint)
+                if not before or not before["requests"] or not row["requests"]:
+                    continue
+                problems = []
+                if min(row["requests"], before["requests"]) >= _MIN_SAMPLES:
+                    if row["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                        problems.append(f"p95 {before['p95_ms']:.1f} -> {row['p95_ms']:.1f}ms")
+                    if row["rps"] < before["rps"] * (1 - tolerance):
+                        problems.append(f"req/s {before['rps']:.1f} -> {row['rps']:.1f}")
+                # Averages move a little with the journey mix (declined cards
+                # skip queries); a whole extra query per request is a change
+                if row["queries_per_request"] >= before["queries_per_request"] + 1:
+                    problems.append(f"queries {before['queries_per_request']} -> {row['queries_per_request']}")
+                if row["errors"] > before["errors"]:
+                    problems.append(f"errors {before['errors']} -> {row['errors']}")
+                if problems:
+                    regressions += 1
+                    self.stdout.write(self.style.WARNING(f"{clients:>4} {endpoint:<31} " + "; ".join(problems)))
+        return regressions
+
+
+class _Server:
+    """uvicorn serving this project with the fake payment gateway"""
+
+    def __init__(self, workers, gateway_latency):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.workers = workers
+        self.env = {
+            **os.environ,
+            "PAYMENT_GATEWAY": "shop.gateways.FakeGateway",
+            "FAKE_GATEWAY_LATENCY": str(gateway_latency),
+            "FAKE_GATEWAY_ERROR_RATE": "0",
+            "FAKE_GATEWAY_WEBHOOK_URL": "",
+            "SERVER_TIMING": "True",  # queries and DB time per request
+            "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "backend.settings"),
+        }
+        self.process = None
+
+    def start(self, timeout=30):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "backend.asgi:application", "--host", "127.0.0.1",
+             "--port", str(self.port), "--workers", str(self.workers), "--log-level", "warning",
+             "--no-access-log"],
+            cwd=settings.BASE_DIR, env=self.env,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise CommandError(f"uvicorn exited with {self.process.returncode}")
+            try:
+                httpx.get(f"{self.url}/categories/", timeout=5)
+                return
+            except httpx.HTTPError:
+                time.sleep(0.2)
+        self.stop()
+        raise CommandError(f"uvicorn did not answer within {timeout}s")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
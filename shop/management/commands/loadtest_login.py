@@ -0,0 +1,118 @@
+import asyncio
+import random
+import secrets
+import time
+from collections import Counter
+
+import httpx
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure login latency of a real user, alone and during a credential stuffing "
+        "flood from many IPs. Run the server with NUM_PROXIES=1 so X-Forwarded-For "
+        "sets the client IP."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000")
+        parser.add_argument("--username", required=True, help="An active account")
+        parser.add_argument("--password", required=True)
+        parser.add_argument("--attack-rps", type=int, default=5000)
+        parser.add_argument("--attack-ips", type=int, default=200,
+                            help="Distinct client IPs the attack comes from")
+        parser.add_argument("--connections", type=int, default=500,
+                            help="Attack requests in flight at most")
+        parser.add_argument("--duration", type=float, default=10.0)
+        parser.add_argument("--interval", type=float, default=0.2,
+                            help="Seconds between real logins")
+        parser.add_argument("--legit-ips", type=int, default=50,
+                            help="IPs the real logins come from, in turn (keep each under login_ip)")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'phase':>8} {'logins':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'failed':>7} "
+                          f"{'attack':>8} {'req/s':>8}  attack responses")
+        for phase, attack in (("baseline", False), ("attack", True)):
+            result = asyncio.run(self._run(options, attack))
+            self._report(phase, options["duration"], *result)
+
+    async def _run(self, options, attack):
+        url = options["url"].rstrip("/") + "/login/"
+        deadline = time.monotonic() + options["duration"]
+        limits = httpx.Limits(max_connections=options["connections"] + 1)
+        async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+            legit = asyncio.create_task(self._legit(client, url, options, deadline))
+            attack_statuses = await self._attack(client, url, options, deadline) if attack else Counter()
+            timings, failed = await legit
+        return timings, failed, attack_statuses
+
+    async def _legit(self, client, url, options, deadline):
+        timings, failed = [], 0
+        credentials = {"username": options["username"], "password": options["password"]}
+        ips = [f"203.0.113.{i % 250 + 1}" for i in range(options["legit_ips"])]
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            ip = ips[(len(timings) + failed) % len(ips)]
+            try:
+                response = await client.post(
+                    url, json=credentials, headers={"X-Forwarded-For": ip}
+                )
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                timings.append(time.monotonic() - started)
+            else:
+                failed += 1
+            await asyncio.sleep(max(0.0, options["interval"] - (time.monotonic() - started)))
+        return timings, failed
+
+    async def _attack(self, client, url, options, deadline):
+        statuses = Counter()
+        slots = asyncio.Semaphore(options["connections"])
+        ips = [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(options["attack_ips"])]
+
+        async def guess():
+            try:
+                response = await client.post(
+                    url,
+                    json={"username": f"user{random.randrange(100000)}", "password": secrets.token_hex(6)},
+                    headers={"X-Forwarded-For": random.choice(ips)},
+                )
+                statuses[response.status_code] += 1
+            except httpx.HTTPError:
+                statuses["error"] += 1
+            finally:
+                slots.release()
+
+        # Send in 10ms ticks; when every slot is busy the request is dropped,
+        # so the achieved rate shows what the server actually absorbed
+        tasks = set()
+        per_tick = max(1, options["attack_rps"] // 100)
+        while time.monotonic() < deadline:
+            tick = time.monotonic()
+            for _ in range(per_tick):
+                if slots.locked():
+                    statuses["dropped"] += 1
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(guess())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            await asyncio.sleep(max(0.0, 0.01 - (time.monotonic() - tick)))
+        await asyncio.gather(*tasks)
+        return statuses
+
+    def _report(self, phase, duration, timings, failed, attack_statuses):
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(int(len(timings) * p), len(timings) - 1)] * 1000 if timings else 0
+
+        sent = sum(count for status, count in attack_statuses.items() if status != "dropped")
+        breakdown = ", ".join(f"{status}: {count}" for status, count in sorted(attack_statuses.items(), key=str))
+        self.stdout.write(
+            f"{phase:>8} {len(timings):>7} {percentile(0.5):>5.0f}ms {percentile(0.95):>5.0f}ms "
+            f"{percentile(0.99):>5.0f}ms {failed:>7} {sent:>8} {sent / duration:>8.0f}  {breakdown or '-'}"
+        )
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+
+import stripe
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from shop import stripe_client
+from shop.fake_stripe import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare PaymentIntent throughput of one sync worker (blocking stripe calls) "
+        "with one async worker (shop.stripe_client) against a local fake Stripe"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--latency", type=float, nargs="+", default=[0.5, 2.0],
+                            help="Fake Stripe latencies to test, in seconds")
+        parser.add_argument("--duration", type=float, default=10.0,
+                            help="Seconds to run each scenario")
+        parser.add_argument("--concurrency", type=int, default=100,
+                            help="Requests in flight for the async worker")
+
+    def handle(self, *args, **options):
+        duration = options["duration"]
+        concurrency = options["concurrency"]
+        # Per-request debug logging would dominate the timings
+        for name in ("stripe", "httpx", "httpcore"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+        self.stdout.write(f"{'latency':>8} {'mode':>6} {'requests':>9} {'req/s':>8} {'p50':>7} {'p99':>7} {'errors':>7}")
+        for latency in options["latency"]:
+            with FakeStripeServer(latency=latency) as server:
+                sync = self._run_sync(server.url, duration)
+                self._report(latency, "sync", sync, duration)
+
+                with override_settings(STRIPE_API_BASE=server.url, STRIPE_SECRET_KEY="sk_test_fake",
+                                       STRIPE_MAX_CONCURRENCY=max(concurrency, 1),
+                                       STRIPE_MAX_CONNECTIONS=max(concurrency, 1)):
+                    stripe_client.reset_clients()
+                    result = asyncio.run(self._run_async(duration, concurrency))
+                stripe_client.reset_clients()
+                self._report(latency, "async", result, duration)
+
+    def _run_sync(self, url, duration):
+        """What a sync gunicorn worker does: one blocking call at a time"""
+        client = stripe.StripeClient("sk_test_fake", base_addresses={"api": url}, max_network_retries=0)
+        timings, errors = [], 0
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                client.v1.payment_intents.create({"amount": 1000, "currency": "usd"})
+                timings.append(time.monotonic() - started)
+            except stripe.error.StripeError:
+                errors += 1
+        return timings, errors
+
+    async def _run_async(self, duration, concurrency):
+        timings, errors = [], 0
+        deadline = time.monotonic() + duration
+
+        async def user():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    await stripe_client.create_payment_intent(amount=1000, currency="usd")
+                    timings.append(time.monotonic() - started)
+                except (stripe.error.StripeError, stripe_client.StripeBusy):
+                    errors += 1
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        return timings, errors
+
+    def _report(self, latency, mode, result, duration):
+        timings, errors = result
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(int(len(timings) * p), len(timings) - 1)] * 1000 if timings else 0
+
+        self.stdout.write(
+            f"{latency:>7.1f}s {mode:>6} {len(timings):>9} {len(timings) / duration:>8.1f} "
+            f"{percentile(0.5):>5.0f}ms {percentile(0.99):>5.0f}ms {errors:>7}"
+        )
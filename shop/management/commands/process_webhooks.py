@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import webhooks
+
+
+class Command(BaseCommand):
+    help = "Apply stored Stripe webhook events to payments and orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200)
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="Seconds to sleep when there is nothing to process")
+        parser.add_argument("--once", action="store_true",
+                            help="Process what is pending now and exit")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        total = 0
+        started = time.monotonic()
+
+        while True:
+            processed, failed = webhooks.process_batch(batch_size)
+            total += processed
+            if processed or failed:
+                self.stdout.write(f"Applied {processed} event(s), {failed} to retry")
+
+            # A full batch means there is probably more waiting
+            if processed + failed >= batch_size:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"Done: {total} event(s) in {elapsed:.1f}s"))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import token_store
+
+
+class Command(BaseCommand):
+    help = "Delete expired outstanding and blacklisted JWTs in small chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--pause", type=float, default=0.05,
+                            help="Seconds to sleep between chunks, to leave room for other writes")
+        parser.add_argument("--interval", type=float, default=3600.0,
+                            help="Seconds between prune runs")
+        parser.add_argument("--once", action="store_true",
+                            help="Prune once and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            outstanding = blacklisted = 0
+            for chunk_outstanding, chunk_blacklisted in token_store.prune_expired(options["chunk_size"], options["pause"]):
+                outstanding += chunk_outstanding
+                blacklisted += chunk_blacklisted
+
+            self.stdout.write(self.style.SUCCESS(
+                f"Pruned {outstanding} outstanding and {blacklisted} blacklisted token(s) "
+                f"in {time.monotonic() - started:.1f}s"
+            ))
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
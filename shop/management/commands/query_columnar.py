@@ -0,0 +1,42 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import columnar
+
+
+class Command(BaseCommand):
+    help = (
+        "Run an ad-hoc query against the columnar order history, e.g. "
+        "--where 'category=Electronics' --where 'state=Goa' --where 'customer_orders>3' "
+        "--group-by week --sum quantity"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", help="Store directory (default: settings.COLUMNAR_DATA_DIR)")
+        parser.add_argument("--where", action="append", default=[],
+                            help="Filter such as 'state=Goa', 'customer_orders>3', 'category in A,B'")
+        parser.add_argument("--group-by", action="append", default=[],
+                            help=f"Column to group by, or one of: {', '.join(columnar.TIME_BUCKETS)}")
+        parser.add_argument("--sum", action="append", default=[], help="Numeric column to sum")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        try:
+            store = columnar.ColumnStore(options["path"])
+            filters = [columnar.parse_filter(expression) for expression in options["where"]]
+            started = time.monotonic()
+            results = store.query(filters=filters, group_by=options["group_by"], sums=options["sum"])
+        except FileNotFoundError:
+            raise CommandError("No columnar export found, run `manage.py export_columnar` first")
+        except (KeyError, ValueError) as e:
+            raise CommandError(str(e))
+        elapsed = time.monotonic() - started
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            for row in results:
+                self.stdout.write("  ".join(f"{key}={value}" for key, value in row.items()))
+        self.stderr.write(f"{len(results)} group(s) over {store.rows} rows in {elapsed * 1000:.0f} ms")
@@ -0,0 +1,70 @@
+import csv
+from dataclasses import asdict, fields
+from datetime import datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from shop import reconciliation
+
+
+class Command(BaseCommand):
+    help = "Reconcile pending/failed payments with the PaymentIntents Stripe has on record"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="List intents created from this date, YYYY-MM-DD (default: --days ago)")
+        parser.add_argument("--end", help="... up to this date, inclusive (default: today)")
+        parser.add_argument("--days", type=int, default=7)
+        parser.add_argument("--recorded", metavar="FILE",
+                            help="Read intents from a recorded list response (JSON) instead of Stripe")
+        parser.add_argument("--dry-run", action="store_true", help="Report only, don't change payments")
+        parser.add_argument("--report", metavar="FILE", help="Write the discrepancies to a CSV file")
+
+    def handle(self, *args, **options):
+        if options["recorded"]:
+            intents = reconciliation.load_recorded(options["recorded"])
+            source = options["recorded"]
+        else:
+            end = self._date(options["end"]) or timezone.localdate()
+            start = self._date(options["start"]) or end - timedelta(days=options["days"])
+            window = [timezone.make_aware(datetime.combine(day, time.min)) for day in (start, end + timedelta(days=1))]
+            intents = reconciliation.list_intents(*window)
+            source = f"Stripe, created {start} to {end}"
+
+        report = reconciliation.reconcile(intents, apply=not options["dry_run"])
+
+        self.stdout.write(f"Source: {source}")
+        self.stdout.write(f"{report.intents_seen} intent(s) seen, {report.payments_checked} open payment(s) checked")
+        for discrepancy in report.discrepancies:
+            self.stdout.write(
+                f"  {discrepancy.kind:<16} {discrepancy.transaction_id}  payment={discrepancy.payment_id} "
+                f"order={discrepancy.order_id} ours={discrepancy.our_status or '-'} "
+                f"stripe={discrepancy.stripe_status} {discrepancy.detail}".rstrip()
+            )
+        summary = ", ".join(
+            f"{report.count(kind)} {kind}" for kind in ("completed", "failed", "amount_mismatch", "missing_payment")
+        )
+        self.stdout.write(f"Discrepancies: {summary}")
+
+        if options["report"]:
+            with open(options["report"], "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=[column.name for column in fields(reconciliation.Discrepancy)])
+                writer.writeheader()
+                writer.writerows(asdict(d) for d in report.discrepancies)
+
+        if options["dry_run"]:
+            self.stdout.write(self.style.WARNING("Dry run, nothing changed"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Corrected {report.applied} payment(s)"))
+
+    def _date(self, value):
+        if not value:
+            return None
+        try:
+            parsed = parse_date(value)
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            raise CommandError(f"Invalid date: {value} (expected YYYY-MM-DD)")
+        return parsed
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver pending outbox events (order/payment emails and notifications)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--interval", type=float, default=1.0,
+                            help="Seconds to sleep when the outbox is empty")
+        parser.add_argument("--once", action="store_true",
+                            help="Drain what is pending now and exit")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        total = 0
+        started = time.monotonic()
+
+        while True:
+            processed, failed = outbox.relay_batch(batch_size)
+            total += processed
+            if processed or failed:
+                self.stdout.write(f"Relayed {processed} event(s), {failed} failed")
+
+            # A full batch means there is probably more waiting
+            if processed + failed >= batch_size:
+                continue
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+
+        elapsed = time.monotonic() - started
+        stats = outbox.metrics()
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {total} event(s) in {elapsed:.1f}s, "
+            f"{stats['pending']} pending, lag {stats['lag_seconds']:.1f}s"
+        ))
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop import mail
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails over a single reused connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--interval", type=float, default=2.0,
+                            help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--once", action="store_true",
+                            help="Send what is queued now and exit")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        connection = mail.get_delivery_connection()
+        total = 0
+        started = time.monotonic()
+
+        try:
+            while True:
+                sent, failed = mail.send_batch(connection, batch_size)
+                total += sent
+                if sent or failed:
+                    self.stdout.write(f"Sent {sent} email(s), {failed} failed")
+
+                # A full batch means there is probably more waiting
+                if sent + failed >= batch_size:
+                    continue
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        finally:
+            connection.close()
+
+        elapsed = time.monotonic() - started
+        stats = mail.metrics()
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {total} email(s) in {elapsed:.1f}s, "
+            f"{stats['pending']} pending, lag {stats['lag_seconds']:.1f}s"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop.analytics import update_rollups
+
+
+class Command(BaseCommand):
+    help = "Update the sales rollups with orders created or changed since the last run (run from cron)"
+
+    def handle(self, *args, **options):
+        hours = update_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {hours} hourly bucket(s)"))
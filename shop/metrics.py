@@ -0,0 +1,245 @@
+# metrics.py - Per-request timings, Server-Timing header and /metrics
+#
+# MetricsMiddleware times every request and records where the time went:
+# database queries (count and time, through connection.execute_wrapper) and
+# outbound calls wrapped in timed() - Stripe in the gateway, Cloudinary
+# uploads and SMTP sends through install(). The breakdown goes back to the
+# client as a Server-Timing header and into per-route aggregates keyed by URL
+# name: a latency histogram, request counts by status class, query counts and
+# seconds per backend. metrics_view renders them in the Prometheus text format.
+#
+# Aggregates live in each worker process. With several workers, set
+# METRICS_DIR: every worker writes a snapshot of its totals there at most
+# every METRICS_FLUSH_INTERVAL seconds, and /metrics adds them up.
+import copy
+import functools
+import hmac
+import json
+import os
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BACKENDS = ("db", "stripe", "cloudinary", "smtp")
+
+_current = ContextVar("request_timings", default=None)
+
+_routes = {}  # (route, method) -> totals, see _new_totals
+_lock = threading.Lock()
+_next_flush = 0.0
+
+
+class RequestTimings:
+    """Time spent per backend during one request; also the DB execute wrapper"""
+
+    __slots__ = ("spent", "queries")
+
+    def __init__(self):
+        self.spent = dict.fromkeys(BACKENDS, 0.0)
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.spent["db"] += time.perf_counter() - started
+            self.queries += 1
+
+
+@contextmanager
+def timed(backend):
+    """Adds the block's duration to the current request's ``backend`` time"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.spent[backend] += time.perf_counter() - started
+
+
+def _timed_function(backend, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with timed(backend):
+            return func(*args, **kwargs)
+
+    wrapper.timed_backend = backend
+    return wrapper
+
+
+def install():
+    """Time Cloudinary uploads and SMTP sends; called from ShopConfig.ready"""
+    from cloudinary import uploader
+    from django.core.mail.backends import smtp
+
+    if not hasattr(uploader.call_api, "timed_backend"):
+        uploader.call_api = _timed_function("cloudinary", uploader.call_api)
+    if not hasattr(smtp.EmailBackend.send_messages, "timed_backend"):
+        smtp.EmailBackend.send_messages = _timed_function("smtp", smtp.EmailBackend.send_messages)
+
+
+def _new_totals():
+    return {
+        "buckets": [0] * len(BUCKETS),
+        "count": 0,
+        "sum": 0.0,
+        "statuses": {},
+        "queries": 0,
+        "spent": dict.fromkeys(BACKENDS, 0.0),
+    }
+
+
+def record(route, method, status, duration, timings):
+    with _lock:
+        totals = _routes.get((route, method))
+        if totals is None:
+            totals = _routes[(route, method)] = _new_totals()
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                totals["buckets"][i] += 1
+                break
+        totals["count"] += 1
+        totals["sum"] += duration
+        status_class = f"{status // 100}xx"
+        totals["statuses"][status_class] = totals["statuses"].get(status_class, 0) + 1
+        totals["queries"] += timings.queries
+        for backend, seconds in timings.spent.items():
+            totals["spent"][backend] += seconds
+
+
+def snapshot():
+    with _lock:
+        return [[route, method, copy.deepcopy(totals)] for (route, method), totals in _routes.items()]
+
+
+def _maybe_flush():
+    global _next_flush
+    now = time.monotonic()
+    if not settings.METRICS_DIR or now < _next_flush:
+        return
+    _next_flush = now + settings.METRICS_FLUSH_INTERVAL
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _merged():
+    """This process's totals plus the last snapshots of the other workers"""
+    merged = {(route, method): totals for route, method, totals in snapshot()}
+    directory = settings.METRICS_DIR
+    if not directory or not os.path.isdir(directory):
+        return merged
+    own = f"{os.getpid()}.json"
+    for name in os.listdir(directory):
+        if not name.endswith(".json") or name == own:
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for route, method, totals in entries:
+            into = merged.setdefault((route, method), _new_totals())
+            into["buckets"] = [a + b for a, b in zip(into["buckets"], totals["buckets"])]
+            into["count"] += totals["count"]
+            into["sum"] += totals["sum"]
+            into["queries"] += totals["queries"]
+            for status_class, count in totals["statuses"].items():
+                into["statuses"][status_class] = into["statuses"].get(status_class, 0) + count
+            for backend, seconds in totals["spent"].items():
+                into["spent"][backend] = into["spent"].get(backend, 0.0) + seconds
+    return merged
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def render():
+    merged = sorted(_merged().items())
+    lines = [
+        "# HELP shop_request_duration_seconds Request latency by route",
+        "# TYPE shop_request_duration_seconds histogram",
+    ]
+    for (route, method), totals in merged:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, totals["buckets"]):
+            cumulative += count
+            lines.append(f"shop_request_duration_seconds_bucket{{{_labels(route=route, method=method, le=bound)}}} {cumulative}")
+        lines.append(f"shop_request_duration_seconds_bucket{{{_labels(route=route, method=method, le='+Inf')}}} {totals['count']}")
+        lines.append(f"shop_request_duration_seconds_sum{{{_labels(route=route, method=method)}}} {totals['sum']:.6f}")
+        lines.append(f"shop_request_duration_seconds_count{{{_labels(route=route, method=method)}}} {totals['count']}")
+
+    lines += ["# HELP shop_requests_total Requests by route and status class", "# TYPE shop_requests_total counter"]
+    for (route, method), totals in merged:
+        for status_class, count in sorted(totals["statuses"].items()):
+            lines.append(f"shop_requests_total{{{_labels(route=route, method=method, status=status_class)}}} {count}")
+
+    lines += ["# HELP shop_db_queries_total Database queries by route", "# TYPE shop_db_queries_total counter"]
+    for (route, method), totals in merged:
+        lines.append(f"shop_db_queries_total{{{_labels(route=route, method=method)}}} {totals['queries']}")
+
+    lines += [
+        "# HELP shop_backend_seconds_total Time spent in the database and external services by route",
+        "# TYPE shop_backend_seconds_total counter",
+    ]
+    for (route, method), totals in merged:
+        for backend, seconds in totals["spent"].items():
+            lines.append(
+                f"shop_backend_seconds_total{{{_labels(route=route, method=method, backend=backend)}}} {seconds:.6f}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; needs METRICS_TOKEN as a bearer token (or DEBUG)"""
+    token = settings.METRICS_TOKEN
+    if token:
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+class MetricsMiddleware:
+    """Times the request, sets Server-Timing and records the route's metrics"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(timings))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        route = match.view_name if match is not None else "unmatched"
+        record(route, request.method, response.status_code, duration, timings)
+        if settings.SERVER_TIMING:
+            parts = [f"total;dur={duration * 1000:.1f}", f'db;dur={timings.spent["db"] * 1000:.1f};desc="{timings.queries} queries"']
+            parts += [f"{backend};dur={seconds * 1000:.1f}" for backend, seconds in timings.spent.items()
+                      if seconds and backend != "db"]
+            response["Server-Timing"] = ", ".join(parts)
+        _maybe_flush()
+        return response
@@ -0,0 +1,42 @@
+# Indexes backing the admin searches (prefix and case-insensitive exact matches
+# on upper(...)). Expression indexes with text_pattern_ops are PostgreSQL
+# specific, so this is a no-op on other databases. Built CONCURRENTLY to avoid
+# locking large tables, which requires a non-atomic migration.
+
+from django.db import migrations
+
+INDEXES = [
+    ("shop_user_username_upper_idx", "shop_user", "username"),
+    ("shop_user_email_upper_idx", "shop_user", "email"),
+    ("shop_product_name_upper_idx", "shop_product", "name"),
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, table, column in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" '
+            f'ON "{table}" (UPPER("{column}"::text) text_pattern_ops)'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name, _, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('shop', '0024_salesrollup_syncwatermark'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -1,6 +1,8 @@
 # models.py
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
 from cloudinary.models import CloudinaryField
 
 # ✅ User model
@@ -11,12 +13,39 @@ class User(AbstractUser):
     state = models.CharField(max_length=100, blank=True, null=True)
     district = models.CharField(max_length=100, blank=True, null=True)
     pin_code = models.CharField(max_length=10, blank=True, null=True)  # Add this field
+    stripe_customer_id = models.CharField(max_length=255, blank=True, null=True, unique=True)
 
     email = models.EmailField(unique=True)
 
     def __str__(self):
         return self.username
 
+
+class ClaimsUser(User):
+    """
+    User rebuilt from JWT claims by shop.authentication.ClaimsJWTAuthentication.
+
+    Only id, username, is_staff and is_active are loaded; reading any other
+    field fills the rest from the per-process user cache instead of a query.
+    Read-only: load a real User to modify the account.
+    """
+
+    class Meta:
+        proxy = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        deferred = self.get_deferred_fields()
+        if fields is None or from_queryset is not None or not deferred.issuperset(fields):
+            return super().refresh_from_db(using, fields, from_queryset)
+        # A deferred field is being read: fill them all from the cached user
+        from .authentication import get_full_user
+        full_user = get_full_user(self.pk)
+        for attname in deferred:
+            setattr(self, attname, getattr(full_user, attname))
+
+    def save(self, *args, **kwargs):
+        raise TypeError("ClaimsUser is read-only; load the User from the database to modify it")
+
 # ✅ Category model
 class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -91,9 +120,53 @@ class Order(models.Model):
     shipping_district = models.CharField(max_length=100, blank=True, null=True)
     shipping_pin_code = models.CharField(max_length=10, blank=True, null=True)
 
+    # Fully rendered order document (see serializers.refresh_order_snapshot).
+    # Written at checkout and on status/payment changes, served as-is on reads.
+    snapshot = models.JSONField(null=True, blank=True, editable=False, encoder=DjangoJSONEncoder)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="order_created_at_idx"),
+        ]
+
+    # Allowed status transitions: current status -> statuses it may move to
+    STATUS_TRANSITIONS = {
+        "pending": ("processing", "cancelled"),
+        "processing": ("shipped", "cancelled"),
+        "shipped": ("delivered",),
+        "delivered": ("completed",),
+        "cancelled": (),
+        "completed": (),
+    }
+
     def __str__(self):
         return f"Order #{self.id} by {self.user.username}"
 
+    @classmethod
+    def allowed_from(cls, target_status):
+        """Statuses an order may be in to move to ``target_status``"""
+        return [
+            current for current, targets in cls.STATUS_TRANSITIONS.items()
+            if target_status in targets
+        ]
+
+
+# ✅ Order status history (one row per transition)
+class OrderStatusHistory(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="status_history")
+    from_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    to_status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    changed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    source = models.CharField(max_length=20, default="api")  # api, bulk, csv, admin, payment, webhook, reconciliation
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["-changed_at"]
+        verbose_name_plural = "order status history"
+
+    def __str__(self):
+        return f"Order #{self.order_id}: {self.from_status} -> {self.to_status}"
+
 
 # ✅ OrderItem (through table for Order-Product)
 class OrderItem(models.Model):
@@ -120,7 +193,7 @@ class Payment(models.Model):
     payment_method = models.CharField(max_length=50)  # e.g., card, UPI, COD
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     status = models.CharField(max_length=20, choices=PAYMENT_STATUS, default='pending')
-    transaction_id = models.CharField(max_length=100, blank=True, null=True)
+    transaction_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
     paid_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
@@ -129,6 +202,25 @@ class Payment(models.Model):
 
 
 
+# ✅ Local cache of a customer's saved cards, kept in sync from Stripe's
+# payment_method.* webhooks so checkout can list them without an API call.
+class SavedPaymentMethod(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="saved_payment_methods")
+    stripe_payment_method_id = models.CharField(max_length=255, unique=True)
+    brand = models.CharField(max_length=20, blank=True, default="")
+    last4 = models.CharField(max_length=4, blank=True, default="")
+    exp_month = models.PositiveSmallIntegerField(null=True, blank=True)
+    exp_year = models.PositiveSmallIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-last_used_at", "-created_at"]
+
+    def __str__(self):
+        return f"{self.brand} •••• {self.last4} ({self.user.username})"
+
+
 class Review(models.Model):
     user = models.ForeignKey(User,on_delete=models.CASCADE,related_name="reviews")
     product = models.ForeignKey(Product,on_delete=models.CASCADE,related_name="reviews")
@@ -142,4 +234,127 @@ class Review(models.Model):
         ordering = ["-created_at"]
 
     def __str__(self):
-        return f"{self.user.username} - {self.product.name} ({self.rating})"
\ No newline at end of file
+        return f"{self.user.username} - {self.product.name} ({self.rating})"
+
+# ✅ Outbox for side effects (emails, notifications) of order/payment changes.
+# Rows are written in the same transaction as the change and drained by
+# `manage.py relay_outbox`, so delivery is at-least-once.
+class OutboxEvent(models.Model):
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["available_at", "id"],
+                condition=models.Q(processed_at__isnull=True),
+                name="outbox_pending_idx",
+            ),
+            models.Index(fields=["processed_at"], name="outbox_processed_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} #{self.id}"
+
+
+# ✅ Outgoing email. `shop.mail.QueuedEmailBackend` stores messages here (in
+# the caller's transaction) and `manage.py send_queued_email` delivers them.
+class QueuedEmail(models.Model):
+    subject = models.TextField()
+    body = models.TextField(blank=True, default="")
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    cc = models.JSONField(default=list)
+    bcc = models.JSONField(default=list)
+    reply_to = models.JSONField(default=list)
+    headers = models.JSONField(default=dict)
+    alternatives = models.JSONField(default=list)  # [[content, mimetype], ...]
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["available_at", "id"],
+                condition=models.Q(sent_at__isnull=True),
+                name="email_pending_idx",
+            ),
+            models.Index(fields=["sent_at"], name="email_sent_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)}"
+
+
+# ✅ Raw Stripe webhook deliveries. The webhook view only stores the event
+# (deduplicated on Stripe's event id) and `manage.py process_webhooks` applies
+# them to payments and orders in batches.
+class WebhookEvent(models.Model):
+    event_id = models.CharField(max_length=255, unique=True)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    received_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["available_at", "id"],
+                condition=models.Q(processed_at__isnull=True),
+                name="webhook_pending_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id}"
+
+
+# ✅ Sales rollups (see analytics.py). Revenue/orders/units per hour or day,
+# by category, shipping state and payment method. `level` is "order" for
+# order-level totals and "category" for per-category rows (an order with items
+# in two categories counts once at order level and once in each category).
+class SalesRollup(models.Model):
+    GRANULARITY_CHOICES = [("hour", "Hour"), ("day", "Day")]
+    LEVEL_CHOICES = [("order", "Order"), ("category", "Category")]
+
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    level = models.CharField(max_length=8, choices=LEVEL_CHOICES)
+    period_start = models.DateTimeField()
+    category_id = models.BigIntegerField(default=0)  # 0 = uncategorized / order level
+    state = models.CharField(max_length=100, blank=True, default="")
+    payment_method = models.CharField(max_length=20, blank=True, default="")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["granularity", "level", "period_start", "category_id", "state", "payment_method"],
+                name="unique_sales_rollup_bucket",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.granularity} {self.period_start:%Y-%m-%d %H:00} ({self.level})"
+
+
+# ✅ Progress marker for incremental jobs (e.g. sales rollups)
+class SyncWatermark(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
@@ -0,0 +1,136 @@
+# nplusone.py - Flags repeated query shapes (N+1 patterns) in development
+#
+# NPlusOneMiddleware fingerprints every SQL statement of a request (parameters,
+# literals and IN lists collapsed) and warns when one shape runs
+# NPLUSONE_THRESHOLD times or more. The warning names the serializer field that
+# was being rendered when the queries ran, found by walking the stack up to
+# DRF's Serializer.to_representation, and the code that issued them.
+#
+# On when NPLUSONE_DETECT is set (defaults to DEBUG). NPLUSONE_RAISE turns the
+# warning into an NPlusOneError, which makes tests fail on the spot; capture()
+# does the same bookkeeping around any block of code.
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .profiling import code_origin
+
+logger = logging.getLogger(__name__)
+
+_DRF_SERIALIZERS = os.path.join("rest_framework", "serializers.py")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+_FRAMEWORKS = ("django" + os.sep, "rest_framework" + os.sep, "adrf" + os.sep, "asgiref" + os.sep)
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def fingerprint(sql):
+    """The query's shape: the same for every parameter value and IN list length"""
+    sql = sql.replace("%s", "?")
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+def serializer_field(frame):
+    """
+    The serializer fields being rendered at ``frame``, outermost first, as
+    "CartSerializer.product > ProductSerializer.category_name" (or None)
+    """
+    fields = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_name == "to_representation" and code.co_filename.endswith(_DRF_SERIALIZERS):
+            field = frame.f_locals.get("field")
+            serializer = frame.f_locals.get("self")
+            if field is not None and serializer is not None:
+                fields.append(f"{type(serializer).__name__}.{field.field_name}")
+        frame = frame.f_back
+    return " > ".join(reversed(fields)) or None
+
+
+def _origin(frame, depth=3):
+    """Innermost frames that issued the query, preferring ones outside Django and DRF"""
+    frames = code_origin(frame, depth=12)
+    own = [line for line in frames if not line.startswith(_FRAMEWORKS)]
+    return (own or frames)[:depth]
+
+
+class QueryLog:
+    """Counts queries by shape; also the DB execute wrapper"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.examples = {}  # shape -> (sql, serializer field, origin) of its second run
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = fingerprint(sql)
+        self.counts[shape] += 1
+        if self.counts[shape] == 2:
+            # Stack walks only for shapes that repeat; the second run is the
+            # first one issued from the loop, if there is one
+            frame = sys._getframe(1)
+            self.examples[shape] = (sql, serializer_field(frame), _origin(frame))
+        return execute(sql, params, many, context)
+
+    def repeats(self, threshold):
+        """(count, shape, field, origin) for shapes run ``threshold`` times or more, most first"""
+        return [
+            (count, shape, *self.examples[shape][1:])
+            for shape, count in self.counts.most_common()
+            if count >= threshold
+        ]
+
+    def report(self, threshold):
+        lines = []
+        for count, shape, field, origin in self.repeats(threshold):
+            lines.append(f"{count}x {shape}")
+            if field:
+                lines.append(f"    while rendering {field}")
+            lines.append(f"    from {' <- '.join(origin)}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def capture():
+    """Logs the queries of the block on every connection; yields the QueryLog"""
+    log = QueryLog()
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(log))
+        yield log
+
+
+class NPlusOneMiddleware:
+    """Warns about (or, with NPLUSONE_RAISE, fails) requests that repeat a query shape"""
+
+    def __init__(self, get_response):
+        if not settings.NPLUSONE_DETECT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with capture() as log:
+            response = self.get_response(request)
+        threshold = settings.NPLUSONE_THRESHOLD
+        repeats = log.repeats(threshold)
+        if repeats:
+            message = f"Repeated queries in {request.method} {request.path}:\n{log.report(threshold)}"
+            if settings.NPLUSONE_RAISE:
+                raise NPlusOneError(message)
+            logger.warning(message)
+            response["X-Query-Repeats"] = str(len(repeats))
+        return response
@@ -0,0 +1,114 @@
+# order_status.py - Order status state machine and bulk transitions
+import csv
+import io
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import outbox
+from .models import Order, OrderStatusHistory
+
+
+class InvalidStatus(ValueError):
+    pass
+
+
+def parse_courier_csv(uploaded_file):
+    """
+    Read order ids from a courier CSV.
+
+    Uses the ``order_id`` column when there is a header row, otherwise the
+    first column. Blank and non-numeric cells are skipped.
+    """
+    text = io.TextIOWrapper(uploaded_file, encoding="utf-8-sig")
+    rows = list(csv.reader(text))
+    if not rows:
+        return []
+
+    column = 0
+    header = [cell.strip().lower() for cell in rows[0]]
+    if "order_id" in header:
+        column = header.index("order_id")
+        rows = rows[1:]
+
+    order_ids = []
+    for row in rows:
+        if len(row) > column and row[column].strip().isdigit():
+            order_ids.append(int(row[column].strip()))
+    return order_ids
+
+
+def transition_orders(order_ids, target_status, changed_by=None, source="bulk", allowed_from=None):
+    """
+    Move orders to ``target_status`` if the state machine allows it.
+    ``allowed_from`` narrows the statuses they may move from further.
+
+    Candidate rows are locked and moved with a single
+    ``UPDATE ... WHERE id IN (...) AND status IN (allowed_from)``, then one
+    history row per order is written with ``bulk_create``.
+
+    Returns ``{order_id: {"outcome": ..., "from_status": ...}}`` where outcome
+    is one of ``updated``, ``unchanged``, ``invalid_transition`` or ``not_found``.
+    """
+    if target_status not in dict(Order.STATUS_CHOICES):
+        raise InvalidStatus(f"Invalid status: {target_status}")
+
+    order_ids = list(dict.fromkeys(int(order_id) for order_id in order_ids))
+    allowed_from = [
+        value for value in Order.allowed_from(target_status) if allowed_from is None or value in allowed_from
+    ]
+    results = {}
+
+    with transaction.atomic():
+        # Lock the rows we may move so concurrent updates can't slip in between
+        movable = dict(
+            Order.objects.select_for_update()
+            .filter(id__in=order_ids, status__in=allowed_from)
+            .values_list("id", "status")
+        )
+        if movable:
+            Order.objects.filter(id__in=movable, status__in=allowed_from).update(
+                status=target_status, updated_at=timezone.now()
+            )
+            OrderStatusHistory.objects.bulk_create([
+                OrderStatusHistory(
+                    order_id=order_id,
+                    from_status=from_status,
+                    to_status=target_status,
+                    changed_by=changed_by,
+                    source=source,
+                )
+                for order_id, from_status in movable.items()
+            ])
+            _patch_snapshot_status(movable.keys(), target_status)
+            outbox.enqueue_many(outbox.ORDER_STATUS_CHANGED, [
+                {"order_id": order_id, "from_status": from_status, "status": target_status}
+                for order_id, from_status in movable.items()
+            ])
+
+        # Explain why the remaining ids were not moved
+        remaining = [order_id for order_id in order_ids if order_id not in movable]
+        current = dict(
+            Order.objects.filter(id__in=remaining).values_list("id", "status")
+        ) if remaining else {}
+
+    for order_id in order_ids:
+        if order_id in movable:
+            results[order_id] = {"outcome": "updated", "from_status": movable[order_id]}
+        elif order_id not in current:
+            results[order_id] = {"outcome": "not_found", "from_status": None}
+        elif current[order_id] == target_status:
+            results[order_id] = {"outcome": "unchanged", "from_status": current[order_id]}
+        else:
+            results[order_id] = {"outcome": "invalid_transition", "from_status": current[order_id]}
+    return results
+
+
+def _patch_snapshot_status(order_ids, target_status):
+    """Status is the only order field that changed, so patch it in the snapshots"""
+    orders = list(
+        Order.objects.filter(id__in=list(order_ids), snapshot__isnull=False).only("id", "snapshot")
+    )
+    for order in orders:
+        order.snapshot["status"] = target_status
+    Order.objects.bulk_update(orders, ["snapshot"], batch_size=500)
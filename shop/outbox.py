@@ -0,0 +1,135 @@
+# outbox.py - Transactional outbox for order/payment side effects
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import Order, Payment, OutboxEvent
+from .utils import (
+    send_order_confirmation,
+    send_order_status_update,
+    send_payment_receipt,
+    send_payment_failed,
+)
+
+logger = logging.getLogger(__name__)
+
+ORDER_CREATED = "order.created"
+ORDER_STATUS_CHANGED = "order.status_changed"
+PAYMENT_COMPLETED = "payment.completed"
+PAYMENT_FAILED = "payment.failed"
+
+MAX_ATTEMPTS = 10
+
+
+def enqueue(event_type, **payload):
+    """
+    Record a side effect to run after commit.
+
+    Call this inside the same ``transaction.atomic()`` block as the change it
+    belongs to, so the event exists if and only if the change was committed.
+    """
+    return OutboxEvent.objects.create(event_type=event_type, payload=payload)
+
+
+def enqueue_many(event_type, payloads):
+    """Bulk version of :func:`enqueue` for bulk status changes"""
+    return OutboxEvent.objects.bulk_create(
+        [OutboxEvent(event_type=event_type, payload=payload) for payload in payloads]
+    )
+
+
+# ---------------- Handlers ----------------
+# Delivery is at-least-once, so a handler may run more than once per event.
+
+def _order_created(payload):
+    order = Order.objects.select_related("user").get(id=payload["order_id"])
+    send_order_confirmation(order)
+
+
+def _order_status_changed(payload):
+    order = Order.objects.select_related("user").get(id=payload["order_id"])
+    # Skip notifications that were overtaken by a later transition
+    if order.status == payload["status"]:
+        send_order_status_update(order)
+
+
+def _payment_completed(payload):
+    payment = Payment.objects.select_related("order__user").get(id=payload["payment_id"])
+    send_payment_receipt(payment)
+
+
+def _payment_failed(payload):
+    payment = Payment.objects.select_related("order__user").get(id=payload["payment_id"])
+    send_payment_failed(payment)
+
+
+HANDLERS = {
+    ORDER_CREATED: _order_created,
+    ORDER_STATUS_CHANGED: _order_status_changed,
+    PAYMENT_COMPLETED: _payment_completed,
+    PAYMENT_FAILED: _payment_failed,
+}
+
+
+def _retry_delay(attempts):
+    # 30s, 1m, 2m, 4m ... capped at one hour
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+
+def relay_batch(batch_size=100):
+    """
+    Process one batch of pending events.
+
+    Rows are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` so several
+    relay workers can run side by side without handing out the same event.
+    Returns ``(processed, failed)``.
+    """
+    processed = failed = 0
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, available_at__lte=timezone.now(), attempts__lt=MAX_ATTEMPTS)
+            .order_by("available_at", "id")[:batch_size]
+        )
+        for event in events:
+            handler = HANDLERS.get(event.event_type)
+            event.attempts += 1
+            try:
+                if handler is None:
+                    raise LookupError(f"No handler for {event.event_type}")
+                # Savepoint so a failing handler doesn't abort the whole batch
+                with transaction.atomic():
+                    handler(event.payload)
+            except Exception as e:
+                logger.exception(f"Outbox event {event.id} ({event.event_type}) failed")
+                event.last_error = str(e)
+                event.available_at = timezone.now() + _retry_delay(event.attempts)
+                failed += 1
+            else:
+                event.processed_at = timezone.now()
+                event.last_error = ""
+                processed += 1
+
+        OutboxEvent.objects.bulk_update(
+            events, ["attempts", "processed_at", "available_at", "last_error"]
+        )
+    return processed, failed
+
+
+def metrics():
+    """Queue depth, lag and throughput of the outbox"""
+    now = timezone.now()
+    unprocessed = OutboxEvent.objects.filter(processed_at__isnull=True)
+    pending = unprocessed.filter(attempts__lt=MAX_ATTEMPTS)
+    oldest = pending.aggregate(oldest=Min("created_at"))["oldest"]
+    processed = OutboxEvent.objects.filter(processed_at__isnull=False)
+    return {
+        "pending": pending.count(),
+        "dead": unprocessed.filter(attempts__gte=MAX_ATTEMPTS).count(),
+        "lag_seconds": (now - oldest).total_seconds() if oldest else 0.0,
+        "processed_last_minute": processed.filter(processed_at__gte=now - timedelta(minutes=1)).count(),
+        "processed_last_hour": processed.filter(processed_at__gte=now - timedelta(hours=1)).count(),
+    }
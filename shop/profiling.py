@@ -0,0 +1,298 @@
+# profiling.py - On-demand request profiling for staff
+#
+# A request is profiled when it carries a profile token in the X-Profile
+# header, signed by the server and handed out to staff in the admin
+# (/admin/profiles/) or by /admin-api/profile-token/, or when its route is
+# listed in PROFILE_SAMPLE_ROUTES ("route:N" profiles 1 in N requests). A
+# header rather than a query parameter, so tokens stay out of access logs,
+# and a token stops working once its user is no longer active staff.
+#
+# Two modes (X-Profile-Mode header, PROFILE_SAMPLE_MODE):
+# * cprofile - deterministic, but only sees the thread the middleware runs
+#   on, which is not the one running async views under ASGI;
+# * sample - a thread snapshots stacks every PROFILE_SAMPLE_INTERVAL_MS and
+#   keeps those of the request thread and any thread inside project code.
+#
+# Every SQL query is captured with its duration and the innermost frames
+# outside the ORM that issued it (for async views, those of the thread that
+# ran the query). Results are JSON files in PROFILE_DIR, of which only the
+# newest PROFILE_RING_SIZE are kept; the admin lists and shows them.
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+
+from .models import User
+
+MODES = ("cprofile", "sample")
+TOKEN_SALT = "shop.profiling"
+
+_PROFILE_ID = re.compile(r"^\d+-[0-9a-f]{8}$")
+_PROJECT_DIR = os.path.realpath(str(settings.BASE_DIR))
+_PLUMBING = tuple(
+    os.path.join(*parts) + os.sep
+    for parts in (("django", "db"), ("django", "core", "handlers"), ("django", "utils"))
+)
+_THREAD_HANDOFF = os.sep + "asgiref" + os.sep
+
+
+def issue_token(user):
+    return signing.dumps({"user": user.pk}, salt=TOKEN_SALT)
+
+
+def read_token(token):
+    """The id of the user the token was issued to if they are still active staff, or None"""
+    try:
+        user_id = signing.loads(token, salt=TOKEN_SALT, max_age=settings.PROFILE_TOKEN_MAX_AGE)["user"]
+    except (signing.BadSignature, KeyError, TypeError):
+        return None
+    if not User.objects.filter(pk=user_id, is_staff=True, is_active=True).exists():
+        return None
+    return user_id
+
+
+def _is_project_file(filename):
+    return filename.startswith(_PROJECT_DIR) and "site-packages" not in filename
+
+
+def _display_path(filename):
+    if "site-packages" in filename:
+        return filename.split("site-packages" + os.sep, 1)[-1]
+    if _is_project_file(filename):
+        return os.path.relpath(filename, _PROJECT_DIR)
+    return os.path.basename(filename)
+
+
+def code_origin(frame, depth=5):
+    """Innermost frames outside the ORM, as "path:line in function" strings"""
+    origin = []
+    while frame is not None and len(origin) < depth:
+        code = frame.f_code
+        filename = code.co_filename
+        if _THREAD_HANDOFF in filename:
+            break  # above this is whoever handed the work to this thread
+        # ORM internals and our own middleware and execute wrappers are on
+        # every stack; skip them
+        skip = (
+            any(part in filename for part in _PLUMBING)
+            or filename == __file__
+            or (_is_project_file(filename) and code.co_name in ("__call__", "process_view"))
+        )
+        if not skip:
+            origin.append(f"{_display_path(filename)}:{frame.f_lineno} in {code.co_name}")
+        frame = frame.f_back
+    # The async ORM runs queries on a worker thread, away from the awaiting view
+    return origin or ["(async ORM call)"]
+
+
+def _collapse(frame):
+    """Stack as "outer;...;inner" (the collapsed format flame graph tools read)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, request_thread, interval):
+        super().__init__(daemon=True, name="request-profiler")
+        self.request_thread = request_thread
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                if thread_id != self.request_thread and not self._in_project(frame):
+                    continue
+                self.stacks[_collapse(frame)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    @staticmethod
+    def _in_project(frame):
+        while frame is not None:
+            if _is_project_file(frame.f_code.co_filename):
+                return True
+            frame = frame.f_back
+        return False
+
+
+class ProfileSession:
+    """Profiler and SQL log for one request"""
+
+    def __init__(self, mode, trigger, user_id=None):
+        self.mode = mode
+        self.trigger = trigger
+        self.user_id = user_id
+        self.queries = []
+        self._stack = ExitStack()
+        self._profiler = None
+        self._sampler = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                "alias": context["connection"].alias,
+                "sql": sql,
+                "many": many,
+                "ms": round((time.perf_counter() - started) * 1000, 3),
+                "origin": code_origin(sys._getframe(1)),
+            })
+
+    def start(self):
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        self.started = time.perf_counter()
+        if self.mode == "sample":
+            self._sampler = _Sampler(threading.get_ident(), settings.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+            self._sampler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def finish(self, request, response):
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        duration = time.perf_counter() - self.started
+        self._stack.close()
+
+        match = request.resolver_match
+        result = {
+            "id": f"{time.time_ns()}-{uuid.uuid4().hex[:8]}",
+            "time": time.time(),
+            "method": request.method,
+            "path": request.path,
+            "route": match.view_name if match is not None else None,
+            "status": response.status_code,
+            "duration_ms": round(duration * 1000, 3),
+            "mode": self.mode,
+            "trigger": self.trigger,
+            "user": self.user_id,
+            "request_id": getattr(request, "request_id", None),
+            "queries": self.queries,
+            "sql_ms": round(sum(query["ms"] for query in self.queries), 3),
+        }
+        if self._profiler is not None:
+            result["profile"] = {
+                sort: self._stats_text(sort) for sort in ("cumulative", "tottime")
+            }
+        else:
+            result["samples"] = self._sampler.samples
+            result["stacks"] = [
+                {"stack": stack, "count": count} for stack, count in self._sampler.stacks.most_common()
+            ]
+        save(result)
+        response["X-Profile-Id"] = result["id"]
+        return result
+
+    def _stats_text(self, sort):
+        out = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=out)
+        stats.sort_stats(sort).print_stats(settings.PROFILE_TOP_FUNCTIONS)
+        return out.getvalue()
+
+
+def save(result):
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{result['id']}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(result, f)
+    os.replace(f"{path}.tmp", path)
+
+    # Ring: drop the oldest beyond PROFILE_RING_SIZE (ids sort by time)
+    names = sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+    for name in names[:-settings.PROFILE_RING_SIZE]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass  # another worker pruned it first
+
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first"""
+    directory = settings.PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        result = load(name[:-len(".json")])
+        if result is not None:
+            result["query_count"] = len(result.pop("queries"))
+            result.pop("profile", None)
+            result.pop("stacks", None)
+            profiles.append(result)
+    return profiles
+
+
+def load(profile_id):
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(settings.PROFILE_DIR, f"{profile_id}.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ProfilingMiddleware:
+    """Starts a ProfileSession before the view when asked to, stores it after"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.counters = defaultdict(itertools.count)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        session = getattr(request, "profile_session", None)
+        if session is not None:
+            session.finish(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        token = request.headers.get("X-Profile")
+        if token:
+            user_id = read_token(token)
+            if user_id is None:
+                return None
+            mode = request.headers.get("X-Profile-Mode")
+            mode = mode if mode in MODES else "cprofile"
+            request.profile_session = ProfileSession(mode, "token", user_id).start()
+            return None
+
+        route = request.resolver_match.view_name
+        every = settings.PROFILE_SAMPLE_ROUTES.get(route)
+        if every and (next(self.counters[route]) + 1) % every == 0:
+            request.profile_session = ProfileSession(settings.PROFILE_SAMPLE_MODE, "sampled").start()
+        return None
@@ -0,0 +1,172 @@
+# reconciliation.py - Batch reconciliation of payments against Stripe
+#
+# `manage.py reconcile_payments` lists the PaymentIntents created in a window
+# (auto-paginated, 100 per page), matches them in memory against every
+# pending/failed Payment by transaction_id and fixes the mismatches in bulk.
+# `reconcile()` takes any iterable of intent dicts, so it can be run against
+# a recorded list response instead of the live API.
+import json
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+import stripe
+from django.db import transaction
+from django.utils import timezone
+
+from . import outbox
+from .models import Order, Payment
+from .order_status import transition_orders
+from .webhooks import patch_payment_snapshots
+
+OPEN_STATUSES = ("pending", "failed")
+
+# Stripe statuses that mean the attempt is over without money collected
+FAILED_INTENT_STATUSES = ("canceled",)
+
+
+@dataclass
+class Discrepancy:
+    kind: str  # completed, failed, amount_mismatch, missing_payment
+    transaction_id: str
+    payment_id: int = None
+    order_id: int = None
+    our_status: str = ""
+    stripe_status: str = ""
+    detail: str = ""
+
+
+@dataclass
+class Report:
+    intents_seen: int = 0
+    payments_checked: int = 0
+    discrepancies: list = field(default_factory=list)
+    applied: int = 0
+
+    def count(self, kind):
+        return sum(1 for d in self.discrepancies if d.kind == kind)
+
+
+def list_intents(start, end):
+    """PaymentIntents created in ``[start, end)``, following Stripe's pagination"""
+    return stripe.PaymentIntent.list(
+        created={"gte": int(start.timestamp()), "lt": int(end.timestamp())},
+        limit=100,
+    ).auto_paging_iter()
+
+
+def load_recorded(path):
+    """
+    Intents from a recorded list response: a Stripe list object
+    (``{"object": "list", "data": [...]}``), an array of them, or a plain
+    array of intents.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    pages = data if isinstance(data, list) and data and data[0].get("object") == "list" else [data]
+    for page in pages:
+        yield from page["data"] if isinstance(page, dict) else page
+
+
+def _intent_outcome(intent):
+    if intent["status"] == "succeeded":
+        return "completed"
+    if intent["status"] in FAILED_INTENT_STATUSES or (
+        intent["status"] == "requires_payment_method" and intent.get("last_payment_error")
+    ):
+        return "failed"
+    return None
+
+
+def reconcile(intents, apply=True):
+    """
+    Compare ``intents`` with our open payments and, if ``apply``, correct them.
+
+    All pending/failed payments are loaded once into a dict keyed by
+    transaction_id (the build side of the hash join); intents are then
+    streamed against it. Returns a :class:`Report`.
+    """
+    report = Report()
+    open_payments = {
+        transaction_id: (payment_id, order_id, status, amount)
+        for payment_id, order_id, transaction_id, status, amount in (
+            Payment.objects.filter(status__in=OPEN_STATUSES, transaction_id__isnull=False)
+            .values_list("id", "order_id", "transaction_id", "status", "amount")
+            .iterator(chunk_size=5000)
+        )
+    }
+    report.payments_checked = len(open_payments)
+
+    unmatched_succeeded = {}
+    for intent in intents:
+        report.intents_seen += 1
+        outcome = _intent_outcome(intent)
+        match = open_payments.get(intent["id"])
+        if match is None:
+            if outcome == "completed":
+                unmatched_succeeded[intent["id"]] = (intent.get("metadata") or {}).get("order_id", "")
+            continue
+
+        payment_id, order_id, status, amount = match
+        if Decimal(intent["amount"]) != amount * 100:
+            report.discrepancies.append(Discrepancy(
+                "amount_mismatch", intent["id"], payment_id, order_id, status, intent["status"],
+                f"ours {amount}, Stripe {Decimal(intent['amount']) / 100:.2f}",
+            ))
+        if outcome and outcome != status:
+            report.discrepancies.append(Discrepancy(
+                outcome, intent["id"], payment_id, order_id, status, intent["status"],
+            ))
+
+    # Succeeded intents that aren't open here: fine if we already have them
+    # as completed, a discrepancy if we have no payment at all
+    intent_ids = list(unmatched_succeeded)
+    for start in range(0, len(intent_ids), 1000):
+        chunk = intent_ids[start:start + 1000]
+        known = set(Payment.objects.filter(transaction_id__in=chunk).values_list("transaction_id", flat=True))
+        for intent_id in chunk:
+            if intent_id not in known:
+                report.discrepancies.append(Discrepancy(
+                    "missing_payment", intent_id, stripe_status="succeeded",
+                    detail=f"order_id={unmatched_succeeded[intent_id]}",
+                ))
+
+    if apply:
+        report.applied = apply_corrections(
+            [d for d in report.discrepancies if d.kind in ("completed", "failed")]
+        )
+    return report
+
+
+def apply_corrections(discrepancies):
+    """Move payments to the status Stripe reports, with bulk updates"""
+    targets = {d.payment_id: d.kind for d in discrepancies}
+    if not targets:
+        return 0
+
+    now = timezone.now()
+    with transaction.atomic():
+        # Re-check under lock: a webhook may have fixed some in the meantime
+        payments = list(
+            Payment.objects.select_for_update()
+            .filter(id__in=list(targets), status__in=OPEN_STATUSES)
+        )
+        changed, paid_orders = [], []
+        for payment in payments:
+            target = targets[payment.id]
+            if payment.status == target:
+                continue
+            payment.status = target
+            if target == "completed":
+                payment.paid_at = now
+                paid_orders.append(payment.order_id)
+            changed.append(payment)
+
+        Payment.objects.bulk_update(changed, ["status", "paid_at"], batch_size=500)
+        transition_orders(paid_orders, "processing", source="reconciliation")
+        patch_payment_snapshots(changed)
+        for status, event_type in (("completed", outbox.PAYMENT_COMPLETED), ("failed", outbox.PAYMENT_FAILED)):
+            outbox.enqueue_many(event_type, [
+                {"payment_id": payment.id, "order_id": payment.order_id}
+                for payment in changed if payment.status == status
+            ])
+    return len(changed)
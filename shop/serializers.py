@@ -3,11 +3,18 @@ from django.contrib.auth import get_user_model
 import re  # Regular expressions for validation
 from datetime import date
 from django.utils import timezone
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
 from django.contrib.auth import authenticate
-from .models import Product , Order, OrderItem, Payment, Product ,Cart,Review ,Category
+from .models import Product , Order, OrderItem, Payment, Product ,Cart,Review ,Category, SavedPaymentMethod
+from . import outbox
+from .authentication import ClaimsRefreshToken, is_revoked, stamp_claims
 User = get_user_model()
-from django.db import transaction
+from django.db import models, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.core.serializers.json import DjangoJSONEncoder
+import json
 
 from datetime import timedelta
 from django.contrib.auth.password_validation import validate_password
@@ -128,8 +135,10 @@ class PasswordChangeSerializer(serializers.Serializer):
     new_password = serializers.CharField(write_only=True, required=True)
     confirm_password = serializers.CharField(write_only=True, required=True)
 
+    # The view passes the account as the instance: request.user is a
+    # read-only ClaimsUser
     def validate_current_password(self, value):
-        user = self.context['request'].user
+        user = self.instance
         if not user.check_password(value):
             raise serializers.ValidationError("Current password is incorrect.")
         return value
@@ -148,7 +157,7 @@ class PasswordChangeSerializer(serializers.Serializer):
         return data
 
     def save(self, **kwargs):
-        user = self.context['request'].user
+        user = self.instance
         user.set_password(self.validated_data['new_password'])
         user.save()
         return user
@@ -246,8 +255,8 @@ class UserLoginSerializer(serializers.Serializer):
         if not user:
             raise serializers.ValidationError("Invalid username or password")
 
-        # Generate JWT tokens
-        refresh = RefreshToken.for_user(user)
+        # Generate JWT tokens; the user claims let requests skip the user lookup
+        refresh = ClaimsRefreshToken.for_user(user)
 
         return {
             'refresh': str(refresh),
@@ -260,6 +269,34 @@ class UserLoginSerializer(serializers.Serializer):
             }
         }
 
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Token refresh that re-reads the user (as simplejwt does anyway) to put
+    current claims in the new tokens, and refuses revoked refresh tokens.
+    """
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        if is_revoked(refresh):
+            raise AuthenticationFailed("Token has been revoked", "token_revoked")
+        user = User.objects.filter(pk=refresh.payload.get(api_settings.USER_ID_CLAIM)).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+        stamp_claims(refresh, user)
+
+        data = {"access": str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data["refresh"] = str(refresh)
+        return data
+
+
 class ProductOrderSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
 
@@ -326,9 +363,17 @@ class PaymentSerializer(serializers.ModelSerializer):
             status='pending',
             transaction_id=f"{payment_method.upper()}-{order.id}-{timezone.now().timestamp()}"
         )
+        refresh_order_snapshot(order)
         
         return payment
     
+class SavedPaymentMethodSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SavedPaymentMethod
+        fields = ['id', 'brand', 'last4', 'exp_month', 'exp_year', 'last_used_at']
+        read_only_fields = fields
+
+
 # In your serializers.py - Update CartSerializer
 class CartSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)  # Include full product data
@@ -363,7 +408,7 @@ class CartSerializer(serializers.ModelSerializer):
 class ReviewSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     user_name = serializers.CharField(source='user.username', read_only=True)
-    user_id = serializers.IntegerField(source='user.id', read_only=True)  # Add user ID
+    user_id = serializers.IntegerField(read_only=True)  # the FK column, no user load
     product = serializers.PrimaryKeyRelatedField(read_only=True)
     is_current_user_review = serializers.SerializerMethodField()
 
@@ -378,7 +423,7 @@ class ReviewSerializer(serializers.ModelSerializer):
     def get_is_current_user_review(self, obj):
         request = self.context.get('request')
         if request and request.user.is_authenticated:
-            return obj.user.id == request.user.id
+            return obj.user_id == request.user.id
         return False
     def validate_rating(self, value):
         if value < 1 or value > 5:
@@ -400,13 +445,18 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ["id", "name", "image", "created_at", "product_image"]
 
     def get_product_image(self, obj):
-        # Use the related_name 'products' to access all products of this category
-        first_product = obj.products.first()  # Returns first Product instance or None
-        if first_product and first_product.image:
+        if hasattr(obj, "first_product_image"):
+            # Annotated by CategoryListView, saving a query per category
+            image = obj.first_product_image
+        else:
+            # Use the related_name 'products' to access all products of this category
+            first_product = obj.products.first()  # Returns first Product instance or None
+            image = first_product.image if first_product else None
+        if image:
             request = self.context.get("request")
             if request:
-                return request.build_absolute_uri(first_product.image.url)
-            return first_product.image.url
+                return request.build_absolute_uri(image.url)
+            return image.url
         return None
 
 
@@ -449,6 +499,18 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return obj.quantity * (obj.price or obj.product.price)
 # ---------------- Order Serializer ----------------
 # serializers.py - Update OrderSerializer
+class OrderListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        orders = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        # Orders not snapshotted yet (see backfill_order_snapshots) are
+        # rendered live; load what they need in one query per relation
+        prefetch_related_objects(
+            [order for order in orders if order.snapshot is None],
+            'user', 'payment', Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+        )
+        return super().to_representation(orders)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     items = serializers.SerializerMethodField()
     user_detail = serializers.SerializerMethodField()
@@ -466,6 +528,15 @@ class OrderSerializer(serializers.ModelSerializer):
             "shipping_state", "shipping_district", "shipping_pin_code"
         ]
         read_only_fields = fields
+        list_serializer_class = OrderListSerializer
+
+    def to_representation(self, instance):
+        # Serve the frozen document when we have one; orders created before
+        # snapshots existed are rendered but not saved, since this runs on
+        # reads (backfill_order_snapshots writes them)
+        if self.context.get('render_snapshot') or instance.snapshot is None:
+            return super().to_representation(instance)
+        return instance.snapshot
 
     def get_user_detail(self, obj):
         return {
@@ -474,8 +545,38 @@ class OrderSerializer(serializers.ModelSerializer):
         }
         
     def get_items(self, obj):
+        # Keep the line items exactly as they were bought
+        frozen_items = self.context.get('snapshot_items')
+        if frozen_items is not None:
+            return frozen_items
         order_items = obj.items.all()
+        if 'items' not in getattr(obj, '_prefetched_objects_cache', {}):
+            # One join instead of a product query per line
+            order_items = order_items.select_related('product')
         return OrderItemSerializer(order_items, many=True, context=self.context).data
+
+
+def refresh_order_snapshot(order, rerender_items=False):
+    """
+    (Re)write the JSON snapshot of an order.
+
+    Line items are rendered once, when the order is first snapshotted, so the
+    document keeps the product name/image/price that was actually bought.
+    Later refreshes (status or payment changes) only re-render the order level
+    fields unless ``rerender_items`` is set (e.g. items edited in the admin).
+    """
+    previous_items = None
+    if order.snapshot and not rerender_items:
+        previous_items = order.snapshot.get('items')
+
+    data = OrderSerializer(order, context={
+        'render_snapshot': True,
+        'snapshot_items': previous_items,
+    }).data
+    # Round-trip through the model encoder so the stored and served values match
+    order.snapshot = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+    Order.objects.filter(pk=order.pk).update(snapshot=order.snapshot)
+    return order.snapshot
 # In serializers.py - update OrderCreateSerializer
 # In serializers.py - update OrderCreateSerializer
 class ShippingAddressSerializer(serializers.Serializer):
@@ -559,6 +660,8 @@ class OrderCreateSerializer(serializers.ModelSerializer):
             # Card payment will be created separately during payment process
             pass
 
+        refresh_order_snapshot(order)
+        outbox.enqueue(outbox.ORDER_CREATED, order_id=order.id)
         return order
     
 class ShippingAddressSerializer(serializers.Serializer):
@@ -0,0 +1,108 @@
+# stripe_client.py - Async Stripe client for the payment views
+#
+# One pooled httpx.AsyncClient per event loop (a single one under uvicorn
+# workers), explicit connect/read timeouts and a cap on in-flight Stripe calls,
+# so a slow Stripe can't pile up unbounded work in a worker.
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+import httpx
+import stripe
+from django.conf import settings
+
+
+class StripeBusy(Exception):
+    """Too many Stripe calls in flight; the caller should answer 503"""
+
+
+class _LimitedHTTPX:
+    """The httpx module as stripe uses it, with pool limits on the clients it builds"""
+
+    def __init__(self, limits):
+        self.limits = limits
+
+    def __getattr__(self, name):
+        return getattr(httpx, name)
+
+    def AsyncClient(self, **kwargs):
+        return httpx.AsyncClient(limits=self.limits, **kwargs)
+
+    def Client(self, **kwargs):
+        return httpx.Client(limits=self.limits, **kwargs)
+
+
+class PooledHTTPXClient(stripe.HTTPXClient):
+    """stripe's httpx client, with connection pool limits"""
+
+    def __init__(self, limits, **kwargs):
+        # stripe builds its clients from the module given as _lib (pinned in
+        # requirements.txt), so only one AsyncClient is made and it keeps
+        # stripe's own verify handling, verify_ssl_certs included
+        super().__init__(_lib=_LimitedHTTPX(limits), **kwargs)
+
+
+# event loop -> (StripeClient, Semaphore). Pooled connections can't be shared
+# between loops, e.g. when async views run under a WSGI server.
+_clients = weakref.WeakKeyDictionary()
+
+
+def _build_client():
+    http_client = PooledHTTPXClient(
+        timeout=httpx.Timeout(
+            settings.STRIPE_READ_TIMEOUT,
+            connect=settings.STRIPE_CONNECT_TIMEOUT,
+        ),
+        limits=httpx.Limits(
+            max_connections=settings.STRIPE_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.STRIPE_MAX_CONNECTIONS,
+        ),
+    )
+    return stripe.StripeClient(
+        settings.STRIPE_SECRET_KEY,
+        http_client=http_client,
+        base_addresses={"api": settings.STRIPE_API_BASE},
+        max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+    )
+
+
+def _get_client():
+    loop = asyncio.get_running_loop()
+    if loop not in _clients:
+        _clients[loop] = (_build_client(), asyncio.Semaphore(settings.STRIPE_MAX_CONCURRENCY))
+    return _clients[loop]
+
+
+def reset_clients():
+    """Forget cached clients (after changing Stripe settings, e.g. in tests)"""
+    _clients.clear()
+
+
+@asynccontextmanager
+async def _slot():
+    client, semaphore = _get_client()
+    try:
+        await asyncio.wait_for(semaphore.acquire(), settings.STRIPE_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise StripeBusy("Too many payment requests in progress, please retry")
+    try:
+        yield client
+    finally:
+        semaphore.release()
+
+
+async def create_payment_intent(idempotency_key=None, **params):
+    options = {"idempotency_key": idempotency_key} if idempotency_key else {}
+    async with _slot() as client:
+        return await client.v1.payment_intents.create_async(params, options)
+
+
+async def retrieve_payment_intent(intent_id):
+    async with _slot() as client:
+        return await client.v1.payment_intents.retrieve_async(intent_id)
+
+
+async def create_customer(idempotency_key=None, **params):
+    options = {"idempotency_key": idempotency_key} if idempotency_key else {}
+    async with _slot() as client:
+        return await client.v1.customers.create_async(params, options)
@@ -6,8 +6,10 @@ django.setup()
 
 import stripe
 from django.conf import settings
+from shop.gateways import get_gateway
 
 print("Testing Stripe configuration...")
+print(f"Payment gateway: {settings.PAYMENT_GATEWAY}")
 print(f"Stripe Secret Key: {'Configured' if settings.STRIPE_SECRET_KEY else 'Missing'}")
 print(f"Stripe Publishable Key: {'Configured' if settings.STRIPE_PUBLISHABLE_KEY else 'Missing'}")
 
@@ -15,7 +17,7 @@ if settings.STRIPE_SECRET_KEY:
     try:
         stripe.api_key = settings.STRIPE_SECRET_KEY
         # Test Stripe connection
-        balance = stripe.Balance.retrieve()
+        balance = get_gateway().retrieve_balance()
         print("✅ Stripe connection successful!")
         print(f"Available balance: {balance.available[0].amount} {balance.available[0].currency}")
     except Exception as e:
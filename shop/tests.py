@@ -1,3 +1,798 @@
-from django.test import TestCase
+import logging
+import os
+import shutil
+import ssl
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import stripe
+from asgiref.sync import async_to_sync
+from django.core import mail as django_mail
+from django.core.mail import send_mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemBackend
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.checks import run_checks
+from django.db import OperationalError, connection, connections, transaction
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .authentication import ClaimsRefreshToken
+from . import authentication, db_router, mail, nplusone, outbox, profiling
+from .gateways import FakeGateway, reset_gateway
+from .log import RequestIdFilter
+from .stripe_client import PooledHTTPXClient
+from .models import (
+    Cart, Category, Order, OrderStatusHistory, OutboxEvent, Payment, Product, QueuedEmail, Review, SavedPaymentMethod, User,
+)
+from .serializers import CartSerializer, refresh_order_snapshot
+from .views import _complete_card_payment, _record_cod_payment, _stripe_customer_id
+
+
+class FingerprintTests(TestCase):
+    def test_parameters_and_literals_collapse(self):
+        self.assertEqual(
+            nplusone.fingerprint('SELECT "a" FROM "t" WHERE "id" = %s AND "name" = \'x\' LIMIT 21'),
+            'SELECT "a" FROM "t" WHERE "id" = ? AND "name" = ? LIMIT ?',
+        )
+
+    def test_in_lists_of_any_length_match(self):
+        self.assertEqual(
+            nplusone.fingerprint('SELECT * FROM "t" WHERE "id" IN (%s, %s)'),
+            nplusone.fingerprint('SELECT * FROM "t" WHERE "id" IN (%s,\n %s, %s, %s)'),
+        )
+
+
+class DetectorTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "pw")
+        for i in range(4):
+            category = Category.objects.create(name=f"Category {i}")
+            product = Product.objects.create(name=f"Product {i}", price=Decimal("10.00"), stock=5, category=category)
+            Cart.objects.create(user=self.user, product=product)
+
+    def test_names_the_serializer_field(self):
+        carts = list(Cart.objects.filter(user=self.user))  # no select_related
+        with nplusone.capture() as log:
+            CartSerializer(carts, many=True).data
+
+        repeats = log.repeats(3)
+        fields = {field for _, _, field, _ in repeats}
+        self.assertIn("CartSerializer.product", fields)
+        self.assertIn("CartSerializer.product > ProductSerializer.category_name", fields)
+        self.assertIn("while rendering CartSerializer.product", log.report(3))
+
+    def test_joined_queryset_is_clean(self):
+        carts = list(Cart.objects.filter(user=self.user).select_related("product__category"))
+        with nplusone.capture() as log:
+            CartSerializer(carts, many=True).data
+        self.assertEqual(log.repeats(2), [])
+
+
+# Most queries each endpoint may run, whatever the number of rows it returns
+QUERY_BUDGETS = {
+    "product-list-create": 2,       # count, page
+    "product-detail": 1,
+    "category-list": 2,             # count, page (first product image is a subquery)
+    "category-products": 2,
+    "review-list-create": 3,        # product exists, count, page
+    "cart-list-create": 2,
+    "order-list-create": 2,         # served from snapshots
+    "payment-list": 2,
+    "saved-payment-methods": 1,
+}
+
+
+@override_settings(NPLUSONE_DETECT=True, NPLUSONE_RAISE=True, NPLUSONE_THRESHOLD=3, DATABASE_REPLICAS=[])
+class QueryBudgetTests(TestCase):
+    """
+    Each endpoint is requested with one row and again with several: the query
+    count must stay within its budget and not grow with the rows. The N+1
+    middleware also runs, so a repeated query shape fails with the field to blame.
+    """
+
+    ROWS = 6  # stays within one page
+
+    def setUp(self):
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name="Books")
+        self.product = self.add_product()
+
+    def add_product(self):
+        count = Product.objects.count()
+        return Product.objects.create(
+            name=f"Product {count}", price=Decimal("12.50"), stock=10, category=self.category
+        )
+
+    def add_category(self):
+        category = Category.objects.create(name=f"Category {Category.objects.count()}")
+        Product.objects.create(name=f"In {category.name}", price=Decimal("1.00"), stock=1, category=category)
+
+    def add_review(self):
+        reviewer = User.objects.create_user(f"reviewer{User.objects.count()}", f"r{User.objects.count()}@example.com")
+        Review.objects.create(user=reviewer, product=self.product, rating=4, title="Good")
+
+    def add_cart_line(self):
+        Cart.objects.create(user=self.user, product=self.add_product())
+
+    def add_order(self):
+        order = Order.objects.create(user=self.user, total_price=Decimal("12.50"), payment_method="cod")
+        order.items.create(product=self.add_product(), quantity=1, price=Decimal("12.50"))
+        Payment.objects.create(order=order, payment_method="cod", amount=order.total_price, status="pending")
+        refresh_order_snapshot(order)
+
+    def add_saved_card(self):
+        count = SavedPaymentMethod.objects.count()
+        SavedPaymentMethod.objects.create(user=self.user, stripe_payment_method_id=f"pm_{count}", last4="4242")
+
+    def assertQueryBudget(self, name, add_row, **kwargs):
+        url = reverse(name, kwargs=kwargs)
+        add_row()
+        few = self.count_queries(url)
+        for _ in range(self.ROWS - 1):
+            add_row()
+        many = self.count_queries(url)
+
+        budget = QUERY_BUDGETS[name]
+        self.assertLessEqual(many, budget, f"{name}: {many} queries, budget {budget}")
+        self.assertEqual(many, few, f"{name}: {few} queries for 1 row but {many} for {self.ROWS}")
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content[:200])
+        return len(queries)
+
+    def test_product_list(self):
+        self.assertQueryBudget("product-list-create", self.add_product)
+
+    def test_product_detail(self):
+        self.assertQueryBudget("product-detail", lambda: None, pk=self.product.pk)
+
+    def test_category_list(self):
+        self.assertQueryBudget("category-list", self.add_category)
+
+    def test_category_products(self):
+        self.assertQueryBudget("category-products", self.add_product, pk=self.category.pk)
+
+    def test_reviews(self):
+        self.assertQueryBudget("review-list-create", self.add_review, product_id=self.product.pk)
+
+    def test_cart(self):
+        self.assertQueryBudget("cart-list-create", self.add_cart_line)
+
+    def test_orders(self):
+        self.assertQueryBudget("order-list-create", self.add_order)
+
+    def test_payments(self):
+        self.assertQueryBudget("payment-list", self.add_order)
+
+    def test_saved_cards(self):
+        self.assertQueryBudget("saved-payment-methods", self.add_saved_card)
+
+
+class BulkOrderStatusTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user("warehouse", "warehouse@example.com", "pw", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.orders = [Order.objects.create(user=self.staff) for _ in range(12)]
+
+    def test_moves_listed_orders(self):
+        ids = [self.orders[0].id, self.orders[11].id]
+        response = self.client.post(reverse("order-bulk-status"), {"order_ids": ids, "status": "processing"},
+                                    format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["updated"], 2)
+        self.assertEqual(set(Order.objects.filter(status="processing").values_list("id", flat=True)), set(ids))
+
+    def test_string_is_rejected(self):
+        response = self.client.post(reverse("order-bulk-status"), {"order_ids": "12", "status": "processing"},
+                                    format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exclude(status="pending").exists())
+
+    def test_non_integer_ids_are_rejected(self):
+        for order_ids in ([1.5], [True], ["1x"], [[1]]):
+            response = self.client.post(reverse("order-bulk-status"),
+                                        {"order_ids": order_ids, "status": "processing"}, format="json")
+            self.assertEqual(response.status_code, 400, order_ids)
+        self.assertFalse(Order.objects.exclude(status="pending").exists())
+
+    def test_form_body_uses_every_value(self):
+        ids = [self.orders[1].id, self.orders[11].id]
+        response = self.client.post(reverse("order-bulk-status"), {"order_ids": ids, "status": "processing"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(Order.objects.filter(status="processing").values_list("id", flat=True)), set(ids))
+        self.assertEqual(OrderStatusHistory.objects.count(), 2)
+
+
+class OrderStatusGuardTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user("owner", "owner@example.com", "pw")
+        self.order = Order.objects.create(user=self.owner, total_price=Decimal("12.50"), payment_method="cod")
+        self.client = APIClient()
+
+    def patch_status(self, user, value):
+        self.client.force_authenticate(user)
+        return self.client.patch(reverse("order-status-update", kwargs={"pk": self.order.pk}), {"status": value},
+                                 format="json")
+
+    def test_other_customers_cannot_move_the_order(self):
+        stranger = User.objects.create_user("stranger", "stranger@example.com", "pw")
+        self.assertEqual(self.patch_status(stranger, "cancelled").status_code, 404)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "pending")
+
+    def test_staff_go_through_the_state_machine(self):
+        staff = User.objects.create_user("warehouse", "warehouse@example.com", "pw", is_staff=True)
+        self.assertEqual(self.patch_status(staff, "shipped").status_code, 400)
+        self.assertEqual(self.patch_status(staff, "processing").status_code, 200)
+        self.assertEqual(self.patch_status(staff, "cancelled").status_code, 200)
+        self.assertEqual(
+            list(OrderStatusHistory.objects.order_by("id").values_list("to_status", flat=True)),
+            ["processing", "cancelled"],
+        )
+
+    def test_owner_can_only_cancel_a_pending_order(self):
+        self.assertEqual(self.patch_status(self.owner, "processing").status_code, 403)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "pending")
+        self.assertEqual(self.patch_status(self.owner, "cancelled").status_code, 200)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "cancelled")
+
+    def test_owner_cannot_cancel_once_processing(self):
+        Order.objects.filter(pk=self.order.pk).update(status="processing")
+        self.assertEqual(self.patch_status(self.owner, "cancelled").status_code, 403)
+        self.assertFalse(OrderStatusHistory.objects.exists())
+
+    def test_cod_checkout_is_recorded(self):
+        _record_cod_payment(self.order)
+        history = OrderStatusHistory.objects.get(order=self.order)
+        self.assertEqual((history.from_status, history.to_status, history.source), ("pending", "processing", "payment"))
+        self.assertEqual(self.order.snapshot["status"], "processing")
+
+    def test_payment_does_not_reopen_a_cancelled_order(self):
+        self.order.status = "cancelled"
+        self.order.save()
+        payment = Payment.objects.create(order=self.order, payment_method="card", amount=self.order.total_price)
+        _complete_card_payment(payment)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, "cancelled")
+        self.assertFalse(OrderStatusHistory.objects.exists())
+
+
+class SavedCardAuthenticationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "pw", stripe_customer_id="cus_1")
+        self.order = Order.objects.create(user=self.user, total_price=Decimal("12.50"))
+        self.card = SavedPaymentMethod.objects.create(user=self.user, stripe_payment_method_id="pm_1", last4="3155")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def pay(self, error):
+        gateway = mock.Mock(acreate_payment_intent=mock.AsyncMock(side_effect=error))
+        with mock.patch("shop.views.get_gateway", return_value=gateway):
+            return self.client.post(reverse("payment-create"), {
+                "order": self.order.id, "payment_method": "card", "saved_payment_method": self.card.id,
+            }, format="json")
+
+    def test_authentication_required_returns_the_intent(self):
+        intent = {"id": "pi_1", "object": "payment_intent", "client_secret": "pi_1_secret_x",
+                  "status": "requires_payment_method"}
+        response = self.pay(stripe.error.CardError(
+            "This payment requires authentication.", None, "authentication_required", http_status=402,
+            json_body={"error": {"type": "card_error", "code": "authentication_required", "payment_intent": intent}},
+        ))
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data["client_secret"], "pi_1_secret_x")
+        self.assertEqual(response.data["payment_method"], "pm_1")
+        self.assertTrue(response.data["requires_confirmation"])
+        self.assertEqual(Payment.objects.get(order=self.order).transaction_id, "pi_1")
+
+    def test_declined_card_is_an_error(self):
+        response = self.pay(stripe.error.CardError("Your card was declined.", None, "card_declined"))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_losing_checkout_uses_the_saved_customer(self):
+        user = User.objects.create_user("racer", "racer@example.com", "pw")
+        User.objects.filter(pk=user.pk).update(stripe_customer_id="cus_winner")  # the other checkout won
+        gateway = mock.Mock(acreate_customer=mock.AsyncMock(return_value=mock.Mock(id="cus_orphan")))
+        with mock.patch("shop.views.get_gateway", return_value=gateway):
+            self.assertEqual(async_to_sync(_stripe_customer_id)(user), "cus_winner")
+        self.assertEqual(user.stripe_customer_id, "cus_winner")
+
+
+class FlakyBackend(LocmemBackend):
+    """locmem backend that counts opens and rejects mail to bad@example.com"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened = 0
+        self.connected = False
+        self.unreachable = False
+
+    def open(self):
+        if self.unreachable:
+            raise ConnectionRefusedError("SMTP server down")
+        if self.connected:
+            return False
+        self.connected = True
+        self.opened += 1
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def send_messages(self, messages):
+        if any("bad@example.com" in message.to for message in messages):
+            raise ValueError("Recipient refused")
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND="shop.mail.QueuedEmailBackend")
+class MailQueueTests(TestCase):
+    def queue(self, *recipients):
+        for recipient in recipients:
+            send_mail("Order shipped", "On its way", "shop@example.com", [recipient])
+
+    def test_queued_in_the_callers_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.queue("a@example.com")
+                self.assertEqual(QueuedEmail.objects.count(), 1)
+                raise RuntimeError("request failed")
+        self.assertFalse(QueuedEmail.objects.exists())
+        self.assertEqual(django_mail.outbox, [])
+
+    def test_batch_reuses_one_connection(self):
+        self.queue("a@example.com", "b@example.com", "c@example.com")
+        connection = FlakyBackend()
+        self.assertEqual(mail.send_batch(connection), (3, 0))
+        self.assertEqual(len(django_mail.outbox), 3)
+        self.assertEqual(connection.opened, 1)
+        self.assertTrue(connection.connected)  # left open for the next batch
+        self.assertFalse(QueuedEmail.objects.filter(sent_at__isnull=True).exists())
+        self.assertEqual(mail.send_batch(connection), (0, 0))
+
+    def test_failures_back_off_until_max_attempts(self):
+        self.queue("bad@example.com", "a@example.com")
+        connection = FlakyBackend()
+        self.assertEqual(mail.send_batch(connection), (1, 1))
+        self.assertEqual(connection.opened, 2)  # reconnected after the refusal
+        row = QueuedEmail.objects.get(to=["bad@example.com"])
+        self.assertEqual((row.attempts, row.last_error), (1, "Recipient refused"))
+        self.assertAlmostEqual((row.available_at - timezone.now()).total_seconds(), 60, delta=5)
+        self.assertEqual(mail.send_batch(connection), (0, 0))  # not due yet
+
+        for attempt in range(2, mail.MAX_ATTEMPTS + 1):
+            QueuedEmail.objects.filter(pk=row.pk).update(available_at=timezone.now())
+            self.assertEqual(mail.send_batch(connection), (0, 1))
+        row.refresh_from_db()
+        self.assertEqual(row.attempts, mail.MAX_ATTEMPTS)
+        self.assertEqual(mail._retry_delay(row.attempts), timedelta(hours=1))
+
+        QueuedEmail.objects.filter(pk=row.pk).update(available_at=timezone.now())
+        self.assertEqual(mail.send_batch(connection), (0, 0))  # given up
+
+    def test_unreachable_server_does_not_use_an_attempt(self):
+        self.queue("a@example.com")
+        connection = FlakyBackend()
+        connection.unreachable = True
+        self.assertEqual(mail.send_batch(connection), (0, 0))
+        self.assertEqual(QueuedEmail.objects.get().attempts, 0)
+
+    def test_metrics(self):
+        self.queue("a@example.com", "bad@example.com", "c@example.com")
+        QueuedEmail.objects.filter(to=["c@example.com"]).update(attempts=mail.MAX_ATTEMPTS)
+        QueuedEmail.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        mail.send_batch(FlakyBackend())
+
+        metrics = mail.metrics()
+        self.assertEqual(
+            {key: metrics[key] for key in ("pending", "retrying", "dead", "sent_last_minute", "sent_last_hour")},
+            {"pending": 1, "retrying": 1, "dead": 1, "sent_last_minute": 1, "sent_last_hour": 1},
+        )
+        self.assertGreaterEqual(metrics["lag_seconds"], 300)
+
+
+REPLICA = "replica_test"
+
+
+@override_settings(DATABASE_REPLICAS=[REPLICA], REPLICA_PIN_SECONDS=10, REPLICA_LAG_CHECK_INTERVAL=0)
+class ReplicaRoutingTests(TestCase):
+    """
+    A second SQLite file stands in for the replica. It holds the same ids as
+    the primary under different names, so a response shows where it was read.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # Registered here rather than in settings, so the test runner doesn't
+        # try to create a test database for it
+        cls.databases = {"default", REPLICA}
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings[REPLICA] = connections.configure_settings({
+            "default": connections.settings["default"],
+            REPLICA: {"ENGINE": "django.db.backends.sqlite3",
+                      "NAME": os.path.join(cls.replica_dir, "replica.sqlite3")},
+        })[REPLICA]
+        # The router keeps migrations off replicas, so create the tables directly
+        with connections[REPLICA].schema_editor() as editor:
+            for model in apps.get_models():
+                if model._meta.managed and not model._meta.proxy:
+                    editor.create_model(model)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        shutil.rmtree(cls.replica_dir)
+
+    def setUp(self):
+        cache.clear()
+        db_router._health.clear()
+        self.client = APIClient()
+        for alias in ("default", REPLICA):
+            user = User.objects.db_manager(alias).create_user("reader", "reader@example.com", "pw")
+            category = Category.objects.using(alias).create(name=f"Books on {alias}")
+            product = Product.objects.using(alias).create(
+                name=f"Novel on {alias}", price=Decimal("9.99"), stock=3, category=category
+            )
+            Review.objects.using(alias).create(user=user, product=product, rating=5, title=f"Read on {alias}")
+        self.user, self.category, self.product = user, category, product  # same ids on both
+
+    def names(self, url, field="name"):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return {row[field] for row in response.data["results"]}
+
+    def test_anonymous_catalog_reads_use_the_replica(self):
+        with self.assertNoLogs("shop.db_router", "WARNING"):
+            self.assert_replica_reads()
+
+    def assert_replica_reads(self):
+        self.assertEqual(self.names(reverse("product-list-create")), {f"Novel on {REPLICA}"})
+        self.assertEqual(self.names(reverse("category-list")), {f"Books on {REPLICA}"})
+        self.assertEqual(self.names(reverse("category-products", kwargs={"pk": self.category.pk})),
+                         {f"Novel on {REPLICA}"})
+        self.assertEqual(self.names(reverse("review-list-create", kwargs={"product_id": self.product.pk}), "title"),
+                         {f"Read on {REPLICA}"})
+
+    def test_other_views_use_the_primary(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("product-detail", kwargs={"pk": self.product.pk}))
+        self.assertEqual(response.data["name"], "Novel on default")
+
+    def test_writes_go_to_the_primary_and_pin_the_writer(self):
+        writer = User.objects.create_user("writer", "writer@example.com", "pw")
+        self.client.force_authenticate(writer)
+        url = reverse("review-list-create", kwargs={"product_id": self.product.pk})
+        self.assertEqual(self.client.post(url, {"rating": 4, "title": "Mine"}, format="json").status_code, 201)
+        self.assertTrue(Review.objects.using("default").filter(title="Mine").exists())
+        self.assertFalse(Review.objects.using(REPLICA).filter(title="Mine").exists())
+
+        # The writer reads their own review for REPLICA_PIN_SECONDS...
+        self.assertIn("Mine", self.names(url, "title"))
+        # ...everyone else still reads the replica
+        self.client.force_authenticate(None)
+        self.assertEqual(self.names(url, "title"), {f"Read on {REPLICA}"})
+
+        cache.delete(db_router._pin_key(writer.pk))  # the pin expired
+        self.client.force_authenticate(writer)
+        self.assertEqual(self.names(url, "title"), {f"Read on {REPLICA}"})
+
+    def test_unreachable_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(connections[REPLICA], "cursor", side_effect=OperationalError("replica down")):
+            self.assertEqual(self.names(reverse("product-list-create")), {"Novel on default"})
+
+    def test_lagging_replica_falls_back_to_the_primary(self):
+        with override_settings(REPLICA_MAX_LAG=5), self.replica_lag(30.0):
+            self.assertEqual(self.names(reverse("product-list-create")), {"Novel on default"})
+        db_router._health.clear()
+        with override_settings(REPLICA_MAX_LAG=5), self.replica_lag(0.5):
+            self.assertTrue(db_router._check(REPLICA))
+
+    def replica_lag(self, seconds):
+        """Makes the replica look like a PostgreSQL standby ``seconds`` behind"""
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value.fetchone.return_value = (seconds,)
+        replica = connections[REPLICA]
+        return mock.patch.multiple(replica, vendor="postgresql", cursor=mock.Mock(return_value=cursor))
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "old-password")
+        patcher = mock.patch.object(authentication, "revoke_tokens")
+        self.revoke_tokens = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_password_change_revokes(self):
+        self.user.set_password("new-password")
+        self.user.save()
+        self.revoke_tokens.assert_called_once_with(self.user.pk)
+
+    def test_deactivation_revokes_once(self):
+        self.user.is_active = False
+        self.user.save()
+        self.user.first_name = "Gone"
+        self.user.save()
+        self.revoke_tokens.assert_called_once_with(self.user.pk)
+
+    def test_staff_changes_revoke(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.user.is_superuser = True
+        self.user.save(update_fields=["is_superuser"])
+        self.assertEqual(self.revoke_tokens.call_count, 2)
+
+    def test_other_saves_do_not_revoke(self):
+        self.user.first_name = "Sam"
+        self.user.save()
+        self.user.set_password("new-password")
+        self.user.save(update_fields=["first_name"])  # the password isn't written
+        self.revoke_tokens.assert_not_called()
+
+    @override_settings(PASSWORD_HASHERS=[
+        "django.contrib.auth.hashers.ScryptPasswordHasher", "django.contrib.auth.hashers.MD5PasswordHasher",
+    ])
+    def test_hasher_upgrade_on_login_does_not_revoke(self):
+        User.objects.filter(pk=self.user.pk).update(password=make_password("old-password", hasher="md5"))
+        user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(user.check_password("old-password"))
+        self.assertTrue(User.objects.get(pk=user.pk).password.startswith("scrypt$"))
+        self.revoke_tokens.assert_not_called()
+
+
+class ChangePasswordTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "old-Passw0rd!")
+        old = ClaimsRefreshToken.for_user(self.user).access_token
+        old["iat"] -= 10  # issued before the change, not in the same second
+        self.old_access = str(old)
+
+    def get_user(self, access):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        return client.get(reverse("user-detail"))
+
+    def test_password_change_hands_out_fresh_tokens(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.old_access}")
+        response = client.put(reverse("change-password"), {
+            "current_password": "old-Passw0rd!",
+            "new_password": "new-Passw0rd!",
+            "confirm_password": "new-Passw0rd!",
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_user(self.old_access).status_code, 401)
+        self.assertEqual(self.get_user(response.data["access"]).status_code, 200)
+
+
+class RevocationCacheCheckTests(TestCase):
+    LOCAL = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    SHARED = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://redis"}}
+
+    def error_ids(self, **kwargs):
+        return [error.id for error in run_checks(tags=["caches"], **kwargs)]
+
+    def test_several_workers_need_a_shared_cache(self):
+        with override_settings(CACHES=self.LOCAL, WEB_CONCURRENCY=1):
+            self.assertNotIn("shop.E001", self.error_ids())
+            self.assertIn("shop.E001", self.error_ids(include_deployment_checks=True))
+        with override_settings(CACHES=self.LOCAL, WEB_CONCURRENCY=4):
+            self.assertIn("shop.E001", self.error_ids())
+        with override_settings(CACHES=self.SHARED, WEB_CONCURRENCY=4):
+            self.assertNotIn("shop.E001", self.error_ids(include_deployment_checks=True))
+
+
+class ProfileTokenTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user("ops", "ops@example.com", "pw", is_staff=True)
+        self.token = profiling.issue_token(self.staff)
+        profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, profile_dir)
+        self.enterContext(override_settings(PROFILE_DIR=profile_dir))
+
+    def test_token_needs_active_staff(self):
+        self.assertEqual(profiling.read_token(self.token), self.staff.pk)
+        User.objects.filter(pk=self.staff.pk).update(is_staff=False)
+        self.assertIsNone(profiling.read_token(self.token))
+        User.objects.filter(pk=self.staff.pk).update(is_staff=True, is_active=False)
+        self.assertIsNone(profiling.read_token(self.token))
+
+    def test_only_the_header_is_read(self):
+        url = reverse("category-list")
+        self.assertEqual(self.client.get(url, {"_profile": self.token}).status_code, 200)
+        self.assertEqual(profiling.list_profiles(), [])
+        self.assertEqual(self.client.get(url, HTTP_X_PROFILE=self.token).status_code, 200)
+        self.assertEqual([profile["user"] for profile in profiling.list_profiles()], [self.staff.pk])
+
+    def test_profile_pages_are_admin_only(self):
+        self.client.get(reverse("category-list"), HTTP_X_PROFILE=self.token)
+        [profile] = profiling.list_profiles()
+        list_url, detail_url = reverse("shop_profiles"), reverse("shop_profile", args=[profile["id"]])
+        self.assertEqual(self.client.get(list_url).status_code, 302)  # to the admin login
+        self.client.force_login(self.staff)
+        self.assertContains(self.client.get(list_url), detail_url)
+        self.assertEqual(self.client.get(detail_url).status_code, 200)
+
+
+class ServerTimingTests(TestCase):
+    def test_header_only_when_enabled(self):
+        url = reverse("category-list")
+        with override_settings(SERVER_TIMING=False):
+            self.assertNotIn("Server-Timing", self.client.get(url).headers)
+        with override_settings(SERVER_TIMING=True):
+            self.assertIn('desc="', self.client.get(url).headers["Server-Timing"])
+
+
+class RequestIdLoggingTests(TestCase):
+    def test_error_responses_are_logged_with_the_request_id(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        handler.addFilter(RequestIdFilter())
+        logger = logging.getLogger("django.request")
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+
+        response = self.client.get("/api/no-such-page/", HTTP_X_REQUEST_ID="req-404")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual([record.request_id for record in records], ["req-404"])
+
+
+class PooledHTTPXClientTests(TestCase):
+    LIMITS = httpx.Limits(max_connections=3, max_keepalive_connections=3)
+
+    def test_builds_one_limited_client(self):
+        with mock.patch.object(httpx, "AsyncClient", wraps=httpx.AsyncClient) as async_client:
+            PooledHTTPXClient(limits=self.LIMITS, timeout=5)
+        async_client.assert_called_once()
+        self.assertIs(async_client.call_args.kwargs["limits"], self.LIMITS)
+        self.assertIsInstance(async_client.call_args.kwargs["verify"], ssl.SSLContext)
+
+    def test_respects_verify_ssl_certs(self):
+        with mock.patch.object(httpx, "AsyncClient", wraps=httpx.AsyncClient) as async_client:
+            PooledHTTPXClient(limits=self.LIMITS, verify_ssl_certs=False)
+        self.assertIs(async_client.call_args.kwargs["verify"], False)
+
+
+@override_settings(
+    PAYMENT_GATEWAY="shop.gateways.FakeGateway", FAKE_GATEWAY_LATENCY=0, FAKE_GATEWAY_ERROR_RATE=0,
+    FAKE_GATEWAY_DECLINE_RATE=0, FAKE_GATEWAY_WEBHOOK_URL="",
+)
+class DuplicatePaymentTests(TestCase):
+    def setUp(self):
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "pw", stripe_customer_id="cus_1")
+        self.order = Order.objects.create(user=self.user, total_price=Decimal("12.50"))
+        self.card = SavedPaymentMethod.objects.create(user=self.user, stripe_payment_method_id="pm_1", last4="4242")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_double_submit_charges_once(self):
+        body = {"order": self.order.id, "payment_method": "card", "saved_payment_method": self.card.id}
+        with mock.patch.object(FakeGateway, "_new_intent", autospec=True, side_effect=FakeGateway._new_intent) as charge:
+            first = self.client.post(reverse("payment-create"), body, format="json")
+            second = self.client.post(reverse("payment-create"), body, format="json")
+        self.assertEqual(first.status_code, 201, first.data)
+        self.assertEqual(second.status_code, 400)
+        self.assertEqual(charge.call_count, 1)
+        self.assertEqual(Payment.objects.get().status, "completed")
+
+    def test_same_idempotency_key_returns_the_same_intent(self):
+        gateway = FakeGateway()
+        params = {"amount": 1250, "currency": "usd", "payment_method": "pm_1", "confirm": True}
+        first = async_to_sync(gateway.acreate_payment_intent)(idempotency_key="payment-order-1-pm_1", **params)
+        again = async_to_sync(gateway.acreate_payment_intent)(idempotency_key="payment-order-1-pm_1", **params)
+        self.assertEqual(first.id, again.id)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        staff = User.objects.create_user("accounts", "accounts@example.com", "pw", is_staff=True)
+        self.auth = f"Bearer {ClaimsRefreshToken.for_user(staff).access_token}"
+        product = Product.objects.create(name="Lamp", price=Decimal("20.00"), stock=5,
+                                         category=Category.objects.create(name="Home"))
+        for _ in range(3):
+            order = Order.objects.create(user=staff, total_price=Decimal("20.00"))
+            order.items.create(product=product, quantity=1, price=Decimal("20.00"))
+
+    async def test_streams_asynchronously_under_asgi(self):
+        response = await AsyncClient().get(reverse("order-export", kwargs={"export_format": "csv"}),
+                                           headers={"Authorization": self.auth})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+        lines = b"".join([chunk async for chunk in response.streaming_content]).decode().splitlines()
+        self.assertEqual(len(lines), 4)  # header and one line per order item
+        self.assertTrue(lines[0].startswith("order_id,"))
+
+    def test_wsgi_gets_a_sync_stream(self):
+        response = self.client.get(reverse("order-export", kwargs={"export_format": "jsonl"}),
+                                   headers={"Authorization": self.auth})
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(b"".join(response.streaming_content).splitlines()), 3)
+
+
+class PaymentConfirmTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "pw")
+        order = Order.objects.create(user=self.user, total_price=Decimal("12.50"))
+        self.payment = Payment.objects.create(order=order, payment_method="card", amount=order.total_price,
+                                              transaction_id="pi_1")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def completed_events(self):
+        return OutboxEvent.objects.filter(event_type=outbox.PAYMENT_COMPLETED).count()
+
+    def test_repeated_confirm_completes_once(self):
+        intent = stripe.PaymentIntent.construct_from({"id": "pi_1", "status": "succeeded"}, "sk_test")
+        gateway = mock.Mock(aretrieve_payment_intent=mock.AsyncMock(return_value=intent))
+        with mock.patch("shop.views.get_gateway", return_value=gateway):
+            for _ in range(3):
+                response = self.client.post(reverse("payment-confirm"), {"payment_id": self.payment.id}, format="json")
+                self.assertEqual(response.status_code, 200)
+        self.payment.refresh_from_db()
+        paid_at = self.payment.paid_at
+        self.assertEqual(gateway.aretrieve_payment_intent.call_count, 1)
+        self.assertEqual(self.completed_events(), 1)
+        self.assertEqual(OrderStatusHistory.objects.count(), 1)
+
+        # A confirm racing the first one, with its own stale copy of the row
+        stale = Payment.objects.get(pk=self.payment.pk)
+        stale.status = "pending"
+        self.assertFalse(_complete_card_payment(stale))
+        self.assertEqual(stale.paid_at, paid_at)
+        self.assertEqual(self.completed_events(), 1)
+
+
+class UnsnapshottedOrderTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("shopper", "shopper@example.com", "pw")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name="Books")
+
+    def add_order(self):
+        order = Order.objects.create(user=self.user, total_price=Decimal("5.00"))
+        product = Product.objects.create(name=f"Book {order.pk}", price=Decimal("5.00"), stock=1,
+                                         category=self.category)
+        order.items.create(product=product, quantity=1, price=Decimal("5.00"))
+        Payment.objects.create(order=order, payment_method="cod", amount=order.total_price)
+
+    def list_orders(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("order-list-create"))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q["sql"] for q in queries if not q["sql"].startswith("SELECT")])
+        return response, len(queries)
+
+    def test_rendered_from_batched_queries_without_writes(self):
+        self.add_order()
+        _, few = self.list_orders()
+        for _ in range(4):
+            self.add_order()
+        response, many = self.list_orders()
+        self.assertEqual(many, few)
+        self.assertEqual([len(order["items"]) for order in response.data["results"]], [1] * 5)
+        self.assertEqual(response.data["results"][0]["payment_method"], "cod")
+        self.assertFalse(Order.objects.filter(snapshot__isnull=False).exists())
@@ -0,0 +1,108 @@
+# throttling.py - Cache-backed throttles for the unauthenticated account endpoints
+#
+# Login, registration and password reset are cheap to call and expensive to
+# serve (PBKDF2, SMTP), so they are throttled per client IP and per submitted
+# username/email. DRF runs throttles before the view body, i.e. before any
+# password hashing or query.
+#
+# Counting is a sliding window approximated from two fixed windows: the
+# current window's counter plus the previous one weighted by how much of it
+# still overlaps. Counters are bumped with cache.incr, atomic on the shared
+# Redis cache (REDIS_URL), and rates come from DEFAULT_THROTTLE_RATES.
+import hashlib
+
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Base class: subclasses set ``scope`` and implement ``get_cache_key``.
+    With ``count_failures_only`` the request is only checked; the view
+    calls ``record_failure`` when the attempt fails.
+    """
+    count_failures_only = False
+
+    def allow_request(self, request, view):
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        now = self.timer()
+        window = int(now // self.duration)
+        current_key = f"{key}:{window}"
+        previous = self.cache.get(f"{key}:{window - 1}", 0)
+        if self.count_failures_only:
+            current = self.cache.get(current_key, 0)
+        else:
+            current = self._hit(current_key) - 1  # requests before this one
+
+        elapsed = now - window * self.duration
+        if current + previous * (1 - elapsed / self.duration) < self.num_requests:
+            return True
+        self._wait = self.duration - elapsed
+        return False
+
+    def wait(self):
+        return getattr(self, "_wait", None)
+
+    def record_failure(self, request, view):
+        key = self.get_cache_key(request, view)
+        if key is not None:
+            self._hit(f"{key}:{int(self.timer() // self.duration)}")
+
+    def _hit(self, key):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Missing key: create it (kept for two windows), unless another
+            # request just did
+            if self.cache.add(key, 1, 2 * self.duration):
+                return 1
+            return self.cache.incr(key)
+
+
+class IPThrottle(SlidingWindowThrottle):
+    def get_cache_key(self, request, view):
+        return f"throttle:{self.scope}:{self.get_ident(request)}"
+
+
+class FieldThrottle(SlidingWindowThrottle):
+    """Keyed by a request body field (e.g. username or email), case-insensitive"""
+    field = None
+
+    def get_cache_key(self, request, view):
+        value = request.data.get(self.field) if hasattr(request.data, "get") else None
+        if not value or not isinstance(value, str):
+            return None
+        digest = hashlib.sha1(value.strip().lower().encode()).hexdigest()
+        return f"throttle:{self.scope}:{digest}"
+
+
+class LoginIPThrottle(IPThrottle):
+    scope = "login_ip"
+
+
+class LoginUsernameThrottle(FieldThrottle):
+    # Only failed logins count, so the account owner's own logins never
+    # use up the limit
+    scope = "login_username"
+    field = "username"
+    count_failures_only = True
+
+
+class RegistrationIPThrottle(IPThrottle):
+    scope = "register_ip"
+
+
+class RegistrationEmailThrottle(FieldThrottle):
+    scope = "register_email"
+    field = "email"
+
+
+class PasswordResetIPThrottle(IPThrottle):
+    scope = "password_reset_ip"
+
+
+class PasswordResetEmailThrottle(FieldThrottle):
+    scope = "password_reset_email"
+    field = "email"
@@ -0,0 +1,140 @@
+# token_store.py - Bounded simplejwt token tables
+#
+# With token_blacklist installed every login and every refresh rotation adds
+# an OutstandingToken row. `manage.py prune_tokens` deletes the expired ones
+# (and their BlacklistedToken rows) in small chunks, each in its own short
+# transaction, walking the table in primary key order: ids grow with issue
+# time, so the expired rows are the low end of the table.
+#
+# `blacklist_filter` keeps a Bloom filter of the blacklisted refresh token
+# jtis in each process. ClaimsRefreshToken only asks the database when the
+# filter says "maybe", so refresh and logout skip the blacklist query. Tokens
+# blacklisted by another process show up at the next refresh of the filter
+# (TOKEN_BLACKLIST_FILTER_REFRESH seconds).
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (no false negatives)"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        if key in self:
+            return
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class BlacklistFilter:
+    """Per-process Bloom filter of blacklisted jtis, refreshed from the database"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._synced_at = None  # wall clock of the last database read
+        self._checked_at = 0.0
+        self._built_at = 0.0
+
+    def might_contain(self, jti):
+        self._sync()
+        return jti in self._bloom
+
+    def add(self, jti):
+        """Record a token this process just blacklisted"""
+        self._sync()
+        with self._lock:
+            self._bloom.add(jti)
+
+    def reset(self):
+        with self._lock:
+            self._bloom = None
+
+    def _sync(self):
+        now = time.monotonic()
+        if self._bloom is not None and now - self._checked_at < settings.TOKEN_BLACKLIST_FILTER_REFRESH:
+            return
+        with self._lock:
+            if self._bloom is not None and now - self._checked_at < settings.TOKEN_BLACKLIST_FILTER_REFRESH:
+                return
+            if (
+                self._bloom is None
+                or self._bloom.count >= self._bloom.capacity
+                or now - self._built_at >= settings.TOKEN_BLACKLIST_FILTER_REBUILD
+            ):
+                self._rebuild(now)
+            else:
+                self._add_recent()
+            self._checked_at = now
+
+    def _rebuild(self, now):
+        # Fully rebuilt now and then so pruned tokens drop out of the filter
+        synced_at = timezone.now()
+        jtis = list(
+            BlacklistedToken.objects.filter(token__expires_at__gt=synced_at)
+            .values_list("token__jti", flat=True).iterator(chunk_size=5000)
+        )
+        bloom = BloomFilter(max(2 * len(jtis), 1024))
+        for jti in jtis:
+            bloom.add(jti)
+        self._bloom, self._synced_at, self._built_at = bloom, synced_at, now
+
+    def _add_recent(self):
+        # Overlap the previous read so rows committed late aren't missed
+        synced_at = timezone.now()
+        since = self._synced_at - timedelta(seconds=settings.TOKEN_BLACKLIST_FILTER_REFRESH + 60)
+        for jti in BlacklistedToken.objects.filter(blacklisted_at__gte=since).values_list("token__jti", flat=True):
+            self._bloom.add(jti)
+        self._synced_at = synced_at
+
+
+blacklist_filter = BlacklistFilter()
+
+
+def prune_expired(chunk_size=1000, pause=0.0):
+    """
+    Delete expired outstanding tokens and their blacklist entries, ``chunk_size``
+    at a time, each chunk in its own transaction. Yields ``(outstanding,
+    blacklisted)`` deleted per chunk.
+    """
+    now = timezone.now()
+    last_id = 0
+    while True:
+        ids = list(
+            OutstandingToken.objects.filter(id__gt=last_id, expires_at__lte=now)
+            .order_by("id").values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        with transaction.atomic():
+            blacklisted, _ = BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            outstanding, _ = OutstandingToken.objects.filter(id__in=ids).delete()
+        yield outstanding, blacklisted
+        last_id = ids[-1]
+        if pause:
+            time.sleep(pause)
@@ -1,7 +1,7 @@
 # shop/urls.py
 from django.urls import path
 from rest_framework_simplejwt.views import TokenRefreshView
-from . import views
+from . import metrics, views
 
 from .views import (
     # User Auth
@@ -13,7 +13,7 @@ from .views import (
     CategoryListView, CategoryProductListView,
 
     # Orders
-    OrderListCreateView, OrderDetailView, OrderStatusUpdateView,
+    OrderListCreateView, OrderDetailView, OrderStatusUpdateView, OrderBulkStatusUpdateView,
 
     # Cart
     CartListCreateView, CartDetailView,
@@ -51,6 +51,7 @@ urlpatterns = [
     path("orders/", OrderListCreateView.as_view(), name="order-list-create"),
     path("orders/<int:pk>/", OrderDetailView.as_view(), name="order-detail"),
     path("orders/<int:pk>/status/", OrderStatusUpdateView.as_view(), name="order-status-update"),
+    path("orders/bulk-status/", OrderBulkStatusUpdateView.as_view(), name="order-bulk-status"),
 
     # ------------------ CART ------------------
     path("cart/", CartListCreateView.as_view(), name="cart-list-create"),
@@ -62,14 +63,22 @@ urlpatterns = [
     path('payments/', views.PaymentCreateView.as_view(), name='payment-create'),
     path('payments/list/', views.PaymentListView.as_view(), name='payment-list'),
     path('payments/confirm/', views.PaymentConfirmView.as_view(), name='payment-confirm'),
+    path('payments/saved-cards/', views.SavedPaymentMethodListView.as_view(), name='saved-payment-methods'),
     path('payments/webhook/', views.stripe_webhook, name='stripe-webhook'),
     path('payments/webhook-debug/', views.webhook_debug, name='webhook-debug'),
     # urls.py - Add debug endpoint
 path('stripe-config/', views.StripeConfigView.as_view(), name='stripe-config'),
-    path("debug/", views.DebugView.as_view(), name="debug"),
+    path("metrics/", metrics.metrics_view, name="metrics"),
 
     path("token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
 
+    # ------------------ ADMIN API ------------------
+    path("admin-api/analytics/", views.SalesAnalyticsView.as_view(), name="sales-analytics"),
+    path("admin-api/outbox/", views.OutboxMetricsView.as_view(), name="outbox-metrics"),
+    path("admin-api/email-queue/", views.EmailQueueMetricsView.as_view(), name="email-queue-metrics"),
+    path("admin-api/profile-token/", views.ProfileTokenView.as_view(), name="profile-token"),
+    path("admin-api/orders/export/<str:export_format>/", views.OrderExportView.as_view(), name="order-export"),
+
     # ------------------ REVIEWS ------------------
     path("products/<int:product_id>/reviews/", ReviewListCreateView.as_view(), name="review-list-create"),
     path("reviews/<int:pk>/", ReviewDetailView.as_view(), name="review-detail"),
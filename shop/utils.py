@@ -4,6 +4,9 @@ from django.conf import settings
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
+import logging
+
+logger = logging.getLogger(__name__)
 
 def send_verification_email(user, email=None):
     email_to_verify = email or user.email
@@ -81,23 +84,109 @@ def send_verification_email(user, email=None):
         recipient_list=[email_to_verify],
     )
 
+def send_order_confirmation(order):
+    """Send order confirmation email after checkout"""
+    send_mail(
+        subject=f"Order #{order.id} confirmed",
+        message=f"""
+        Hi {order.user.username},
+
+        Thank you for your order #{order.id}.
+        Total: {order.total_price}
+        Payment method: {order.get_payment_method_display()}
+
+        You can track your order here:
+        {settings.FRONTEND_URL}/orders/{order.id}
+
+        Thank you,
+        Your App Team
+        """,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[order.user.email],
+    )
+
+
+def send_order_status_update(order):
+    """Notify the customer that their order status changed"""
+    send_mail(
+        subject=f"Order #{order.id} is now {order.get_status_display()}",
+        message=f"""
+        Hi {order.user.username},
+
+        The status of your order #{order.id} is now: {order.get_status_display()}.
+
+        {settings.FRONTEND_URL}/orders/{order.id}
+
+        Thank you,
+        Your App Team
+        """,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[order.user.email],
+    )
+
+
+def send_payment_receipt(payment):
+    """Send payment receipt once a payment is completed"""
+    order = payment.order
+    send_mail(
+        subject=f"Payment received for order #{order.id}",
+        message=f"""
+        Hi {order.user.username},
+
+        We received your payment of {payment.amount} for order #{order.id}.
+        Transaction ID: {payment.transaction_id}
+
+        Thank you,
+        Your App Team
+        """,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[order.user.email],
+    )
+
+
+def send_payment_failed(payment):
+    """Let the customer know their payment did not go through"""
+    order = payment.order
+    send_mail(
+        subject=f"Payment failed for order #{order.id}",
+        message=f"""
+        Hi {order.user.username},
+
+        Your payment for order #{order.id} could not be completed.
+        Please try again from your orders page:
+        {settings.FRONTEND_URL}/orders/{order.id}
+
+        Thank you,
+        Your App Team
+        """,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[order.user.email],
+    )
+
 import stripe
 from django.conf import settings
+from .gateways import get_gateway
+
+def stripe_customer_params(user):
+    """Fields for the user's Stripe customer. The idempotency key makes a
+    retried (or concurrent) create return the same customer."""
+    return {
+        "email": user.email,
+        "name": user.username,
+        "metadata": {
+            "user_id": user.id,
+            "username": user.username
+        },
+        "idempotency_key": f"customer-user-{user.id}",
+    }
 
 def create_stripe_customer(user):
     """Create a Stripe customer for a user"""
     try:
-        customer = stripe.Customer.create(
-            email=user.email,
-            name=user.username,
-            metadata={
-                "user_id": user.id,
-                "username": user.username
-            }
-        )
+        customer = get_gateway().create_customer(**stripe_customer_params(user))
         return customer
     except stripe.error.StripeError as e:
-        print(f"Error creating Stripe customer: {e}")
+        logger.error(f"Error creating Stripe customer: {e}")
         return None
 
 def create_payment_intent(amount, currency, customer_id=None, metadata=None):
@@ -113,8 +202,8 @@ def create_payment_intent(amount, currency, customer_id=None, metadata=None):
         if customer_id:
             intent_data['customer'] = customer_id
             
-        intent = stripe.PaymentIntent.create(**intent_data)
+        intent = get_gateway().create_payment_intent(**intent_data)
         return intent
     except stripe.error.StripeError as e:
-        print(f"Error creating PaymentIntent: {e}")
+        logger.error(f"Error creating PaymentIntent: {e}")
         return None
\ No newline at end of file
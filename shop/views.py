@@ -2,15 +2,14 @@ from rest_framework import generics, status ,permissions ,serializers ,filters
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 from django_filters.rest_framework import DjangoFilterBackend
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.encoding import force_bytes
 from django.core.mail import send_mail
 from django.conf import settings
-from .utils import send_verification_email,send_password_change_confirmation
-from django.db.models import Prefetch
+from .utils import send_verification_email,send_password_change_confirmation, stripe_customer_params
+from django.db.models import OuterRef, Prefetch, Subquery
 from rest_framework.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
@@ -22,7 +21,7 @@ from django.http import JsonResponse
 from django.utils import timezone
 
 
-from .models import User, Product ,Order, Payment ,Cart ,Review ,Category,OrderItem
+from .models import User, Product ,Order, Payment ,Cart ,Review ,Category,OrderItem, SalesRollup, SavedPaymentMethod
 from .serializers import (
     UserRegistrationSerializer,
     UserLoginSerializer,
@@ -30,13 +29,44 @@ from .serializers import (
     OrderSerializer,
     OrderCreateSerializer, 
     PaymentSerializer,
+    SavedPaymentMethodSerializer,
     CartSerializer,
     UserProfileSerializer,
     ReviewSerializer,
     CategorySerializer,
-    PasswordChangeSerializer
+    PasswordChangeSerializer,
+    refresh_order_snapshot,
 )
+from .order_status import transition_orders, parse_courier_csv
+from . import mail, outbox, profiling, webhooks
+from .exports import EXPORT_FORMATS, astream_export, export_rows, stream_export
+from .analytics import DIMENSIONS as ANALYTICS_DIMENSIONS, query_rollups
+from datetime import timedelta
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from adrf.views import APIView as AsyncAPIView
+from adrf import generics as async_generics
+from adrf.generics import aget_object_or_404
+from asgiref.sync import sync_to_async
+from . import stripe_client
+from .gateways import get_gateway
+from .authentication import ClaimsRefreshToken, aget_full_user, forget_user
+from .db_router import ReplicaReadMixin
+from .pagination import AsyncPageNumberPagination
+from .throttling import (
+    LoginIPThrottle,
+    LoginUsernameThrottle,
+    PasswordResetEmailThrottle,
+    PasswordResetIPThrottle,
+    RegistrationEmailThrottle,
+    RegistrationIPThrottle,
+)
+from django.utils.dateparse import parse_date
 from django.views.decorators.csrf import csrf_exempt
+import logging
+
+logger = logging.getLogger(__name__)
 
 # ✅ Register User
 
@@ -47,44 +77,49 @@ class EmailVerificationView(APIView):
     
     def get(self, request, uidb64, token):
         try:
-            print(f"Verifying email: uidb64={uidb64}, token={token}")
+            logger.debug(f"Verifying email: uidb64={uidb64}")
             
             # Decode the user ID
             uid = urlsafe_base64_decode(uidb64).decode()
             user = User.objects.get(pk=uid)
             
-            print(f"Found user: {user.username}")
+            logger.debug(f"Found user: {user.username}")
 
             if not default_token_generator.check_token(user, token):
-                print("Token validation failed")
+                logger.info(f"Email verification token rejected for user {user.pk}")
                 return Response({"error": "Invalid or expired verification link"}, status=status.HTTP_400_BAD_REQUEST)
 
             # Check if user is already active
             if user.is_active:
-                print("User already active")
+                logger.debug("User already active")
                 return Response({"message": "Email is already verified"}, status=status.HTTP_200_OK)
 
             # Activate the user
             user.is_active = True
             user.save()
-            print("User activated successfully")
+            logger.info(f"User {user.pk} activated")
             
             return Response({"message": "Email verified successfully"}, status=status.HTTP_200_OK)
 
         except (TypeError, ValueError, OverflowError, User.DoesNotExist) as e:
-            print(f"Error during verification: {e}")
+            logger.info(f"Invalid verification link: {e}")
             return Response({"error": "Invalid verification link"}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            print(f"Unexpected error: {e}")
+            logger.exception(f"Email verification failed: {e}")
             return Response({"error": "An error occurred during verification"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
 
 class OrderStatusUpdateView(generics.UpdateAPIView):
-    queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]  # 👈 This requires login
 
+    def get_queryset(self):
+        # ✅ Staff can move any order, customers only (cancel) their own
+        if self.request.user.is_staff:
+            return Order.objects.all()
+        return Order.objects.filter(user=self.request.user)
+
     def update(self, request, *args, **kwargs):
         order = self.get_object()
         status_value = request.data.get("status")
@@ -92,16 +127,77 @@ class OrderStatusUpdateView(generics.UpdateAPIView):
         if status_value not in dict(Order.STATUS_CHOICES):
             return Response({"error": "Invalid status"}, status=400)
 
-        order.status = status_value
-        order.save()
+        # ✅ Customers may only cancel an order they haven't paid for yet
+        allowed_from = None
+        if not request.user.is_staff:
+            if status_value != 'cancelled' or order.status != 'pending':
+                return Response({"error": "You can only cancel a pending order"}, status=403)
+            allowed_from = ['pending']  # re-checked under the row lock
+
+        result = transition_orders(
+            [order.id], status_value, changed_by=request.user, source="api", allowed_from=allowed_from
+        )[order.id]
+        if result["outcome"] == "invalid_transition":
+            return Response({
+                "error": f"Cannot change order status from {result['from_status']} to {status_value}"
+            }, status=400)
         return Response({"message": f"Order status updated to {status_value}"}, status=200)
 
 
+def _order_id(value):
+    """An order id from a JSON int or a digit string; anything else is a ValueError"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"Invalid order id: {value!r}")
+    if isinstance(value, str) and not value.strip().isdigit():
+        raise ValueError(f"Invalid order id: {value!r}")
+    return int(value)
+
+
+# Bulk status transitions for the warehouse (JSON list of ids or a courier CSV)
+class OrderBulkStatusUpdateView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        status_value = request.data.get("status")
+        if status_value not in dict(Order.STATUS_CHOICES):
+            return Response({"error": "Invalid status"}, status=400)
+
+        try:
+            if "file" in request.FILES:
+                order_ids = parse_courier_csv(request.FILES["file"])
+                source = "csv"
+            else:
+                # A form body repeats the key; JSON must send a list (a string
+                # would otherwise be split into its digits)
+                if hasattr(request.data, "getlist"):
+                    raw_ids = request.data.getlist("order_ids")
+                else:
+                    raw_ids = request.data.get("order_ids") or []
+                if not isinstance(raw_ids, list):
+                    raise TypeError("order_ids is not a list")
+                order_ids = [_order_id(order_id) for order_id in raw_ids]
+                source = "bulk"
+        except (TypeError, ValueError, UnicodeDecodeError):
+            return Response({"error": "order_ids must be a list of integers or a CSV file"}, status=400)
+
+        if not order_ids:
+            return Response({"error": "No order ids given"}, status=400)
+
+        results = transition_orders(order_ids, status_value, changed_by=request.user, source=source)
+        return Response({
+            "status": status_value,
+            "updated": sum(1 for result in results.values() if result["outcome"] == "updated"),
+            "results": [{"id": order_id, **result} for order_id, result in results.items()],
+        }, status=200)
+
+
 class UserRegistrationView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserRegistrationSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [RegistrationIPThrottle, RegistrationEmailThrottle]
 
+    @transaction.atomic  # the queued email commits with the change
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
@@ -116,11 +212,15 @@ class UserRegistrationView(generics.CreateAPIView):
 class UserLoginView(generics.GenericAPIView):
     serializer_class = UserLoginSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
             return Response(serializer.validated_data, status=status.HTTP_200_OK)
+        for throttle in self.get_throttles():
+            if isinstance(throttle, LoginUsernameThrottle):
+                throttle.record_failure(request, self)
         return Response(serializer.errors, status=status.HTTP_401_UNAUTHORIZED)
 
 
@@ -174,7 +274,8 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        # request.user is built from the token; edits need the real row
+        return User.objects.get(pk=self.request.user.pk)
 
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -185,6 +286,7 @@ class UserDetailView(generics.RetrieveUpdateAPIView):
             "message": "User profile retrieved successfully"
         })
 
+    @transaction.atomic  # the queued email commits with the change
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         user = self.get_object()
@@ -242,30 +344,32 @@ class ChangePasswordView(generics.UpdateAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        return self.request.user
+        return User.objects.get(pk=self.request.user.pk)
 
+    @transaction.atomic  # the queued email commits with the change
     def update(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data)
+        serializer = self.get_serializer(self.get_object(), data=request.data)
         
         if serializer.is_valid():
             user = serializer.save()
             
             # Update session auth hash to prevent logout
             update_session_auth_hash(request, user)
+            # ✅ Saving the password revoked every earlier JWT, this one
+            # included; hand out a fresh pair so the user stays logged in
+            refresh = ClaimsRefreshToken.for_user(user)
             
             # Send password change confirmation email
             try:
                 send_password_change_confirmation(user)
             except Exception as e:
                 # Log the error but don't fail the password change operation
-                print(f"Failed to send password change email: {e}")
-                # You can use proper logging here:
-                # import logging
-                # logger = logging.getLogger(__name__)
-                # logger.error(f"Password change email failed: {e}")
+                logger.error(f"Password change email failed: {e}")
             
             return Response({
-                "message": "Password changed successfully"
+                "message": "Password changed successfully",
+                "refresh": str(refresh),
+                "access": str(refresh.access_token),
             }, status=status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -278,7 +382,7 @@ class UserLogoutView(APIView):
         if not refresh_token:
             return Response({"error": "Refresh token is required"}, status=400)
         try:
-            token = RefreshToken(refresh_token)
+            token = ClaimsRefreshToken(refresh_token)
             token.blacklist()
             return Response({"message": "Logged out successfully"}, status=205)
         except Exception:
@@ -286,9 +390,13 @@ class UserLogoutView(APIView):
 
 
 # ✅ Product List + Create
-class ProductListCreateView(generics.ListCreateAPIView):
-    queryset = Product.objects.all().order_by('-created_at')
+# The catalog reads (products, categories, reviews) are async views: the
+# count and page come from the async ORM, relations are loaded with the page
+# so serializing it runs no queries, and writes keep the sync DRF code path.
+class ProductListCreateView(ReplicaReadMixin, async_generics.ListCreateAPIView):
+    queryset = Product.objects.select_related('category').order_by('-created_at')
     serializer_class = ProductSerializer
+    pagination_class = AsyncPageNumberPagination
     permission_classes = [permissions.IsAuthenticated]
 
     # Enable filtering, searching, ordering
@@ -303,13 +411,25 @@ class ProductListCreateView(generics.ListCreateAPIView):
         if self.request.method == "POST":
             return [permissions.IsAdminUser()]
         return [permissions.AllowAny()]
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(self.create)(request, *args, **kwargs)
 # Product Detail (Retrieve, Update, Delete)
 
-class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Product.objects.all()
+class ProductDetailView(async_generics.RetrieveUpdateDestroyAPIView):
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
 
+    async def put(self, request, *args, **kwargs):
+        return await sync_to_async(self.update)(request, *args, **kwargs)
+
+    async def patch(self, request, *args, **kwargs):
+        return await sync_to_async(self.partial_update)(request, *args, **kwargs)
+
+    async def delete(self, request, *args, **kwargs):
+        return await sync_to_async(self.destroy)(request, *args, **kwargs)
+
 
 
 # ---------------- List & Create Orders ----------------
@@ -319,17 +439,6 @@ class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
 # In views.py - Update OrderListCreateView
 # In views.py - Update OrderListCreateView
 
-# views.py - Add debug endpoint
-class DebugView(APIView):
-    permission_classes = [permissions.AllowAny]
-    
-    def get(self, request):
-        return Response({
-            "status": "ok",
-            "message": "Server is running",
-            "user_authenticated": request.user.is_authenticated,
-            "user": str(request.user) if request.user.is_authenticated else "Anonymous"
-        })
 # views.py - Fix OrderListCreateView with better error handling
 # views.py - Fix OrderListCreateView to return proper response
 # views.py - Update OrderListCreateView to return detailed errors
@@ -342,9 +451,8 @@ class OrderListCreateView(generics.ListCreateAPIView):
         return OrderSerializer
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).prefetch_related(
-            Prefetch('items', queryset=OrderItem.objects.select_related('product'))
-        ).order_by('-created_at')
+        # Orders are served from their snapshot, so no items/products join here
+        return Order.objects.filter(user=self.request.user).order_by('-created_at')
 
     def create(self, request, *args, **kwargs):
         try:
@@ -370,9 +478,7 @@ class OrderListCreateView(generics.ListCreateAPIView):
                 }, status=status.HTTP_400_BAD_REQUEST)
                 
         except Exception as e:
-            print(f"Error in order creation: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"Error in order creation: {str(e)}")
             
             return Response({
                 "success": False,
@@ -386,10 +492,8 @@ class OrderDetailView(generics.RetrieveUpdateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        # Prefetch related items and products
-        return Order.objects.filter(user=self.request.user).prefetch_related(
-            Prefetch('items', queryset=OrderItem.objects.select_related('product'))
-        )
+        # Served from the order snapshot, no need to prefetch items/products
+        return Order.objects.filter(user=self.request.user)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -405,10 +509,20 @@ class PaymentListView(generics.ListAPIView):
     serializer_class = PaymentSerializer
 
     def get_queryset(self):
+        payments = Payment.objects.filter(order__user=self.request.user).order_by('-id')
         order_id = self.request.query_params.get('order')
         if order_id:
-            return Payment.objects.filter(order_id=order_id, order__user=self.request.user)
-        return Payment.objects.filter(order__user=self.request.user)
+            return payments.filter(order_id=order_id)
+        return payments
+
+# Saved cards for checkout, served from the local cache (no Stripe call)
+class SavedPaymentMethodListView(generics.ListAPIView):
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = SavedPaymentMethodSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        return SavedPaymentMethod.objects.filter(user=self.request.user)
 
 # shop/views.py - Update CartListCreateView
 class CartListCreateView(generics.ListCreateAPIView):
@@ -416,7 +530,8 @@ class CartListCreateView(generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        # The nested product renders its category name
+        return Cart.objects.filter(user=self.request.user).select_related('product__category').order_by('-added_at')
 
     def create(self, request, *args, **kwargs):
         product_id = request.data.get('product')
@@ -442,14 +557,16 @@ class CartDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        return Cart.objects.filter(user=self.request.user).select_related('product__category')
 
 
 
 # In views.py - ForgotPasswordView
 class ForgotPasswordView(APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [PasswordResetIPThrottle, PasswordResetEmailThrottle]
 
+    @transaction.atomic  # the queued email commits with the change
     def post(self, request):
         email = request.data.get("email")
         try:
@@ -508,8 +625,9 @@ class ResetPasswordView(APIView):
             return Response({"error": str(e)}, status=500)
         
 # views.py - Update ReviewListCreateView
-class ReviewListCreateView(generics.ListCreateAPIView):
+class ReviewListCreateView(ReplicaReadMixin, async_generics.ListCreateAPIView):
     serializer_class = ReviewSerializer
+    pagination_class = AsyncPageNumberPagination
     
     def get_permissions(self):
         if self.request.method == 'GET':
@@ -518,8 +636,15 @@ class ReviewListCreateView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         product_id = self.kwargs["product_id"]
-        product = get_object_or_404(Product, id=product_id)
         return Review.objects.filter(product_id=product_id).select_related('user')
+
+    async def get(self, request, *args, **kwargs):
+        # 404 for unknown products rather than an empty page
+        await aget_object_or_404(Product, id=self.kwargs["product_id"])
+        return await self.alist(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        return await sync_to_async(self.create)(request, *args, **kwargs)
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -576,19 +701,26 @@ class ReviewDetailView(generics.RetrieveUpdateDestroyAPIView):
             raise PermissionDenied("You can only modify your own reviews.")
         return review
 # ✅ List all categories
-class CategoryListView(generics.ListAPIView):
-    queryset = Category.objects.all().order_by("-created_at")
+class CategoryListView(ReplicaReadMixin, async_generics.ListAPIView):
+    # The first product's image, instead of a query per category in the serializer
+    queryset = Category.objects.annotate(
+        first_product_image=Subquery(
+            Product.objects.filter(category=OuterRef("pk")).order_by("pk").values("image")[:1]
+        )
+    ).order_by("-created_at")
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = AsyncPageNumberPagination
 
 # ✅ Get products by category
-class CategoryProductListView(generics.ListAPIView):
+class CategoryProductListView(ReplicaReadMixin, async_generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = AsyncPageNumberPagination
 
     def get_queryset(self):
         category_id = self.kwargs["pk"]
-        return Product.objects.filter(category_id=category_id).order_by("-created_at")
+        return Product.objects.filter(category_id=category_id).select_related("category").order_by("-created_at")
 
 
 
@@ -604,12 +736,91 @@ from django.http import HttpResponse
 
 # views.py - Update PaymentCreateView to handle existing payments
 
+# DB writes for the async payment views; each runs in one transaction
+@transaction.atomic
+def _record_card_payment(order, intent, saved_card=None):
+    payment, created = Payment.objects.get_or_create(order=order, defaults={
+        "amount": order.total_price,
+        "payment_method": 'card',
+        "status": 'pending',
+        "transaction_id": intent.id,
+    })
+    if not created:
+        # A concurrent request for the same order recorded it first
+        return payment
+    if saved_card:
+        SavedPaymentMethod.objects.filter(pk=saved_card.pk).update(last_used_at=timezone.now())
+    # Saved cards are confirmed server side, so the intent may already be paid
+    if intent.status == 'succeeded':
+        _complete_card_payment(payment)
+    else:
+        refresh_order_snapshot(order)
+    return payment
+
+
+def _intent_needing_authentication(error):
+    """The PaymentIntent of an off-session charge that needs customer authentication, or None"""
+    if error.code != 'authentication_required' or error.error is None:
+        return None
+    return error.error.get('payment_intent')
+
+
+async def _stripe_customer_id(user):
+    """The user's Stripe customer, created on first card checkout"""
+    if not user.stripe_customer_id:
+        customer = await get_gateway().acreate_customer(**stripe_customer_params(user))
+        await User.objects.filter(pk=user.pk, stripe_customer_id__isnull=True).aupdate(stripe_customer_id=customer.id)
+        forget_user(user.pk)  # update() skips post_save
+        # A concurrent checkout may have saved its customer first; use that one
+        user.stripe_customer_id = await User.objects.filter(pk=user.pk).values_list(
+            'stripe_customer_id', flat=True).aget()
+    return user.stripe_customer_id
+
+
+@transaction.atomic
+def _record_cod_payment(order):
+    # For COD, create a payment record with pending status
+    payment = Payment.objects.create(
+        order=order,
+        amount=order.total_price,
+        payment_method='cod',
+        status='pending',
+        transaction_id=f"COD-{order.id}-{timezone.now().timestamp()}"
+    )
+
+    # Update order status to processing for COD
+    transition_orders([order.id], 'processing', source='payment')
+    order.refresh_from_db(fields=['status', 'updated_at'])
+    refresh_order_snapshot(order)
+    return payment
+
+
+@transaction.atomic
+def _complete_card_payment(payment):
+    """Marks the payment paid; a no-op returning False if it already was (confirm or webhook)"""
+    locked = Payment.objects.select_for_update().only('status', 'paid_at').get(pk=payment.pk)
+    if locked.status == 'completed':
+        payment.status, payment.paid_at = locked.status, locked.paid_at
+        return False
+
+    payment.status = 'completed'
+    payment.paid_at = timezone.now()
+    payment.save()
+
+    # Update order status
+    transition_orders([payment.order_id], 'processing', source='payment')
+    payment.order.refresh_from_db(fields=['status', 'updated_at'])
+    refresh_order_snapshot(payment.order)
+    outbox.enqueue(outbox.PAYMENT_COMPLETED, payment_id=payment.id, order_id=payment.order_id)
+    return True
+
+
 # views.py - Fix PaymentCreateView for Stripe
-class PaymentCreateView(generics.CreateAPIView):
+# Async so a slow Stripe response doesn't hold a worker (run under ASGI)
+class PaymentCreateView(AsyncAPIView):
     permission_classes = [permissions.IsAuthenticated]
-    serializer_class = PaymentSerializer
 
-    def create(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         try:
             order_id = request.data.get('order')
             payment_method = request.data.get('payment_method', 'card')
@@ -621,39 +832,76 @@ class PaymentCreateView(generics.CreateAPIView):
                 )
 
             try:
-                order = Order.objects.get(id=order_id, user=request.user)
+                order = await Order.objects.aget(id=order_id, user=request.user)
             except Order.DoesNotExist:
                 return Response(
                     {"error": "Order not found or does not belong to you."}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
 
+            # ✅ One payment per order: a double submit must not charge twice
+            if await Payment.objects.filter(order=order).aexists():
+                return Response(
+                    {"error": "This order already has a payment."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             # Handle different payment methods
             if payment_method == 'card':
+                saved_card = None
+                saved_card_id = request.data.get('saved_payment_method')
+                if saved_card_id:
+                    saved_card = await SavedPaymentMethod.objects.filter(id=saved_card_id, user=request.user).afirst()
+                    if saved_card is None:
+                        return Response({"error": "Saved card not found."}, status=status.HTTP_404_NOT_FOUND)
+
                 try:
+                    # request.user only has the token claims; the full user
+                    # comes from the auth cache (no sync query in async code)
+                    user = await aget_full_user(request.user.pk)
                     # Convert to cents for Stripe
                     amount_cents = int(float(order.total_price) * 100)
-                    
-                    # Create Stripe PaymentIntent
-                    intent = stripe.PaymentIntent.create(
-                        amount=amount_cents,
-                        currency=settings.STRIPE_CURRENCY.lower(),
-                        payment_method_types=['card'],
-                        metadata={
+                    intent_params = {
+                        "amount": amount_cents,
+                        "currency": settings.STRIPE_CURRENCY.lower(),
+                        "payment_method_types": ['card'],
+                        "customer": await _stripe_customer_id(user),
+                        "metadata": {
                             "order_id": order.id, 
-                            "user_id": request.user.id,
-                            "user_email": request.user.email
+                            "user_id": user.id,
+                            "user_email": user.email
                         },
-                    )
+                    }
+                    # ✅ A retry that gets past the check above (e.g. two requests
+                    # at once) gets the same intent back instead of a second charge
+                    idempotency_key = f"payment-order-{order.id}"
+                    if saved_card:
+                        # ✅ Returning customer: charge the saved card right away,
+                        # no client side confirm needed
+                        intent_params.update(
+                            payment_method=saved_card.stripe_payment_method_id,
+                            off_session=True,
+                            confirm=True,
+                        )
+                        # Per card, so a declined card can be retried with another
+                        idempotency_key += f"-{saved_card.stripe_payment_method_id}"
+                    elif request.data.get('save_card', True):
+                        # Keep the card on the customer (cached via payment_method.attached)
+                        intent_params["setup_future_usage"] = 'off_session'
+                    intent_params["idempotency_key"] = idempotency_key
+
+                    # Create Stripe PaymentIntent
+                    try:
+                        intent = await get_gateway().acreate_payment_intent(**intent_params)
+                    except stripe.error.CardError as e:
+                        # ✅ The bank wants 3D Secure: hand the intent to the
+                        # client to confirm on session instead of failing
+                        intent = _intent_needing_authentication(e) if saved_card else None
+                        if intent is None:
+                            raise
                     
                     # Create payment record in database
-                    payment = Payment.objects.create(
-                        order=order,
-                        amount=order.total_price,
-                        payment_method=payment_method,
-                        status='pending',
-                        transaction_id=intent.id,
-                    )
+                    payment = await sync_to_async(_record_card_payment)(order, intent, saved_card)
 
                     # ✅ RETURN CLIENT_SECRET FOR STRIPE
                     return Response({
@@ -662,9 +910,15 @@ class PaymentCreateView(generics.CreateAPIView):
                         "amount": str(order.total_price),
                         "status": payment.status,
                         "client_secret": intent.client_secret,  # ✅ THIS IS CRITICAL
-                        "publishable_key": settings.STRIPE_PUBLISHABLE_KEY
+                        "publishable_key": settings.STRIPE_PUBLISHABLE_KEY,
+                        # False when the saved card was already charged
+                        "requires_confirmation": payment.status != 'completed',
+                        # Confirm with this card when its bank asks for 3D Secure
+                        "payment_method": saved_card.stripe_payment_method_id if saved_card else None,
                     }, status=status.HTTP_201_CREATED)
                     
+                except stripe_client.StripeBusy as e:
+                    return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
                 except stripe.error.StripeError as e:
                     logger.error(f"Stripe error: {str(e)}")
                     return Response(
@@ -673,18 +927,7 @@ class PaymentCreateView(generics.CreateAPIView):
                     )
             
             elif payment_method == 'cod':
-                # For COD, create a payment record with pending status
-                payment = Payment.objects.create(
-                    order=order,
-                    amount=order.total_price,
-                    payment_method=payment_method,
-                    status='pending',
-                    transaction_id=f"COD-{order.id}-{timezone.now().timestamp()}"
-                )
-                
-                # Update order status to processing for COD
-                order.status = 'processing'
-                order.save()
+                payment = await sync_to_async(_record_cod_payment)(order)
                 
                 return Response({
                     "payment_id": payment.id,
@@ -701,36 +944,36 @@ class PaymentCreateView(generics.CreateAPIView):
                 )
                 
         except Exception as e:
-            logger.error(f"Payment creation error: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"Payment creation error: {str(e)}")
             return Response(
                 {"error": "Internal server error in payment creation"}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 # Add a view to confirm payment completion
-class PaymentConfirmView(APIView):
+class PaymentConfirmView(AsyncAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         payment_id = request.data.get('payment_id')
         
         try:
-            payment = Payment.objects.get(id=payment_id, order__user=request.user)
+            payment = await Payment.objects.select_related('order').aget(id=payment_id, order__user=request.user)
             
+            if payment.payment_method == 'card' and payment.status == 'completed':
+                # ✅ Already confirmed (by an earlier call or the webhook): nothing to redo
+                return Response({
+                    "status": "success",
+                    "message": "Payment already confirmed",
+                    "payment_status": payment.status
+                })
+
             if payment.payment_method == 'card':
                 # Verify the payment with Stripe
                 try:
-                    intent = stripe.PaymentIntent.retrieve(payment.transaction_id)
+                    intent = await get_gateway().aretrieve_payment_intent(payment.transaction_id)
                     
                     if intent.status == 'succeeded':
-                        payment.status = 'completed'
-                        payment.paid_at = timezone.now()
-                        payment.save()
-                        
-                        # Update order status
-                        payment.order.status = 'processing'
-                        payment.order.save()
+                        await sync_to_async(_complete_card_payment)(payment)
                         
                         return Response({
                             "status": "success",
@@ -743,6 +986,8 @@ class PaymentConfirmView(APIView):
                             "message": f"Payment not completed: {intent.status}"
                         }, status=400)
                         
+                except stripe_client.StripeBusy as e:
+                    return Response({"error": str(e)}, status=503)
                 except stripe.error.StripeError as e:
                     return Response({"error": str(e)}, status=400)
             
@@ -758,9 +1003,6 @@ class PaymentConfirmView(APIView):
             return Response({"error": "Payment not found"}, status=404)
 # # In views.py - update the stripe_webhook function
 import json
-import logging
-
-logger = logging.getLogger(__name__)
 
 @csrf_exempt
 def stripe_webhook(request):
@@ -786,16 +1028,14 @@ def stripe_webhook(request):
         logger.error("Missing Stripe signature header")
         return HttpResponse('Missing signature header', status=400)
     
-    logger.info(f"Webhook received with signature: {sig_header}")
+    logger.debug(f"Webhook received, {len(payload)} bytes")
     
     try:
         # Verify the webhook signature
-        event = stripe.Webhook.construct_event(
-            payload, sig_header, webhook_secret
+        stripe.WebhookSignature.verify_header(
+            payload.decode('utf-8'), sig_header, webhook_secret, stripe.Webhook.DEFAULT_TOLERANCE
         )
-        logger.info(f"Webhook verified successfully: {event['type']}")
-        
-    except ValueError as e:
+    except (ValueError, UnicodeDecodeError) as e:
         # Invalid payload
         logger.error(f"Invalid payload: {e}")
         return HttpResponse('Invalid payload', status=400)
@@ -807,36 +1047,20 @@ def stripe_webhook(request):
         logger.error(f"Webhook processing error: {e}")
         return HttpResponse('Webhook error', status=400)
     
-    # Handle the event based on its type
+    # Store the event and answer right away; `manage.py process_webhooks`
+    # applies it. Stripe redeliveries hit the unique event id and are skipped.
     try:
-        event_type = event['type']
-        logger.info(f"Processing event: {event_type}")
-        
-        if event_type == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-            logger.info(f"Payment succeeded: {payment_intent['id']}")
-            handle_payment_succeeded(payment_intent)
-            
-        elif event_type == 'payment_intent.payment_failed':
-            payment_intent = event['data']['object']
-            logger.info(f"Payment failed: {payment_intent['id']}")
-            handle_payment_failed(payment_intent)
-            
-        elif event_type == 'payment_intent.created':
-            payment_intent = event['data']['object']
-            logger.info(f"Payment intent created: {payment_intent['id']}")
-            
-        else:
-            logger.info(f"Unhandled event type: {event_type}")
-            
+        if not webhooks.store_event(payload):
+            logger.info("Duplicate webhook delivery ignored")
         return HttpResponse(status=200)
-        
+    except (ValueError, KeyError) as e:
+        logger.error(f"Invalid payload: {e}")
+        return HttpResponse('Invalid payload', status=400)
     except Exception as e:
-        logger.error(f"Error processing event: {e}")
+        logger.error(f"Error storing event: {e}")
         return HttpResponse('Event processing error', status=500)
 
 
-
 @csrf_exempt
 def webhook_debug(request):
     """Debug endpoint to check webhook configuration"""
@@ -871,49 +1095,86 @@ def webhook_debug(request):
     
     return HttpResponse('Method not allowed', status=405)
 
-# Add these helper functions for webhook handling if missing
-def handle_payment_succeeded(payment_intent):
-    """Handle successful payment"""
-    try:
-        payment = Payment.objects.get(transaction_id=payment_intent['id'])
-        payment.status = 'completed'
-        payment.paid_at = timezone.now()
-        payment.save()
-        
-        # Update order status
-        payment.order.status = 'processing'
-        payment.order.save()
-        
-        logger.info(f"Payment {payment_intent['id']} marked as completed")
-        
-    except Payment.DoesNotExist:
-        logger.error(f"Payment not found: {payment_intent['id']}")
-        # You might want to create a payment record if it doesn't exist
+# Streaming order export for accounting (admin only)
+class OrderExportView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, export_format):
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": f"Format must be one of: {', '.join(EXPORT_FORMATS)}"}, status=400)
+
         try:
-            order_id = payment_intent['metadata'].get('order_id')
-            if order_id:
-                order = Order.objects.get(id=order_id)
-                Payment.objects.create(
-                    order=order,
-                    amount=payment_intent['amount'] / 100,  # Convert from cents
-                    payment_method='card',
-                    status='completed',
-                    transaction_id=payment_intent['id'],
-                    paid_at=timezone.now()
-                )
-                logger.info(f"Created new payment record for {payment_intent['id']}")
-        except Exception as e:
-            logger.error(f"Error creating payment record: {e}")
+            start, end = (
+                parse_date(request.query_params[name]) if request.query_params.get(name) else None
+                for name in ("start", "end")
+            )
+        except ValueError:
+            start = end = None
+        if (request.query_params.get("start") and not start) or (request.query_params.get("end") and not end):
+            return Response({"error": "Dates must be YYYY-MM-DD"}, status=400)
 
-def handle_payment_failed(payment_intent):
-    """Handle failed payment"""
-    try:
-        payment = Payment.objects.get(transaction_id=payment_intent['id'])
-        payment.status = 'failed'
-        payment.save()
-        logger.info(f"Payment {payment_intent['id']} marked as failed")
-    except Payment.DoesNotExist:
-        logger.error(f"Payment not found for failed payment: {payment_intent['id']}")
+        statuses = [value for value in request.query_params.get("status", "").split(",") if value]
+        if any(value not in dict(Order.STATUS_CHOICES) for value in statuses):
+            return Response({"error": "Invalid status"}, status=400)
+
+        rows = export_rows(start=start, end=end, statuses=statuses)
+        content_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+        # ✅ Under ASGI only an async iterator is streamed as it's produced
+        stream = astream_export if isinstance(request._request, ASGIRequest) else stream_export
+        response = StreamingHttpResponse(stream(rows, export_format), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="orders.{export_format}"'
+        return response
+
+
+# Sales dashboard, answered from the rollup tables (admin only)
+class SalesAnalyticsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        granularity = request.query_params.get("granularity", "day")
+        if granularity not in dict(SalesRollup.GRANULARITY_CHOICES):
+            return Response({"error": "granularity must be 'hour' or 'day'"}, status=400)
+
+        group_by = [value for value in request.query_params.get("group_by", "").split(",") if value]
+        if any(value not in ANALYTICS_DIMENSIONS for value in group_by):
+            return Response({"error": f"group_by must be any of: {', '.join(ANALYTICS_DIMENSIONS)}"}, status=400)
+
+        today = timezone.localdate()
+        try:
+            start = parse_date(request.query_params.get("start", "")) or today - timedelta(days=30)
+            end = parse_date(request.query_params.get("end", "")) or today
+        except ValueError:
+            return Response({"error": "Dates must be YYYY-MM-DD"}, status=400)
+
+        data = query_rollups(start, end, granularity=granularity, group_by=group_by)
+        return Response({"start": start, "end": end, "granularity": granularity, "group_by": group_by, **data})
+
+
+# Outbox queue depth / lag / throughput for monitoring
+class OutboxMetricsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(outbox.metrics())
+
+
+# Email queue depth / lag / throughput for monitoring
+class EmailQueueMetricsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(mail.metrics())
+
+
+# Signed token that makes requests carrying it get profiled (see shop.profiling)
+class ProfileTokenView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request):
+        return Response({
+            "token": profiling.issue_token(request.user),
+            "expires_in": settings.PROFILE_TOKEN_MAX_AGE,
+        })
 
 
 # views.py - Add debug endpoint
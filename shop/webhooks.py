@@ -0,0 +1,247 @@
+# webhooks.py - Queued Stripe webhook ingestion
+#
+# The webhook view verifies the signature and stores the event with
+# `store_event`; the unique event id turns redeliveries into a no-op.
+# `process_batch` (run by `manage.py process_webhooks`) then applies the stored
+# events to payments and orders in bulk.
+import json
+import logging
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import outbox
+from .models import Order, Payment, SavedPaymentMethod, User, WebhookEvent
+from .order_status import transition_orders
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_SUCCEEDED = "payment_intent.succeeded"
+PAYMENT_FAILED = "payment_intent.payment_failed"
+HANDLED_EVENTS = (PAYMENT_SUCCEEDED, PAYMENT_FAILED)
+
+# Keep the saved card cache (SavedPaymentMethod) in step with Stripe
+CARD_SAVED_EVENTS = ("payment_method.attached", "payment_method.updated")
+CARD_REMOVED = "payment_method.detached"
+
+MAX_ATTEMPTS = 10
+
+
+class PaymentNotFound(LookupError):
+    pass
+
+
+def store_event(payload):
+    """
+    Persist a verified webhook payload (raw bytes). Returns False for an event
+    id we already have, i.e. a redelivery.
+    """
+    event = json.loads(payload)
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(event_id=event["id"], event_type=event.get("type", ""), payload=event)
+    except IntegrityError:
+        return False
+    return True
+
+
+def _retry_delay(attempts):
+    # 10s, 20s, 40s ... capped at one hour
+    return timedelta(seconds=min(10 * 2 ** (attempts - 1), 3600))
+
+
+def process_batch(batch_size=100):
+    """
+    Apply one batch of stored webhook events.
+
+    Events are claimed with ``SELECT ... FOR UPDATE SKIP LOCKED`` and applied
+    together. If the batch as a whole raises, each event is retried on its own
+    so one bad event can't hold the others back. Returns ``(processed, failed)``.
+    """
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, available_at__lte=timezone.now(), attempts__lt=MAX_ATTEMPTS)
+            .order_by("available_at", "id")[:batch_size]
+        )
+        if not events:
+            return 0, 0
+
+        try:
+            with transaction.atomic():
+                errors = apply_events(events)
+        except Exception:
+            logger.exception(f"Webhook batch of {len(events)} failed, retrying events one by one")
+            errors = {}
+            for event in events:
+                try:
+                    with transaction.atomic():
+                        errors.update(apply_events([event]))
+                except Exception as e:
+                    logger.exception(f"Webhook event {event.event_id} ({event.event_type}) failed")
+                    errors[event.id] = str(e)
+
+        now = timezone.now()
+        for event in events:
+            event.attempts += 1
+            if event.id in errors:
+                event.last_error = errors[event.id]
+                event.available_at = now + _retry_delay(event.attempts)
+            else:
+                event.processed_at = now
+                event.last_error = ""
+        WebhookEvent.objects.bulk_update(events, ["attempts", "processed_at", "available_at", "last_error"])
+
+    failed = len(errors)
+    return len(events) - failed, failed
+
+
+def apply_events(events):
+    """
+    Apply payment events to ``Payment``/``Order`` rows with bulk queries.
+
+    Only the newest event per PaymentIntent counts, and a completed payment is
+    never moved back to failed. Card attach/detach events refresh the saved
+    card cache. Returns ``{event pk: error}`` for events that should be
+    retried (e.g. the payment row isn't committed yet).
+    """
+    # Newest event per PaymentIntent / PaymentMethod, by Stripe's creation time
+    latest, latest_cards = {}, {}
+    for event in sorted(events, key=lambda e: (e.payload.get("created", 0), e.id)):
+        if event.event_type in HANDLED_EVENTS:
+            latest[event.payload["data"]["object"]["id"]] = event
+        elif event.event_type in CARD_SAVED_EVENTS or event.event_type == CARD_REMOVED:
+            latest_cards[event.payload["data"]["object"]["id"]] = event
+
+    if latest_cards:
+        removed = [pm_id for pm_id, event in latest_cards.items() if event.event_type == CARD_REMOVED]
+        SavedPaymentMethod.objects.filter(stripe_payment_method_id__in=removed).delete()
+        save_payment_methods([
+            event.payload["data"]["object"] for event in latest_cards.values() if event.event_type != CARD_REMOVED
+        ])
+    if not latest:
+        return {}
+
+    now = timezone.now()
+    payments = {
+        payment.transaction_id: payment
+        for payment in Payment.objects.select_for_update().filter(transaction_id__in=latest)
+    }
+    errors = {}
+    changed_payments, new_payments, paid_orders = [], [], []
+    completed, failed = [], []
+
+    # Payments Stripe knows about but we don't (created outside our checkout)
+    missing = {
+        intent_id: event for intent_id, event in latest.items()
+        if intent_id not in payments and event.event_type == PAYMENT_SUCCEEDED
+    }
+    orders = Order.objects.select_for_update().filter(
+        id__in=[_metadata_order_id(event) for event in missing.values() if _metadata_order_id(event)],
+        payment__isnull=True,
+    ).in_bulk()
+
+    for intent_id, event in latest.items():
+        intent = event.payload["data"]["object"]
+        payment = payments.get(intent_id)
+
+        if payment is None:
+            order = orders.get(_metadata_order_id(event)) if event.event_type == PAYMENT_SUCCEEDED else None
+            if order is None:
+                errors[event.id] = str(PaymentNotFound(f"Payment not found: {intent_id}"))
+                continue
+            payment = Payment(
+                order=order,
+                amount=intent["amount"] / 100,  # Convert from cents
+                payment_method="card",
+                status="completed",
+                transaction_id=intent_id,
+                paid_at=now,
+            )
+            new_payments.append(payment)
+            paid_orders.append(order.id)
+            continue
+
+        if event.event_type == PAYMENT_SUCCEEDED and payment.status != "completed":
+            payment.status = "completed"
+            payment.paid_at = now
+            changed_payments.append(payment)
+            completed.append(payment)
+            paid_orders.append(payment.order_id)
+        elif event.event_type == PAYMENT_FAILED and payment.status == "pending":
+            payment.status = "failed"
+            changed_payments.append(payment)
+            failed.append(payment)
+
+    Payment.objects.bulk_update(changed_payments, ["status", "paid_at"], batch_size=500)
+    Payment.objects.bulk_create(new_payments, batch_size=500)
+    # Pending orders move on to processing; others (e.g. cancelled) are left alone
+    transition_orders(paid_orders, "processing", source="webhook")
+
+    patch_payment_snapshots(changed_payments + new_payments)
+    outbox.enqueue_many(outbox.PAYMENT_COMPLETED, [
+        {"payment_id": payment.id, "order_id": payment.order_id} for payment in completed + new_payments
+    ])
+    outbox.enqueue_many(outbox.PAYMENT_FAILED, [
+        {"payment_id": payment.id, "order_id": payment.order_id} for payment in failed
+    ])
+
+    logger.info(
+        f"Applied {len(latest)} webhook event(s): {len(completed) + len(new_payments)} completed, "
+        f"{len(failed)} failed, {len(errors)} to retry"
+    )
+    return errors
+
+
+def _metadata_order_id(event):
+    order_id = (event.payload["data"]["object"].get("metadata") or {}).get("order_id")
+    return int(order_id) if order_id and str(order_id).isdigit() else None
+
+
+def patch_payment_snapshots(payments):
+    """Only the status and payment fields changed, so patch them in the snapshots"""
+    by_order = {payment.order_id: payment for payment in payments}
+    orders = list(
+        Order.objects.filter(id__in=list(by_order), snapshot__isnull=False).only("id", "status", "snapshot")
+    )
+    for order in orders:
+        payment = by_order[order.id]
+        order.snapshot.update(
+            status=order.status,
+            payment_method=payment.payment_method,
+            payment_status=payment.status,
+            transaction_id=payment.transaction_id,
+        )
+    Order.objects.bulk_update(orders, ["snapshot"], batch_size=500)
+
+
+def save_payment_methods(payment_methods):
+    """
+    Upsert Stripe card PaymentMethods (dicts) into the local cache, matching
+    them to users by ``stripe_customer_id``. Cards of unknown customers are
+    skipped.
+    """
+    payment_methods = [pm for pm in payment_methods if pm.get("customer") and pm.get("card")]
+    users = User.objects.filter(
+        stripe_customer_id__in={pm["customer"] for pm in payment_methods}
+    ).in_bulk(field_name="stripe_customer_id")
+    cards = [
+        SavedPaymentMethod(
+            user=users[pm["customer"]],
+            stripe_payment_method_id=pm["id"],
+            brand=pm["card"].get("brand") or "",
+            last4=pm["card"].get("last4") or "",
+            exp_month=pm["card"].get("exp_month"),
+            exp_year=pm["card"].get("exp_year"),
+        )
+        for pm in payment_methods if pm["customer"] in users
+    ]
+    SavedPaymentMethod.objects.bulk_create(
+        cards,
+        update_conflicts=True,
+        unique_fields=["stripe_payment_method_id"],
+        update_fields=["user", "brand", "last4", "exp_month", "exp_year"],
+        batch_size=500,
+    )
+    return len(cards)
@@ -956,6 +956,11 @@ export const changePassword = async (passwordData) => {
       const data = await res.json();
 
       if (res.ok) {
+        // The old tokens are revoked with the password change; keep the new pair
+        if (data.access && data.refresh) {
+          localStorage.setItem("accessToken", data.access);
+          localStorage.setItem("refreshToken", data.refresh);
+        }
         return { 
           success: true, 
           message: data.message || "Password changed successfully!" 
@@ -1305,7 +1310,7 @@ export const createOrder = async (orderData) => {
 // apis.js - Add server test function
 export const testServerConnection = async () => {
   try {
-    const response = await fetch(`${API_BASE}debug/`);
+    const response = await fetch(`${API_BASE}stripe-config/`);
     const data = await response.json();
     console.log("Server connection test:", data);
     return { success: true, data };